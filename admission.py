@@ -0,0 +1,192 @@
+# Tệp: admission.py
+# Mục đích: Kiểm soát tải (admission control) cho các endpoint công khai
+#
+# - Token bucket theo từng client (IP) cho mỗi nhóm route => 429 khi spam
+# - Giới hạn số request đồng thời theo nhóm route => 503 nhanh thay vì xếp hàng chờ pool DB
+# - Ưu tiên đặt đơn: "quote" (/orders/calculate) và "menu" không được dùng
+#   phần kết nối DB dành riêng cho "order" (POST /orders)
+# - Menu đọc từ bản sao (replica.py) khi bản sao dùng được => kiểm tra pool của bản sao, không phải DB chính
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from starlette.responses import JSONResponse
+import models
+import replica
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+class RouteClass:
+    """Cấu hình 1 nhóm route: rate limit theo client + giới hạn đồng thời"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int,
+                 queue_deadline: float, yields_to_orders: bool, reads_replica: bool = False):
+        self.name = name
+        self.rate = rate                      # token / giây cho mỗi client
+        self.burst = burst                    # dung lượng bucket
+        self.max_concurrency = max_concurrency
+        self.queue_deadline = queue_deadline  # chờ slot tối đa (giây) rồi trả 503
+        self.yields_to_orders = yields_to_orders
+        self.reads_replica = reads_replica    # Endpoint dùng replica.get_read_db
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_rate = 0     # 429
+        self.rejected_overload = 0 # 503
+
+
+# Capacity của pool DB (xem models.py) và phần giữ riêng cho đặt đơn
+POOL_CAPACITY = models.DB_POOL_SIZE + models.DB_MAX_OVERFLOW
+READ_POOL_CAPACITY = models.READ_DB_POOL_SIZE + models.READ_DB_MAX_OVERFLOW
+RESERVED_FOR_ORDERS = int(os.getenv("ADMISSION_RESERVED_FOR_ORDERS", str(max(1, POOL_CAPACITY // 5))))
+
+ROUTE_CLASSES = {
+    ("POST", "/orders"): RouteClass(
+        "order",
+        rate=_env_float("ADMISSION_ORDER_RATE", 0.5), burst=_env_float("ADMISSION_ORDER_BURST", 5),
+        max_concurrency=int(os.getenv("ADMISSION_ORDER_CONCURRENCY", str(POOL_CAPACITY))),
+        queue_deadline=_env_float("ADMISSION_ORDER_DEADLINE", 2.0), yields_to_orders=False,
+    ),
+    ("POST", "/orders/calculate"): RouteClass(
+        "quote",
+        rate=_env_float("ADMISSION_QUOTE_RATE", 5), burst=_env_float("ADMISSION_QUOTE_BURST", 20),
+        max_concurrency=int(os.getenv("ADMISSION_QUOTE_CONCURRENCY", str(max(1, POOL_CAPACITY // 3)))),
+        queue_deadline=_env_float("ADMISSION_QUOTE_DEADLINE", 0.2), yields_to_orders=True,
+    ),
+    ("GET", "/menu"): RouteClass(
+        "menu",
+        rate=_env_float("ADMISSION_MENU_RATE", 5), burst=_env_float("ADMISSION_MENU_BURST", 20),
+        max_concurrency=int(os.getenv("ADMISSION_MENU_CONCURRENCY", str(max(1, POOL_CAPACITY // 3)))),
+        queue_deadline=_env_float("ADMISSION_MENU_DEADLINE", 0.5), yields_to_orders=True, reads_replica=True,
+    ),
+    # Gọi theo từng phím gõ => rate cao hơn menu; thường chỉ đọc bộ nhớ (chỉ mục dựng từ menu đã cache)
+    ("GET", "/menu/search"): RouteClass(
+        "search",
+        rate=_env_float("ADMISSION_SEARCH_RATE", 10), burst=_env_float("ADMISSION_SEARCH_BURST", 40),
+        max_concurrency=int(os.getenv("ADMISSION_SEARCH_CONCURRENCY", str(max(1, POOL_CAPACITY // 3)))),
+        queue_deadline=_env_float("ADMISSION_SEARCH_DEADLINE", 0.2), yields_to_orders=True, reads_replica=True,
+    ),
+}
+
+# Chỉ tin X-Forwarded-For khi chạy sau reverse proxy của mình. Phần bên trái header do client tự gửi
+# (giả được) => lấy địa chỉ do proxy của mình thêm vào: hop thứ ADMISSION_TRUSTED_PROXY_HOPS tính từ phải
+TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED", "0") == "1"
+TRUSTED_PROXY_HOPS = max(1, int(os.getenv("ADMISSION_TRUSTED_PROXY_HOPS", "1")))
+MAX_TRACKED_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "50000"))
+
+
+class TokenBuckets:
+    """Token bucket theo (nhóm route, client), LRU có giới hạn để không phình bộ nhớ"""
+
+    def __init__(self, max_clients: int, clock=time.monotonic):
+        self.max_clients = max_clients
+        self.clock = clock
+        self._buckets = OrderedDict()  # (class, client) -> [tokens, lần cập nhật]
+
+    def take(self, route_class: RouteClass, client: str):
+        """Trả về 0 nếu được phép, hoặc số giây nên chờ trước khi thử lại"""
+        now = self.clock()
+        key = (route_class.name, client)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [route_class.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(route_class.burst, bucket[0] + (now - bucket[1]) * route_class.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        return (1 - bucket[0]) / route_class.rate
+
+
+def _client_key(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        hops = [hop.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+                for hop in value.decode("latin-1").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _pool_nearly_exhausted(route_class: RouteClass) -> bool:
+    """
+    Pool sẽ phục vụ request này gần cạn => 503 ngay
+    - DB chính: còn ít hơn RESERVED_FOR_ORDERS kết nối rảnh => nhường cho đặt đơn
+    - Bản sao: hết kết nối rảnh (đặt đơn không dùng bản sao, không cần giữ phần)
+    """
+    if route_class.reads_replica:
+        engine = replica.router.serving_engine()
+        if engine is not models.engine:
+            return engine.pool.checkedout() >= READ_POOL_CAPACITY
+    return models.engine.pool.checkedout() >= POOL_CAPACITY - RESERVED_FOR_ORDERS
+
+
+def _reject(status_code: int, detail: str, retry_after: float):
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+    )
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware: từ chối sớm (429/503) thay vì để request xếp hàng chờ pool DB rồi timeout"""
+
+    def __init__(self, app):
+        self.app = app
+        self.buckets = TokenBuckets(MAX_TRACKED_CLIENTS)
+
+    async def __call__(self, scope, receive, send):
+        route_class = ROUTE_CLASSES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.buckets.take(route_class, _client_key(scope))
+        if retry_after:
+            route_class.rejected_rate += 1
+            await _reject(429, "Quá nhiều yêu cầu, vui lòng thử lại sau giây lát.", retry_after)(scope, receive, send)
+            return
+
+        if route_class.yields_to_orders and _pool_nearly_exhausted(route_class):
+            route_class.rejected_overload += 1
+            await _reject(503, "Hệ thống đang bận, vui lòng thử lại.", 1)(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(route_class.semaphore.acquire(), timeout=route_class.queue_deadline)
+        except asyncio.TimeoutError:
+            route_class.rejected_overload += 1
+            await _reject(503, "Hệ thống đang bận, vui lòng thử lại.", 1)(scope, receive, send)
+            return
+
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.in_flight -= 1
+            route_class.semaphore.release()
+
+
+def stats():
+    """Số liệu hiện tại của từng nhóm route (để theo dõi)"""
+    return {
+        route_class.name: {
+            "in_flight": route_class.in_flight,
+            "max_concurrency": route_class.max_concurrency,
+            "admitted": route_class.admitted,
+            "rejected_rate": route_class.rejected_rate,
+            "rejected_overload": route_class.rejected_overload,
+        }
+        for route_class in ROUTE_CLASSES.values()
+    }
@@ -0,0 +1,174 @@
+# Tệp: app_logging.py
+# Mục đích: Log có cấu trúc (JSON, mỗi dòng 1 bản ghi) không chặn request
+#
+# - Request chỉ đẩy bản ghi vào hàng đợi (QueueHandler); 1 thread nền format + ghi ra stderr
+# - Hàng đợi đầy thì bỏ bản ghi và đếm (dropped) thay vì làm chậm request
+# - Mức log theo logger:  LOG_LEVEL=INFO  LOG_LEVELS="websocket_manager=DEBUG,sqlalchemy.engine=WARNING"
+# - Lấy mẫu sự kiện dày (chỉ DEBUG/INFO, WARNING trở lên luôn ghi):
+#       LOG_SAMPLING="websocket_manager=0.1"  => giữ 1/10 bản ghi, bản ghi có thêm "sample_rate": 10
+# - LOG_FORMAT=text cho người đọc (chạy script tay), mặc định json
+#
+# Dùng: logger = logging.getLogger(__name__)
+#       logger.info("Đã tạo đơn #%s", order.id, extra={"order_id": order.id, "store_id": order.store_id})
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Thuộc tính sẵn có của LogRecord; còn lại (truyền qua extra=) là trường có cấu trúc
+_RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+
+def _parse_pairs(spec: str) -> dict:
+    """"a=1,b=2" -> {"a": "1", "b": "2"}"""
+    pairs = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text: # Đã được DroppingQueueHandler.prepare chốt sẵn
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Giữ 1 trên N bản ghi DEBUG/INFO của các logger được cấu hình (đếm, không random)"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if 0 < rate < 1}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _every_for(self, logger_name: str) -> int:
+        name = logger_name
+        while name:
+            if name in self.every:
+                return self.every[name]
+            name = name.rpartition(".")[0]
+        return 1
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        every = self._every_for(record.name)
+        if every == 1:
+            return True
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        if count % every:
+            return False
+        record.sample_rate = every
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không chờ khi hàng đợi đầy"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Giữ nguyên record (kể cả extra=) cho JsonFormatter; chỉ chốt message/exception
+        # để thread ghi không phải đụng tới đối tượng của request
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_handler = None
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    output = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "text":
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop() # Ghi nốt các bản ghi còn trong hàng đợi
+        _listener = None
+
+
+def _after_fork_in_child():
+    # Thread ghi log không đi theo qua fork (gunicorn preload_app) => mỗi worker tự mở lại
+    if _handler is not None:
+        _handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _start_listener()
+
+
+def configure():
+    """Gắn handler vào root logger (gọi nhiều lần cũng chỉ cấu hình 1 lần)"""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter({name: float(rate) for name, rate in _parse_pairs(LOG_SAMPLING).items()}))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+    _start_listener()
+    atexit.register(_stop_listener)
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
+
+
+configure()
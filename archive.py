@@ -0,0 +1,91 @@
+# Tệp: archive.py
+# Mục đích: Chuyển đơn hàng cũ đã HOAN_TAT / DA_HUY sang bảng lưu trữ (archive)
+#           để các bảng "nóng" (orders, order_items, order_item_options) luôn nhỏ
+#
+# Chạy định kỳ (cron):  python archive.py [--days 90] [--batch-size 500]
+
+import logging
+import os
+import argparse
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+import models
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVABLE_STATUSES = (models.OrderStatus.HOAN_TAT, models.OrderStatus.DA_HUY)
+
+# (bảng nóng, bảng archive) theo thứ tự cha -> con
+_TABLE_PAIRS = (
+    (models.Order, models.ArchivedOrder),
+    (models.OrderItem, models.ArchivedOrderItem),
+    (models.OrderItemOption, models.ArchivedOrderItemOption),
+)
+
+
+def _copy_rows(db: Session, hot_model, archive_model, where_clause):
+    """INSERT INTO <archive> (cột...) SELECT cột... FROM <nóng> WHERE ..."""
+    hot_table = hot_model.__table__
+    columns = [column.name for column in hot_table.columns]
+    db.execute(insert(archive_model.__table__).from_select(
+        columns, select(*[hot_table.c[name] for name in columns]).where(where_clause)
+    ))
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Chuyển 1 lô đơn (1 transaction). Trả về số đơn đã chuyển"""
+    order_ids = db.execute(
+        select(models.Order.id).where(
+            models.Order.status.in_(ARCHIVABLE_STATUSES),
+            models.Order.created_at < cutoff,
+        ).order_by(models.Order.id).limit(batch_size)
+        .with_for_update(skip_locked=True) # Bỏ qua đơn đang bị admin cập nhật
+    ).scalars().all()
+    if not order_ids:
+        db.rollback()
+        return 0
+
+    item_ids = select(models.OrderItem.id).where(models.OrderItem.order_id.in_(order_ids))
+    conditions = {
+        models.Order: models.Order.id.in_(order_ids),
+        models.OrderItem: models.OrderItem.order_id.in_(order_ids),
+        models.OrderItemOption: models.OrderItemOption.order_item_id.in_(item_ids),
+    }
+
+    for hot_model, archive_model in _TABLE_PAIRS:
+        _copy_rows(db, hot_model, archive_model, conditions[hot_model])
+    for hot_model, _ in reversed(_TABLE_PAIRS): # Xóa con trước, cha sau
+        db.execute(delete(hot_model).where(conditions[hot_model]).execution_options(synchronize_session=False))
+
+    db.commit()
+    return len(order_ids)
+
+
+def archive_orders(db: Session, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Chuyển tất cả đơn đủ điều kiện, theo từng lô nhỏ để không khóa bảng lâu"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        moved = archive_batch(db, cutoff, batch_size)
+        if not moved:
+            return total
+        total += moved
+        logger.info("Đã lưu trữ %s đơn hàng...", total, extra={"archived": total})
+
+
+if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
+    parser = argparse.ArgumentParser(description="Lưu trữ đơn hàng cũ đã hoàn tất / đã hủy")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Chỉ lưu trữ đơn cũ hơn N ngày")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="Số đơn mỗi transaction")
+    args = parser.parse_args()
+
+    db = models.SessionLocal()
+    try:
+        total = archive_orders(db, args.days, args.batch_size)
+    finally:
+        db.close()
+    logger.info("Hoàn tất: đã lưu trữ %s đơn hàng cũ hơn %s ngày.", total, args.days, extra={"archived": total})
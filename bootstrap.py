@@ -0,0 +1,180 @@
+# Tệp: bootstrap.py
+# Mục đích: Khởi động container trong 1 process duy nhất:
+#           nạp snapshot menu -> migrate schema (chỉ khi cần) -> seed (chỉ lần đầu) -> chạy Uvicorn
+#           (thay cho chuỗi wait-for-db.py, models.py, seed.py, uvicorn = 4 lần khởi động Python)
+#
+# CSDL chưa lên lúc khởi động: KHÔNG chờ. Server vẫn chạy (menu phục vụ từ snapshot, X-Menu-Stale),
+# mỗi worker thử kết nối + migrate lại ở nền mỗi DB_WAIT_INTERVAL giây (prepare_in_background)
+#
+# WEB_CONCURRENCY > 1: Gunicorn nạp app 1 lần (preload) rồi fork N worker Uvicorn.
+# Cache trong bộ nhớ mỗi worker đồng bộ qua bảng cache_versions (cache.py),
+# thông báo WebSocket đi qua LISTEN/NOTIFY (event_bus.py).
+
+import logging
+import os
+import sys
+import time
+import threading
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+import models
+import migrations
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+DB_WAIT_RETRIES = int(os.getenv("DB_WAIT_RETRIES", "30"))
+DB_WAIT_INTERVAL = float(os.getenv("DB_WAIT_INTERVAL", "2"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+_prepared = False
+_prepare_lock = threading.Lock()
+_retry_thread = None
+_process_started = time.perf_counter()
+
+
+def wait_for_db(retries: int = DB_WAIT_RETRIES, interval: float = DB_WAIT_INTERVAL):
+    """Thử kết nối CSDL cho đến khi được (hoặc hết số lần thử)"""
+    for attempt in range(1, retries + 1):
+        try:
+            with models.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except OperationalError as e:
+            logger.warning("CSDL chưa sẵn sàng (%s), đang thử lại... (Lần %s/%s)", e.orig, attempt, retries)
+            time.sleep(interval)
+    raise SystemExit(f"Lỗi: Không thể kết nối CSDL sau {retries} lần thử. Bỏ cuộc.")
+
+
+def _seed_initial_data():
+    """Admin mặc định + dữ liệu mẫu (chỉ chạy khi vừa migrate)"""
+    import crud, schemas, seed
+
+    db = models.SessionLocal()
+    try:
+        if not crud.get_admin_by_username(db, models.DEFAULT_STORE_ID, "admin"):
+            logger.info("Creating default admin (admin/admin)...")
+            crud.create_admin(db, models.DEFAULT_STORE_ID, schemas.AdminCreate(username="admin", password="admin"))
+    finally:
+        db.close()
+    seed.seed_data()
+
+
+def prepare_database(wait: bool = True):
+    """
+    Đảm bảo CSDL sẵn sàng để phục vụ (gọi nhiều lần cũng chỉ chạy 1 lần mỗi process)
+
+    Khi schema đã ở version mới nhất, bước này chỉ tốn 1 câu SELECT.
+    """
+    global _prepared
+    with _prepare_lock:
+        if _prepared:
+            return
+        if wait:
+            wait_for_db()
+        old_version, new_version = migrations.upgrade(models.engine)
+        if old_version != new_version:
+            logger.info("Schema: v%s -> v%s", old_version, new_version)
+            _seed_initial_data()
+        _prepared = True
+
+
+def try_prepare_database() -> bool:
+    """prepare_database() đúng 1 lần thử, không chờ; False nếu chưa kết nối được CSDL"""
+    try:
+        prepare_database(wait=False)
+    except OperationalError as e:
+        logger.warning("CSDL chưa sẵn sàng (%s), khởi động không chờ CSDL", e.orig)
+        return False
+    return True
+
+
+def prepare_in_background(on_ready=None):
+    """
+    Gọi trong startup của mỗi worker: CSDL chưa sẵn sàng thì thử lại ở thread nền (không chặn khởi động)
+
+    on_ready() chạy 1 lần khi CSDL sẵn sàng (ngay lập tức nếu đã sẵn sàng)
+    """
+    global _retry_thread
+    if try_prepare_database():
+        if on_ready is not None:
+            on_ready()
+        return
+    if _retry_thread is not None and _retry_thread.is_alive():
+        return
+    _retry_thread = threading.Thread(target=_prepare_until_ready, args=(on_ready,), name="db-prepare-retry", daemon=True)
+    _retry_thread.start()
+
+
+def _prepare_until_ready(on_ready):
+    attempt = 0
+    while True:
+        time.sleep(DB_WAIT_INTERVAL)
+        attempt += 1
+        try:
+            prepare_database(wait=False)
+        except OperationalError as e:
+            logger.warning("CSDL chưa sẵn sàng (%s), thử lại sau %g giây... (Lần %s)", e.orig, DB_WAIT_INTERVAL, attempt)
+            continue
+        except Exception:
+            logger.exception("Chuẩn bị CSDL thất bại, dừng thử lại")
+            return
+        logger.info("CSDL sẵn sàng sau %s lần thử lại", attempt)
+        if on_ready is not None:
+            on_ready()
+        return
+
+
+def _post_fork(server, worker):
+    # Kết nối DB mở trong process cha không được dùng chung với worker con
+    models.engine.dispose(close=False)
+
+
+def _serve_gunicorn(app, workers: int):
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{HOST}:{PORT}",
+                "workers": workers,
+                "worker_class": "uvicorn_worker.UvicornWorker",
+                "preload_app": True,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "post_fork": _post_fork,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    models.engine.dispose() # Đóng kết nối đã dùng để migrate trước khi fork
+    PreloadedApplication().run()
+
+
+def serve():
+    """Chạy Uvicorn ngay trong process này (code đã import sẵn, không khởi động lại Python)"""
+    from main import app
+
+    logger.info("App đã nạp sau %.0f ms, khởi động %s worker tại %s:%s...",
+                (time.perf_counter() - _process_started) * 1000, WEB_CONCURRENCY, HOST, PORT)
+    if WEB_CONCURRENCY > 1:
+        _serve_gunicorn(app, WEB_CONCURRENCY)
+    else:
+        import uvicorn
+        uvicorn.run(app, host=HOST, port=PORT)
+
+
+if __name__ == "__main__":
+    import app_logging # Cấu hình log trước mọi thứ khác
+    # main.py "import bootstrap" phải thấy đúng module này (cờ _prepared), không nạp bản thứ 2
+    sys.modules.setdefault("bootstrap", sys.modules[__name__])
+    logger.info("--- Bootstrap ---")
+    from cache import menu_cache
+    menu_cache.load_snapshots() # Trước khi kết nối DB: chỉ đọc file
+    if try_prepare_database():
+        logger.info("CSDL sẵn sàng sau %.0f ms", (time.perf_counter() - _process_started) * 1000)
+    serve() # Chưa sẵn sàng: startup của mỗi worker thử lại ở nền (main.on_startup)
@@ -0,0 +1,409 @@
+# Tệp: cache.py
+# Mục đích: Các bộ đệm (cache) trong bộ nhớ cho dữ liệu đọc nhiều, ghi ít
+#
+# Chạy nhiều worker (WEB_CONCURRENCY > 1): mỗi worker có cache riêng.
+# Bảng cache_versions giữ 1 bộ đếm cho mỗi nhóm dữ liệu của mỗi cửa hàng, được tăng CÙNG transaction
+# với thay đổi (sự kiện after_flush của Session). Mỗi worker đọc lại bảng này
+# tối đa 1 lần / CACHE_VERSION_CHECK_INTERVAL giây; bộ đếm đổi => bỏ cache nhóm đó.
+
+import logging
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from pydantic import TypeAdapter
+from sqlalchemy import BigInteger, event, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+import schemas
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình ---
+# TTL chỉ là "lưới an toàn" cho thay đổi ngoài app (sửa tay trong DB);
+# các thay đổi qua crud đã được ghi thẳng vào cache (write-through)
+VOUCHER_CACHE_TTL_SECONDS = float(os.getenv("VOUCHER_CACHE_TTL", "300"))
+# Giới hạn số mã SAI được nhớ, để spam mã ngẫu nhiên không làm phình bộ nhớ
+VOUCHER_NEGATIVE_CACHE_SIZE = int(os.getenv("VOUCHER_NEGATIVE_CACHE_SIZE", "10000"))
+# Độ trễ tối đa để 1 worker thấy thay đổi do worker khác ghi
+CACHE_VERSION_CHECK_INTERVAL = float(os.getenv("CACHE_VERSION_CHECK_INTERVAL", "1"))
+# Thư mục lưu menu công khai của từng cửa hàng (để khởi động "ấm" và phục vụ khi mất DB); để trống = tắt
+MENU_SNAPSHOT_DIR = os.getenv("MENU_SNAPSHOT_DIR", "data/menu_snapshots")
+
+# Model -> nhóm dữ liệu trong cache_versions. Bộ đếm tính riêng cho từng cửa hàng:
+# tên đầy đủ là "<nhóm>:<store_id>" (vd "menu:2"), riêng "stores" là bộ đếm chung
+MENU_MODELS = (models.Category, models.Product, models.Option, models.OptionValue)
+STORE_MODELS = (models.Store, models.StoreDomain)
+# Ngoài "menu", mỗi bảng danh mục có bộ đếm riêng (ETag của danh sách /admin/<nhóm>/)
+CATALOG_GROUPS = {
+    models.Category: "categories",
+    models.Product: "products",
+    models.Option: "options",
+    models.OptionValue: "options",
+}
+_PENDING_KEY = "cache_versions_pending"
+
+
+def namespace(group: str, store_id: int) -> str:
+    return f"{group}:{store_id}"
+
+
+def catalog_namespaces(store_id: int, *catalog_models) -> tuple:
+    """Bộ đếm cần tăng khi sửa hàng loạt (không qua ORM) các bảng danh mục: "menu" + nhóm của từng bảng"""
+    groups = dict.fromkeys(["menu"] + [CATALOG_GROUPS[model] for model in catalog_models])
+    return tuple(namespace(group, store_id) for group in groups)
+
+
+def _namespaces_of(obj) -> tuple:
+    if isinstance(obj, MENU_MODELS):
+        return catalog_namespaces(obj.store_id, type(obj))
+    if isinstance(obj, models.Voucher):
+        return (namespace("vouchers", obj.store_id),)
+    if isinstance(obj, STORE_MODELS):
+        return ("stores",)
+    return ()
+
+
+class CacheVersions:
+    """
+    Bộ đếm phiên bản dùng chung giữa các worker (bảng cache_versions)
+
+    - get(name): version hiện tại mà worker này biết (đọc lại DB khi quá hạn kiểm tra)
+    - on_change(group, callback): gọi callback(store_id) khi bộ đếm "<group>:<store_id>" tăng
+      (callback() không tham số với nhóm chung như "stores")
+    - touch(db, *names): tăng version trong transaction của db (dùng cho UPDATE/DELETE hàng loạt
+      không đi qua ORM; thay đổi qua ORM đã được tự động ghi nhận)
+    - current(db, *names): đọc thẳng từ DB (không chờ lần kiểm tra sau), dùng cho ETag
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._checked_at = None
+        self._callbacks = {}
+        self.reachable = True # Lần đọc cache_versions gần nhất có thành công không
+
+    def get(self, name: str) -> int:
+        self._refresh_if_due()
+        return self._versions.get(name, 0)
+
+    def menu_key(self, store_id: int) -> int:
+        """Version menu công khai của 1 cửa hàng"""
+        return self.get(namespace("menu", store_id))
+
+    def on_change(self, group: str, callback):
+        self._callbacks.setdefault(group, []).append(callback)
+
+    def touch(self, db: Session, *names: str):
+        pending = db.info.setdefault(_PENDING_KEY, {})
+        for name in names:
+            if name in pending:
+                continue # Mỗi transaction chỉ tăng 1 lần cho mỗi nhóm
+            pending[name] = db.connection().execute(
+                # Bắt đầu từ mốc thời gian (ms), không phải 1: DB tạo lại từ đầu không trùng
+                # version với file snapshot menu còn sót từ DB cũ
+                insert(models.CacheVersion).values(name=name, version=_version_epoch())
+                .on_conflict_do_update(index_elements=["name"], set_={"version": models.CacheVersion.version + 1})
+                .returning(models.CacheVersion.version)
+            ).scalar()
+
+    def current(self, db: Session, *names: str) -> List[int]:
+        """Version mới nhất trong DB của các bộ đếm (1 truy vấn theo khóa chính)"""
+        rows = dict(db.execute(
+            select(models.CacheVersion.name, models.CacheVersion.version).where(models.CacheVersion.name.in_(names))
+        ).all())
+        self._apply(rows)
+        return [rows.get(name, 0) for name in names]
+
+    def _refresh_if_due(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            with models.engine.connect() as conn:
+                rows = conn.execute(select(models.CacheVersion.name, models.CacheVersion.version)).all()
+        except Exception as e:
+            self.reachable = False
+            logger.warning("Không đọc được cache_versions, tạm dùng cache hiện có: %s", e)
+            return
+        self.reachable = True
+        self._apply(dict(rows))
+
+    def _apply(self, versions: dict):
+        changed = []
+        with self._lock:
+            for name, version in versions.items():
+                if version > self._versions.get(name, 0):
+                    self._versions[name] = version
+                    changed.append(name)
+        for name in changed:
+            group, _, store_id = name.partition(":")
+            for callback in self._callbacks.get(group, ()):
+                callback(int(store_id)) if store_id else callback()
+
+
+def _version_epoch():
+    return func.floor(func.extract("epoch", func.clock_timestamp()) * 1000).cast(BigInteger)
+
+
+cache_versions = CacheVersions(CACHE_VERSION_CHECK_INTERVAL)
+
+
+@event.listens_for(models.SessionLocal, "after_flush")
+def _bump_versions_after_flush(session, flush_context):
+    names = {name for obj in (*session.new, *session.dirty, *session.deleted) for name in _namespaces_of(obj)}
+    if names:
+        cache_versions.touch(session, *sorted(names))
+
+
+@event.listens_for(models.SessionLocal, "after_commit")
+def _apply_versions_after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        cache_versions._apply(pending) # Worker ghi thấy thay đổi ngay, không chờ lần kiểm tra sau
+
+
+@event.listens_for(models.SessionLocal, "after_rollback")
+def _discard_versions_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class VoucherCache:
+    """
+    Bảng voucher trong bộ nhớ, tra theo (store_id, code)
+
+    - Mã hợp lệ (đang active): lưu bản sao schemas.Voucher (không dính Session)
+    - Mã không hợp lệ / đã tắt: lưu "kết quả âm" (LRU có giới hạn, chung cho mọi cửa hàng)
+    - create/update/delete voucher trong crud ghi thẳng vào đây
+    """
+
+    def __init__(self, ttl_seconds: float, negative_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.negative_size = negative_size
+        self._lock = threading.Lock()
+        self._active = {}                # (store_id, code) -> (hết hạn lúc, schemas.Voucher)
+        self._invalid = OrderedDict()    # (store_id, code) -> hết hạn lúc
+        # Tăng mỗi lần ghi; kết quả đọc DB "cũ" (bắt đầu trước lần ghi) sẽ bị bỏ qua
+        self._generation = 0
+
+    def lookup(self, store_id: int, code: str):
+        """Trả về (có_trong_cache, voucher hoặc None)"""
+        key = (store_id, code)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._active.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    return True, entry[1]
+                del self._active[key]
+            expires_at = self._invalid.get(key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._invalid.move_to_end(key)
+                    return True, None
+                del self._invalid[key]
+            return False, None
+
+    @property
+    def generation(self) -> int:
+        """Đọc TRƯỚC khi truy vấn DB, rồi truyền vào store()"""
+        return self._generation
+
+    def store(self, store_id: int, code: str, db_voucher, generation: int):
+        """Lưu kết quả đọc từ DB (bỏ qua nếu đã có lần ghi xen vào giữa)"""
+        voucher = schemas.Voucher.model_validate(db_voucher) if db_voucher is not None else None
+        with self._lock:
+            if generation == self._generation:
+                self._set((store_id, code), voucher)
+        return voucher
+
+    def put(self, db_voucher):
+        """Write-through sau khi tạo/cập nhật voucher"""
+        voucher = schemas.Voucher.model_validate(db_voucher)
+        with self._lock:
+            self._generation += 1
+            self._set((db_voucher.store_id, voucher.code), voucher if voucher.is_active else None)
+
+    def mark_invalid(self, store_id: int, code: str):
+        """Write-through sau khi xóa voucher / đổi code"""
+        with self._lock:
+            self._generation += 1
+            self._set((store_id, code), None)
+
+    def clear_store(self, store_id: int):
+        """Bỏ mọi mục của 1 cửa hàng (voucher của cửa hàng đó vừa đổi ở worker khác)"""
+        with self._lock:
+            self._generation += 1
+            for entries in (self._active, self._invalid):
+                for key in [key for key in entries if key[0] == store_id]:
+                    del entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._active.clear()
+            self._invalid.clear()
+
+    def _set(self, key: tuple, voucher):
+        expires_at = time.monotonic() + self.ttl_seconds
+        if voucher is not None:
+            self._invalid.pop(key, None)
+            self._active[key] = (expires_at, voucher)
+        else:
+            self._active.pop(key, None)
+            self._invalid[key] = expires_at
+            self._invalid.move_to_end(key)
+            while len(self._invalid) > self.negative_size:
+                self._invalid.popitem(last=False)
+
+
+class MenuCache:
+    """
+    Menu công khai đã serialize sẵn (bytes JSON) của từng cửa hàng, gắn với cache_versions.menu_key(store_id)
+
+    Mỗi lần dựng lại, menu được ghi ra MENU_SNAPSHOT_DIR/<store_id>.json (ghi file tạm rồi os.replace,
+    không bao giờ để lại file dở dang). Dòng đầu của file là header JSON {"store_id": ..., "version": ...},
+    phần còn lại là đúng body trả về cho client.
+    - Khởi động: load_snapshots() nạp các file (chưa cần DB); version khớp DB thì dùng luôn
+    - DB không truy cập được: last_known() trả menu cuối cùng (đánh dấu stale)
+    """
+
+    _adapter = TypeAdapter(List[schemas.PublicCategory])
+
+    def __init__(self, snapshot_dir: str):
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.Lock()
+        self._entries = {} # store_id -> (version, body)
+        self._snapshots_loaded = False
+
+    def get(self, store_id: int, version: int):
+        with self._lock:
+            entry = self._entries.get(store_id)
+        return entry[1] if entry is not None and entry[0] == version else None
+
+    def last_known(self, store_id: int):
+        """Menu gần nhất đã có (kể cả từ snapshot), dùng khi mất DB"""
+        with self._lock:
+            entry = self._entries.get(store_id)
+        return entry[1] if entry is not None else None
+
+    def store(self, store_id: int, version: int, categories) -> bytes:
+        body = self._adapter.dump_json(self._adapter.validate_python(categories, from_attributes=True))
+        with self._lock:
+            changed = self._entries.get(store_id) != (version, body)
+            self._entries[store_id] = (version, body)
+        if changed:
+            self._write_snapshot(store_id, version, body)
+        return body
+
+    def load_snapshots(self):
+        """Nạp các snapshot từ đĩa (chỉ 1 lần mỗi process, gọi trước khi chờ DB)"""
+        if self._snapshots_loaded or not self.snapshot_dir:
+            return
+        self._snapshots_loaded = True
+        try:
+            names = sorted(name for name in os.listdir(self.snapshot_dir) if name.endswith(".json") and name[:-5].isdigit())
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.snapshot_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    header = json.loads(f.readline())
+                    body = f.read()
+                store_id, version = int(header["store_id"]), int(header["version"])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("Bỏ qua snapshot menu hỏng (%s): %s", path, e)
+                continue
+            with self._lock:
+                self._entries.setdefault(store_id, (version, body))
+        if names:
+            logger.info("Đã nạp %s snapshot menu từ %s", len(names), self.snapshot_dir)
+
+    def _write_snapshot(self, store_id: int, version: int, body: bytes):
+        if not self.snapshot_dir:
+            return
+        header = json.dumps({"store_id": store_id, "version": version, "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")})
+        path = os.path.join(self.snapshot_dir, f"{store_id}.json")
+        try:
+            atomic_write(path, header.encode("utf-8") + b"\n" + body)
+        except OSError as e:
+            logger.warning("Không ghi được snapshot menu (%s): %s", path, e)
+
+
+class OptionRules:
+    """
+    Quy tắc tùy chọn của 1 cửa hàng: món nào được chọn lựa chọn nào, nhóm nào bắt buộc chọn đúng 1
+
+    Dựng 1 lần mỗi version menu (link_product_to_options và CRUD nhóm tùy chọn / lựa chọn
+    đều làm tăng version menu) => kiểm tra giỏ hàng chỉ tra dict, không truy vấn thêm
+    """
+
+    def __init__(self, links, options, values):
+        self.options_of_product = {} # product_id -> [option_id] đã gắn với món
+        for product_id, option_id in links:
+            self.options_of_product.setdefault(product_id, []).append(option_id)
+        self.option_names = {option_id: name for option_id, name, _ in options}
+        self.option_of_value = {value_id: option_id for value_id, option_id in values}
+        # CHON_1 chỉ bắt buộc khi nhóm có ít nhất 1 lựa chọn
+        options_with_values = set(self.option_of_value.values())
+        self.single_choice = {
+            option_id for option_id, _, option_type in options
+            if option_type == models.OptionType.CHON_1 and option_id in options_with_values
+        }
+
+    def violation(self, product_id: int, option_value_ids) -> Optional[str]:
+        """Lý do giỏ hàng sai với món này, hoặc None nếu hợp lệ (O(số lựa chọn + số nhóm của món))"""
+        allowed = self.options_of_product.get(product_id, ())
+        chosen = {}
+        for value_id in option_value_ids:
+            option_id = self.option_of_value.get(value_id)
+            if option_id is None or option_id not in allowed:
+                return f"Tùy chọn ID {value_id} không áp dụng cho món này."
+            if value_id in chosen.setdefault(option_id, set()):
+                return f"Tùy chọn ID {value_id} bị chọn lặp lại."
+            chosen[option_id].add(value_id)
+        for option_id in allowed:
+            if option_id in self.single_choice and len(chosen.get(option_id, ())) != 1:
+                return f"Nhóm '{self.option_names[option_id]}' phải chọn đúng 1 lựa chọn."
+        return None
+
+
+class OptionRulesCache:
+    """OptionRules của từng cửa hàng, gắn với cache_versions.menu_key(store_id)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {} # store_id -> (version, OptionRules)
+
+    def get(self, store_id: int, version: int) -> Optional[OptionRules]:
+        with self._lock:
+            entry = self._entries.get(store_id)
+        return entry[1] if entry is not None and entry[0] == version else None
+
+    def store(self, store_id: int, version: int, rules: OptionRules) -> OptionRules:
+        with self._lock:
+            self._entries[store_id] = (version, rules)
+        return rules
+
+
+def atomic_write(path: str, data: bytes):
+    """Ghi file tạm (riêng mỗi process) rồi os.replace: người đọc không bao giờ thấy file dở dang"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+voucher_cache = VoucherCache(VOUCHER_CACHE_TTL_SECONDS, VOUCHER_NEGATIVE_CACHE_SIZE)
+cache_versions.on_change("vouchers", voucher_cache.clear_store)
+menu_cache = MenuCache(MENU_SNAPSHOT_DIR)
+option_rules_cache = OptionRulesCache()
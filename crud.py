@@ -1,47 +1,80 @@
 # Tệp: crud.py (Bản vá 1.9.1 - Sửa logic Sắp xếp)
 # Mục đích: Chứa tất cả các hàm logic nghiệp vụ (CRUD)
 
-from sqlalchemy.orm import Session, joinedload, subqueryload
-from sqlalchemy import asc, func
+import logging
+from sqlalchemy.orm import Session, joinedload, subqueryload, undefer
+from sqlalchemy import asc, func, update, values, column, Integer, select, bindparam
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from fastapi import HTTPException
 import models, schemas
 import security
-from typing import List
+import reports
+import idempotency
+import order_tracking
+import order_counters
+import side_effects
+import replica
+from cache import voucher_cache, menu_cache, option_rules_cache, OptionRules, cache_versions, namespace, catalog_namespaces
+from typing import List, Optional
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# --- Câu truy vấn dựng sẵn cho đường nóng ---
+# Dựng 1 lần lúc import, giá trị truyền qua bindparam (IN dùng expanding) => mỗi lần gọi không phải dựng lại
+# Query ORM + tính cache key; SQLAlchemy dùng lại SQL đã biên dịch. Đo: python crud_bench.py
+_ADMIN_BY_USERNAME = select(models.Admin).where(
+    models.Admin.store_id == bindparam("store_id"), models.Admin.username == bindparam("username")
+).limit(1)
+_ACTIVE_VOUCHER_BY_CODE = select(models.Voucher).where(
+    models.Voucher.store_id == bindparam("store_id"), models.Voucher.code == bindparam("code"), models.Voucher.is_active == True
+).limit(1)
+_PRODUCTS_BY_IDS = select(models.Product).where(
+    models.Product.store_id == bindparam("store_id"), models.Product.id.in_(bindparam("ids", expanding=True))
+)
+_OPTION_VALUES_BY_IDS = select(models.OptionValue).where(
+    models.OptionValue.store_id == bindparam("store_id"), models.OptionValue.id.in_(bindparam("ids", expanding=True))
+)
+_OPTION_VALUES_WITH_OPTION_BY_IDS = _OPTION_VALUES_BY_IDS.options(joinedload(models.OptionValue.option))
+_PUBLIC_MENU = select(models.Category).options(
+    # Việc sắp xếp products đã được chuyển vào models.py (Bản vá 1.9.1)
+    subqueryload(models.Category.products).subqueryload(models.Product.options).joinedload(models.Option.values) # Tải values cho option
+).where(models.Category.store_id == bindparam("store_id")).order_by(models.Category.display_order)
 
 # --- Nghiệp vụ Admin ---
-def get_admin_by_username(db: Session, username: str):
-    """Tìm admin theo username"""
-    return db.query(models.Admin).filter(models.Admin.username == username).first()
+def get_admin_by_username(db: Session, store_id: int, username: str):
+    """Tìm admin theo username (trong 1 cửa hàng)"""
+    return db.execute(_ADMIN_BY_USERNAME, {"store_id": store_id, "username": username}).scalars().first()
 
-def create_admin(db: Session, admin: schemas.AdminCreate):
+def create_admin(db: Session, store_id: int, admin: schemas.AdminCreate):
     """Tạo Admin mới với mật khẩu đã được "băm" (hash)"""
     hashed_password = security.get_password_hash(admin.password)
-    db_admin = models.Admin(username=admin.username, hashed_password=hashed_password)
+    db_admin = models.Admin(store_id=store_id, username=admin.username, hashed_password=hashed_password)
     db.add(db_admin)
     db.commit()
     db.refresh(db_admin)
     return db_admin
 
 # --- Nghiệp vụ Danh mục (Category) ---
-def get_category(db: Session, category_id: int):
+def get_category(db: Session, store_id: int, category_id: int):
     """Tìm 1 danh mục theo ID"""
-    return db.query(models.Category).filter(models.Category.id == category_id).first()
+    return db.query(models.Category).filter(models.Category.store_id == store_id, models.Category.id == category_id).first()
 
-def get_categories(db: Session, skip: int = 0, limit: int = 100):
+def get_categories(db: Session, store_id: int, skip: int = 0, limit: int = 100):
     """Lấy danh sách tất cả danh mục, sắp xếp theo display_order"""
-    return db.query(models.Category).order_by(models.Category.display_order).offset(skip).limit(limit).all()
+    return db.query(models.Category).filter(models.Category.store_id == store_id).order_by(models.Category.display_order).offset(skip).limit(limit).all()
 
-def create_category(db: Session, category: schemas.CategoryCreate):
+def create_category(db: Session, store_id: int, category: schemas.CategoryCreate):
     """Tạo danh mục mới"""
-    db_category = models.Category(name=category.name, display_order=category.display_order)
+    db_category = models.Category(store_id=store_id, name=category.name, display_order=category.display_order)
     db.add(db_category)
     db.commit()
     db.refresh(db_category)
     return db_category
 
-def update_category(db: Session, category_id: int, category: schemas.CategoryUpdate):
+def update_category(db: Session, store_id: int, category_id: int, category: schemas.CategoryUpdate):
     """Cập nhật thông tin danh mục"""
-    db_category = get_category(db, category_id)
+    db_category = get_category(db, store_id, category_id)
     if not db_category:
         return None
     update_data = category.model_dump(exclude_unset=True) # Dùng model_dump cho Pydantic V2
@@ -51,9 +84,9 @@ def update_category(db: Session, category_id: int, category: schemas.CategoryUpd
     db.refresh(db_category)
     return db_category
 
-def delete_category(db: Session, category_id: int):
+def delete_category(db: Session, store_id: int, category_id: int):
     """Xóa một danh mục"""
-    db_category = get_category(db, category_id)
+    db_category = get_category(db, store_id, category_id)
     if not db_category:
         return None
     db.delete(db_category)
@@ -61,11 +94,11 @@ def delete_category(db: Session, category_id: int):
     return db_category
 
 # --- Nghiệp vụ Sản phẩm (Product) ---
-def get_product(db: Session, product_id: int):
+def get_product(db: Session, store_id: int, product_id: int):
     """Lấy 1 sản phẩm CỤ THỂ bằng ID, kèm tùy chọn đã sắp xếp"""
     product = db.query(models.Product).options(
         joinedload(models.Product.options).subqueryload(models.Option.values)
-    ).filter(models.Product.id == product_id).first()
+    ).filter(models.Product.store_id == store_id, models.Product.id == product_id).first()
 
     # Sắp xếp options sau khi lấy ra
     if product and product.options:
@@ -73,11 +106,12 @@ def get_product(db: Session, product_id: int):
     return product
 
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
+def get_products(db: Session, store_id: int, skip: int = 0, limit: int = 100):
     """Lấy danh sách TẤT CẢ sản phẩm, kèm tùy chọn"""
     products = db.query(models.Product).options(
-        joinedload(models.Product.options) # Tải các Nhóm Tùy chọn
-    ).order_by(models.Product.category_id, models.Product.display_order).offset(skip).limit(limit).all() # Sắp xếp
+        # Tải các Nhóm Tùy chọn + values (schemas.Product trả về cả options[].values, tránh N+1)
+        joinedload(models.Product.options).subqueryload(models.Option.values)
+    ).filter(models.Product.store_id == store_id).order_by(models.Product.category_id, models.Product.display_order).offset(skip).limit(limit).all() # Sắp xếp
 
     # Sắp xếp options cho từng product
     for product in products:
@@ -86,24 +120,26 @@ def get_products(db: Session, skip: int = 0, limit: int = 100):
 
     return products
 
-def create_product(db: Session, product: schemas.ProductCreate):
+def create_product(db: Session, store_id: int, product: schemas.ProductCreate):
     """Tạo sản phẩm mới và gắn nó vào một danh mục"""
     
     # Tìm max display_order TRONG DANH MỤC ĐÓ
-    max_order = db.query(func.max(models.Product.display_order)).filter(models.Product.category_id == product.category_id).scalar() or 0
+    max_order = db.query(func.max(models.Product.display_order)).filter(
+        models.Product.store_id == store_id, models.Product.category_id == product.category_id
+    ).scalar() or 0
     
     # Dùng model_dump(exclude) để không ghi đè display_order
     product_data = product.model_dump(exclude={"display_order"})
-    db_product = models.Product(**product_data, display_order=max_order + 1)
+    db_product = models.Product(**product_data, store_id=store_id, display_order=max_order + 1)
     
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
     return db_product
 
-def update_product(db: Session, product_id: int, product: schemas.ProductUpdate):
+def update_product(db: Session, store_id: int, product_id: int, product: schemas.ProductUpdate):
     """Cập nhật thông tin sản phẩm"""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first() # Lấy object gốc để update
+    db_product = db.query(models.Product).filter(models.Product.store_id == store_id, models.Product.id == product_id).first() # Lấy object gốc để update
     if not db_product:
         return None
     update_data = product.model_dump(exclude_unset=True) # Dùng model_dump cho Pydantic V2
@@ -112,11 +148,11 @@ def update_product(db: Session, product_id: int, product: schemas.ProductUpdate)
     db.commit()
     db.refresh(db_product)
     # Lấy lại product với options đã load để trả về (để response_model khớp)
-    return get_product(db, product_id)
+    return get_product(db, store_id, product_id)
 
-def delete_product(db: Session, product_id: int):
+def delete_product(db: Session, store_id: int, product_id: int):
     """Xóa một sản phẩm"""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first() # Chỉ cần lấy product để xóa
+    db_product = db.query(models.Product).filter(models.Product.store_id == store_id, models.Product.id == product_id).first() # Chỉ cần lấy product để xóa
     if not db_product:
         return None
     deleted_copy = schemas.Product.model_validate(db_product) # Tạo bản copy trước khi xóa để trả về
@@ -124,42 +160,42 @@ def delete_product(db: Session, product_id: int):
     db.commit()
     return deleted_copy # Trả về bản copy
 
-def link_product_to_options(db: Session, product_id: int, option_ids: List[int]):
+def link_product_to_options(db: Session, store_id: int, product_id: int, option_ids: List[int]):
     """Gắn các Nhóm Tùy chọn vào Sản phẩm"""
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    db_product = db.query(models.Product).filter(models.Product.store_id == store_id, models.Product.id == product_id).first()
     if not db_product:
         return None
 
-    # Lấy các đối tượng Option từ DB theo ID
-    db_options = db.query(models.Option).filter(models.Option.id.in_(option_ids)).all()
+    # Lấy các đối tượng Option từ DB theo ID (chỉ của cùng cửa hàng)
+    db_options = db.query(models.Option).filter(models.Option.store_id == store_id, models.Option.id.in_(option_ids)).all()
     db_product.options = db_options # Gán trực tiếp list các object Option
     db.commit()
     
     # Lấy lại product với options đã load để trả về
-    return get_product(db, product_id)
+    return get_product(db, store_id, product_id)
 
 # --- Nghiệp vụ Nhóm Tùy chọn (Option) ---
-def get_option(db: Session, option_id: int):
+def get_option(db: Session, store_id: int, option_id: int):
     """Tìm 1 Nhóm Tùy chọn theo ID"""
-    return db.query(models.Option).filter(models.Option.id == option_id).first()
+    return db.query(models.Option).filter(models.Option.store_id == store_id, models.Option.id == option_id).first()
 
-def create_option(db: Session, option: schemas.OptionCreate):
+def create_option(db: Session, store_id: int, option: schemas.OptionCreate):
     """Tạo một Nhóm Tùy chọn mới (Vd: Topping)"""
-    db_option = models.Option(name=option.name, type=option.type, display_order=option.display_order)
+    db_option = models.Option(store_id=store_id, name=option.name, type=option.type, display_order=option.display_order)
     db.add(db_option)
     db.commit()
     db.refresh(db_option)
     return db_option
 
-def get_options(db: Session, skip: int = 0, limit: int = 100):
+def get_options(db: Session, store_id: int, skip: int = 0, limit: int = 100):
     """Lấy TẤT CẢ các nhóm tùy chọn, kèm lựa chọn con, sắp xếp theo display_order"""
     return db.query(models.Option).options(
         joinedload(models.Option.values) # Tải luôn các values
-    ).order_by(models.Option.display_order).offset(skip).limit(limit).all() # Sắp xếp
+    ).filter(models.Option.store_id == store_id).order_by(models.Option.display_order).offset(skip).limit(limit).all() # Sắp xếp
 
-def delete_option(db: Session, option_id: int):
+def delete_option(db: Session, store_id: int, option_id: int):
     """Xóa một Nhóm Tùy chọn (và các lựa chọn con bên trong)"""
-    db_option = get_option(db, option_id)
+    db_option = get_option(db, store_id, option_id)
     if not db_option:
         return None
     deleted_copy = schemas.Option.model_validate(db_option) # Tạo bản copy trước khi xóa
@@ -167,9 +203,9 @@ def delete_option(db: Session, option_id: int):
     db.commit()
     return deleted_copy
 
-def update_option(db: Session, option_id: int, option: schemas.OptionUpdate):
+def update_option(db: Session, store_id: int, option_id: int, option: schemas.OptionUpdate):
     """Cập nhật thông tin Nhóm Tùy chọn (name, type, display_order)"""
-    db_option = get_option(db, option_id)
+    db_option = get_option(db, store_id, option_id)
     if not db_option:
         return None
     update_data = option.model_dump(exclude_unset=True)
@@ -180,21 +216,21 @@ def update_option(db: Session, option_id: int, option: schemas.OptionUpdate):
     return db_option
 
 # --- Nghiệp vụ Lựa chọn con (OptionValue) ---
-def get_option_value(db: Session, value_id: int):
+def get_option_value(db: Session, store_id: int, value_id: int):
     """Tìm 1 Lựa chọn con theo ID"""
-    return db.query(models.OptionValue).filter(models.OptionValue.id == value_id).first()
+    return db.query(models.OptionValue).filter(models.OptionValue.store_id == store_id, models.OptionValue.id == value_id).first()
 
-def create_option_value(db: Session, option_value: schemas.OptionValueCreate, option_id: int):
+def create_option_value(db: Session, store_id: int, option_value: schemas.OptionValueCreate, option_id: int):
     """Tạo một Lựa chọn con (Vd: Trân châu) và gắn vào Nhóm (Vd: Topping)"""
-    db_value = models.OptionValue(**option_value.model_dump(), option_id=option_id) # Dùng model_dump
+    db_value = models.OptionValue(**option_value.model_dump(), store_id=store_id, option_id=option_id) # Dùng model_dump
     db.add(db_value)
     db.commit()
     db.refresh(db_value)
     return db_value
 
-def delete_option_value(db: Session, value_id: int):
+def delete_option_value(db: Session, store_id: int, value_id: int):
     """Xóa một Lựa chọn con"""
-    db_value = get_option_value(db, value_id)
+    db_value = get_option_value(db, store_id, value_id)
     if not db_value:
         return None
     deleted_copy = schemas.OptionValue.model_validate(db_value) # Tạo bản copy
@@ -202,9 +238,9 @@ def delete_option_value(db: Session, value_id: int):
     db.commit()
     return deleted_copy
 
-def update_option_value(db: Session, value_id: int, option_value: schemas.OptionValueUpdate):
+def update_option_value(db: Session, store_id: int, value_id: int, option_value: schemas.OptionValueUpdate):
     """Cập nhật Lựa chọn con (ví dụ: tên, giá, hoặc HẾT HÀNG)"""
-    db_value = get_option_value(db, value_id)
+    db_value = get_option_value(db, store_id, value_id)
     if not db_value:
         return None
     update_data = option_value.model_dump(exclude_unset=True)
@@ -214,57 +250,101 @@ def update_option_value(db: Session, value_id: int, option_value: schemas.Option
     db.refresh(db_value)
     return db_value
 
+# --- Sắp xếp hàng loạt (kéo-thả) ---
+def _reorder(db: Session, store_id: int, model, ids: List[int], *filters):
+    """Gán display_order = vị trí trong ids (1, 2, ...) bằng 1 câu UPDATE ... FROM (VALUES ...)"""
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate IDs in order list")
+    if not ids:
+        return []
+    new_order = values(column("id", Integer), column("display_order", Integer), name="new_order").data(
+        [(item_id, position) for position, item_id in enumerate(ids, start=1)]
+    )
+    updated_ids = set(db.execute(
+        update(model)
+        .where(model.id == new_order.c.id, model.store_id == store_id, *filters)
+        .values(display_order=new_order.c.display_order)
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    missing = [item_id for item_id in ids if item_id not in updated_ids]
+    if missing:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"IDs not found: {missing}")
+    # UPDATE hàng loạt không qua flush của ORM => tự tăng version menu + bảng này (1 lần)
+    cache_versions.touch(db, *catalog_namespaces(store_id, model))
+    db.commit()
+    return [{"id": item_id, "display_order": position} for position, item_id in enumerate(ids, start=1)]
+
+def reorder_categories(db: Session, store_id: int, ids: List[int]):
+    return _reorder(db, store_id, models.Category, ids)
+
+def reorder_products(db: Session, store_id: int, category_id: int, ids: List[int]):
+    """Chỉ sắp xếp món TRONG danh mục category_id"""
+    return _reorder(db, store_id, models.Product, ids, models.Product.category_id == category_id)
+
+def reorder_options(db: Session, store_id: int, ids: List[int]):
+    return _reorder(db, store_id, models.Option, ids)
+
 # --- Nghiệp vụ Voucher ---
-def create_voucher(db: Session, voucher: schemas.VoucherCreate):
+def create_voucher(db: Session, store_id: int, voucher: schemas.VoucherCreate):
     """Tạo mã giảm giá mới"""
-    db_voucher = models.Voucher(**voucher.model_dump()) # Dùng model_dump
+    db_voucher = models.Voucher(**voucher.model_dump(), store_id=store_id) # Dùng model_dump
     db.add(db_voucher)
     db.commit()
     db.refresh(db_voucher)
+    voucher_cache.put(db_voucher) # Ghi thẳng vào cache (write-through)
     return db_voucher
 
-def get_vouchers(db: Session, skip: int = 0, limit: int = 100):
+def get_vouchers(db: Session, store_id: int, skip: int = 0, limit: int = 100):
     """Lấy tất cả mã giảm giá"""
-    return db.query(models.Voucher).offset(skip).limit(limit).all()
-
-def get_voucher_by_code(db: Session, code: str):
-    """Tìm mã giảm giá theo code (chỉ mã đang active)"""
-    return db.query(models.Voucher).filter(models.Voucher.code == code, models.Voucher.is_active == True).first()
-
-def get_voucher(db: Session, voucher_id: int):
+    return db.query(models.Voucher).filter(models.Voucher.store_id == store_id).offset(skip).limit(limit).all()
+
+def get_voucher_by_code(db: Session, store_id: int, code: str):
+    """Tìm mã giảm giá theo code (chỉ mã đang active), đọc qua voucher_cache (cả kết quả âm)"""
+    cache_versions.get(namespace("vouchers", store_id)) # Worker khác đã sửa voucher => voucher_cache tự xóa
+    found, cached_voucher = voucher_cache.lookup(store_id, code)
+    if found:
+        return cached_voucher
+    generation = voucher_cache.generation
+    db_voucher = db.execute(_ACTIVE_VOUCHER_BY_CODE, {"store_id": store_id, "code": code}).scalars().first()
+    return voucher_cache.store(store_id, code, db_voucher, generation)
+
+def get_voucher(db: Session, store_id: int, voucher_id: int):
     """Tìm voucher theo ID"""
-    return db.query(models.Voucher).filter(models.Voucher.id == voucher_id).first()
+    return db.query(models.Voucher).filter(models.Voucher.store_id == store_id, models.Voucher.id == voucher_id).first()
 
-def update_voucher(db: Session, voucher_id: int, voucher: schemas.VoucherCreate): # Tái sử dụng schema Create
+def update_voucher(db: Session, store_id: int, voucher_id: int, voucher: schemas.VoucherCreate): # Tái sử dụng schema Create
     """Cập nhật thông tin voucher"""
-    db_voucher = get_voucher(db, voucher_id)
+    db_voucher = get_voucher(db, store_id, voucher_id)
     if not db_voucher:
         return None
+    old_code = db_voucher.code
     update_data = voucher.model_dump(exclude_unset=True) # Lấy các trường được gửi lên
     for key, value in update_data.items():
         setattr(db_voucher, key, value)
     db.commit()
     db.refresh(db_voucher)
+    if old_code != db_voucher.code:
+        voucher_cache.mark_invalid(store_id, old_code) # Code cũ không còn tồn tại
+    voucher_cache.put(db_voucher)
     return db_voucher
 
-def delete_voucher(db: Session, voucher_id: int):
+def delete_voucher(db: Session, store_id: int, voucher_id: int):
      """Xóa một voucher"""
-     db_voucher = get_voucher(db, voucher_id)
+     db_voucher = get_voucher(db, store_id, voucher_id)
      if not db_voucher:
          return None
      deleted_copy = schemas.Voucher.model_validate(db_voucher) # Tạo bản copy
      db.delete(db_voucher)
      db.commit()
+     voucher_cache.mark_invalid(store_id, deleted_copy.code)
      return deleted_copy
 
 # --- Nghiệp vụ Công khai (Public) ---
-def get_public_menu(db: Session):
-    """Lấy toàn bộ Menu công khai, đã sắp xếp"""
-    categories = db.query(models.Category).options(
-        # === SỬA DÒNG NÀY (Bản vá 1.9.1) ===
-        # Gỡ bỏ .order_by() bị lỗi. Việc sắp xếp đã được chuyển vào models.py
-        subqueryload(models.Category.products).subqueryload(models.Product.options).joinedload(models.Option.values)      # Tải values cho option
-    ).order_by(models.Category.display_order).all()
+def get_public_menu(db: Session, store_id: int):
+    """Lấy toàn bộ Menu công khai của 1 cửa hàng, đã sắp xếp"""
+    categories = db.execute(_PUBLIC_MENU, {"store_id": store_id}).scalars().all()
 
     # Sắp xếp Options trong từng Product theo display_order
     for category in categories:
@@ -274,6 +354,30 @@ def get_public_menu(db: Session):
 
     return categories
 
+def get_public_menu_json(db: Session, store_id: int):
+    """
+    Menu công khai dạng JSON (bytes), chỉ dựng lại khi cache_versions báo menu đã đổi
+
+    Trả về (body, stale): stale=True khi không truy cập được DB và đang dùng menu cuối cùng đã biết
+    """
+    version = cache_versions.menu_key(store_id) # Đọc TRƯỚC khi truy vấn (có ghi xen vào thì lần sau dựng lại)
+    body = menu_cache.get(store_id, version)
+    if body is not None:
+        return body, not cache_versions.reachable
+    try:
+        if replica.router.is_replica(db) and cache_versions.current(db, namespace("menu", store_id))[0] < version:
+            # Bản sao chưa nhận thay đổi menu mới nhất: dựng từ DB chính, không cache menu cũ dưới version mới
+            with models.SessionLocal() as primary:
+                return menu_cache.store(store_id, version, get_public_menu(primary, store_id)), False
+        return menu_cache.store(store_id, version, get_public_menu(db, store_id)), False
+    except (OperationalError, PoolTimeoutError) as e:
+        db.rollback()
+        body = menu_cache.last_known(store_id)
+        if body is None:
+            raise
+        logger.warning("Không đọc được menu từ DB, trả bản snapshot cũ: %s", e, extra={"store_id": store_id})
+        return body, True
+
 
 # --- Logic "Quầy Thu ngân" ---
 def _calculate_delivery_fee(method: models.DeliveryMethod, sub_total: float) -> float:
@@ -299,15 +403,31 @@ def _calculate_discount(voucher: models.Voucher, sub_total: float) -> float:
     discount = max(0, discount)
     return min(discount, sub_total)
 
-def calculate_order_total(db: Session, order_data: schemas.OrderCalculateRequest):
+def get_option_rules(db: Session, store_id: int) -> OptionRules:
+    """Quy tắc tùy chọn của cửa hàng, chỉ dựng lại (3 truy vấn) khi version menu đổi"""
+    version = cache_versions.menu_key(store_id)
+    rules = option_rules_cache.get(store_id, version)
+    if rules is None:
+        association = models.ProductOptionAssociation
+        links = db.query(association.product_id, association.option_id).join(
+            models.Product, models.Product.id == association.product_id
+        ).filter(models.Product.store_id == store_id).all()
+        options = db.query(models.Option.id, models.Option.name, models.Option.type).filter(models.Option.store_id == store_id).all()
+        values = db.query(models.OptionValue.id, models.OptionValue.option_id).filter(models.OptionValue.store_id == store_id).all()
+        rules = option_rules_cache.store(store_id, version, OptionRules(links, options, values))
+    return rules
+
+def calculate_order_total(db: Session, store_id: int, order_data: schemas.OrderCalculateRequest):
     """Tính toán lại tổng tiền đơn hàng từ ID (Nguồn tin cậy)"""
     sub_total = 0.0
 
     product_ids = list(set([item.product_id for item in order_data.items])) 
     option_value_ids = list(set([opt_id for item in order_data.items for opt_id in item.options])) 
 
-    products_in_cart = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids)).all()}
-    option_values_in_cart = {ov.id: ov for ov in db.query(models.OptionValue).filter(models.OptionValue.id.in_(option_value_ids)).all()}
+    # Chỉ món / tùy chọn của cửa hàng này; ID của cửa hàng khác coi như không tồn tại
+    products_in_cart = {p.id: p for p in db.execute(_PRODUCTS_BY_IDS, {"store_id": store_id, "ids": product_ids}).scalars()}
+    option_values_in_cart = {ov.id: ov for ov in db.execute(_OPTION_VALUES_BY_IDS, {"store_id": store_id, "ids": option_value_ids}).scalars()}
+    option_rules = get_option_rules(db, store_id)
 
     for item in order_data.items:
         db_product = products_in_cart.get(item.product_id)
@@ -317,6 +437,11 @@ def calculate_order_total(db: Session, order_data: schemas.OrderCalculateRequest
         if db_product.is_out_of_stock:
             raise HTTPException(status_code=400, detail=f"Món '{db_product.name}' đã tạm hết hàng!")
 
+        # Lựa chọn phải thuộc nhóm đã gắn với món; nhóm CHON_1 phải chọn đúng 1
+        violation = option_rules.violation(db_product.id, item.options)
+        if violation:
+            raise HTTPException(status_code=400, detail=f"Món '{db_product.name}': {violation}")
+
         item_price = db_product.base_price
 
         for option_value_id in item.options:
@@ -335,7 +460,7 @@ def calculate_order_total(db: Session, order_data: schemas.OrderCalculateRequest
     discount_amount = 0.0
     db_voucher = None
     if order_data.voucher_code:
-        db_voucher = get_voucher_by_code(db, order_data.voucher_code)
+        db_voucher = get_voucher_by_code(db, store_id, order_data.voucher_code)
         if db_voucher:
             if sub_total >= db_voucher.min_order_value:
                 discount_amount = _calculate_discount(db_voucher, sub_total)
@@ -354,15 +479,16 @@ def calculate_order_total(db: Session, order_data: schemas.OrderCalculateRequest
     )
 
 
-def create_order(db: Session, order: schemas.OrderCreate):
-    """Tạo Đơn hàng mới và lưu vào DB"""
+def create_order(db: Session, store_id: int, order: schemas.OrderCreate, idempotency_key: Optional[str] = None):
+    """Tạo Đơn hàng mới và lưu vào DB (kèm đánh dấu Idempotency-Key đã hoàn tất, cùng transaction)"""
 
     try:
-        calculated = calculate_order_total(db, order)
+        calculated = calculate_order_total(db, store_id, order)
     except HTTPException as e:
         raise e 
 
     db_order = models.Order(
+        store_id=store_id,
         customer_name=order.customer_name,
         customer_phone=order.customer_phone,
         customer_address=order.customer_address,
@@ -374,17 +500,18 @@ def create_order(db: Session, order: schemas.OrderCreate):
         delivery_fee=calculated.delivery_fee,
         discount_amount=calculated.discount_amount,
         total_amount=calculated.total_amount,
-        status=models.OrderStatus.MOI
+        status=models.OrderStatus.MOI,
+        created_at=datetime.now(timezone.utc) # Gán sẵn để rollup dùng đúng mốc giờ, không cần refresh
     )
     db.add(db_order)
     db.flush() 
+    db_order.tracking_token = security.create_order_tracking_token(store_id, db_order.id) # Không lưu DB, chỉ trả cho khách
 
     product_ids = list(set([item.product_id for item in order.items]))
     option_value_ids = list(set([opt_id for item in order.items for opt_id in item.options]))
-    products_in_order = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids)).all()}
+    products_in_order = {p.id: p for p in db.execute(_PRODUCTS_BY_IDS, {"store_id": store_id, "ids": product_ids}).scalars()}
     option_values_in_order = {
-        ov.id: ov for ov in db.query(models.OptionValue).options(joinedload(models.OptionValue.option)) 
-        .filter(models.OptionValue.id.in_(option_value_ids)).all()
+        ov.id: ov for ov in db.execute(_OPTION_VALUES_WITH_OPTION_BY_IDS, {"store_id": store_id, "ids": option_value_ids}).scalars()
     }
 
     order_items_to_add = []
@@ -414,6 +541,7 @@ def create_order(db: Session, order: schemas.OrderCreate):
     for temp_item in temp_items_for_options:
         db_item_obj = temp_item["item_obj"]
         options_selected = temp_item["options"]
+        temp_item["option_rows"] = []
         for opt_val in options_selected:
             if opt_val and opt_val.option: 
                 db_item_option = models.OrderItemOption(
@@ -423,32 +551,96 @@ def create_order(db: Session, order: schemas.OrderCreate):
                     added_price=opt_val.price_adjustment
                 )
                 order_item_options_to_add.append(db_item_option)
+                temp_item["option_rows"].append(db_item_option)
 
     db.add_all(order_item_options_to_add)
+    db_order.items_snapshot = _items_snapshot(temp_items_for_options)
+
+    # Cộng dồn vào bảng rollup báo cáo, cùng transaction với đơn hàng
+    reports.record_order_created(db, db_order, order_items_to_add)
+
+    if idempotency_key:
+        response = schemas.PublicOrderResponse.model_validate(db_order).model_dump(mode="json")
+        idempotency.store.mark_completed(db, idempotency_key, response)
+        db_order.idempotent_response = response # Đúng bản đã commit, để process này phát lại
 
     db.commit() 
     db.refresh(db_order)
+    order_counters.counters.record(store_id, {db_order.status.value: 1})
     return db_order
 
+def _items_snapshot(items_with_options: list) -> list:
+    """Món + tùy chọn của đơn dạng schemas.OrderItemDetail (lưu vào orders.items_snapshot)"""
+    return [
+        {
+            "id": entry["item_obj"].id,
+            "product_name": entry["item_obj"].product_name,
+            "quantity": entry["item_obj"].quantity,
+            "item_price": entry["item_obj"].item_price,
+            "item_note": entry["item_obj"].item_note,
+            "options_selected": [
+                {"option_name": row.option_name, "value_name": row.value_name, "added_price": row.added_price}
+                for row in entry["option_rows"]
+            ],
+        }
+        for entry in items_with_options
+    ]
+
 # --- Nghiệp vụ Admin xem Order ---
-def get_orders(db: Session, skip: int = 0, limit: int = 100):
+def get_orders(db: Session, store_id: int, skip: int = 0, limit: int = 100):
     """Lấy danh sách đơn hàng (thông tin cơ bản), mới nhất lên đầu"""
-    return db.query(models.Order).order_by(models.Order.id.desc()).offset(skip).limit(limit).all()
-
-def get_order_details(db: Session, order_id: int):
-    """Lấy chi tiết đầy đủ của 1 đơn hàng"""
-    return db.query(models.Order).options(
-        subqueryload(models.Order.items).
-        subqueryload(models.OrderItem.options_selected)
-    ).filter(models.Order.id == order_id).first()
-
-
-def update_order_status(db: Session, order_id: int, status: models.OrderStatus):
+    return db.query(models.Order).filter(models.Order.store_id == store_id).order_by(models.Order.id.desc()).offset(skip).limit(limit).all()
+
+def get_order_details(db: Session, store_id: int, order_id: int):
+    """
+    Lấy chi tiết đầy đủ của 1 đơn hàng (tự tìm tiếp trong bảng archive nếu đơn đã được lưu trữ)
+
+    Đọc 1 dòng: món + tùy chọn lấy từ items_snapshot; chỉ đơn chưa có snapshot mới đọc bảng chi tiết
+    """
+    for model, item_model in ((models.Order, models.OrderItem), (models.ArchivedOrder, models.ArchivedOrderItem)):
+        # Đơn cũ đã HOAN_TAT/DA_HUY có thể đã được archive.py chuyển đi
+        db_order = db.query(model).options(undefer(model.items_snapshot)).filter(model.store_id == store_id, model.id == order_id).first()
+        if db_order is None:
+            continue
+        if db_order.items_snapshot is None:
+            return db.query(model).options(
+                subqueryload(model.items).
+                subqueryload(item_model.options_selected)
+            ).filter(model.id == order_id).first()
+        fields = {name: getattr(db_order, name) for name in schemas.OrderDetail.model_fields if name != "items"}
+        return schemas.OrderDetail(**fields, items=db_order.items_snapshot)
+    return None
+
+
+def update_order_status(db: Session, store_id: int, order_id: int, status: models.OrderStatus):
     """Cập nhật trạng thái đơn hàng"""
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    # Khóa dòng đơn: 2 admin đổi trạng thái cùng lúc thì người sau đọc trạng thái người trước đã ghi
+    # (không cùng trừ 1 trạng thái cũ trong rollup / order_status_counts)
+    db_order = db.query(models.Order).filter(
+        models.Order.store_id == store_id, models.Order.id == order_id
+    ).populate_existing().with_for_update().first()
     if not db_order:
         return None
+    old_status = db_order.status
+    # Delta cho order_counters tính từ trạng thái ĐÃ KHÓA, dùng lại sau commit
+    delta = {old_status.value: -1, status.value: 1} if old_status != status else {}
+    if delta:
+        reports.record_status_change(db, db_order, old_status, status)
     db_order.status = status
     db.commit()
     db.refresh(db_order)
+    if delta:
+        order_counters.counters.record(store_id, delta)
+        message = {
+            "type": "order_status_changed",
+            "store_id": store_id,
+            "order_id": db_order.id,
+            "previous_status": old_status.value,
+            "status": status.value,
+            "updated_at": db_order.updated_at.isoformat(),
+        }
+        # Khách đang theo dõi đơn ở worker này: đánh thức ngay, không chờ hàng đợi side effect
+        order_tracking.waiters.changed(dict(message))
+        # Admin khác thấy ngay (bấm liên tục được gom lại, xem order_events.py); worker khác nhận qua event bus
+        side_effects.queue.emit("order_status_changed", message)
     return db_order
\ No newline at end of file
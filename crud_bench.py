@@ -0,0 +1,116 @@
+# Tệp: crud_bench.py
+# Mục đích: Đo chi phí Python mỗi lần gọi các truy vấn nóng của crud.py
+#
+# - So sánh cách cũ (dựng Query ORM mỗi lần gọi) với câu truy vấn dựng sẵn trong crud.py
+#   (select() + bindparam, IN dạng expanding)
+# - Mỗi trường hợp chạy --iterations lần trên CÙNG dữ liệu, ghi log (app_logging, 1 dòng / truy vấn):
+#   µs CPU / lần (time.process_time, tức chỉ phần Python của process này, không tính thời gian
+#   chờ Postgres) và µs thực / lần; các số cũng nằm trong trường của log (LOG_FORMAT=json)
+# - Chỉ ĐỌC dữ liệu; CSDL cấu hình như server (POSTGRES_*, DB_HOST), cần đã có dữ liệu mẫu (seed.py)
+#
+# Dùng:  LOG_FORMAT=text python crud_bench.py [--iterations 2000] [--store default]
+
+import sys
+import time
+import logging
+import argparse
+from sqlalchemy.orm import joinedload, subqueryload
+import models
+import crud
+import tenancy
+
+logger = logging.getLogger(__name__)
+
+# --- Cách cũ: dựng Query ORM mỗi lần gọi ---
+def _admin_by_username_query(db, store_id, username):
+    return db.query(models.Admin).filter(models.Admin.store_id == store_id, models.Admin.username == username).first()
+
+def _voucher_by_code_query(db, store_id, code):
+    return db.query(models.Voucher).filter(
+        models.Voucher.store_id == store_id, models.Voucher.code == code, models.Voucher.is_active == True
+    ).first()
+
+def _cart_lookup_query(db, store_id, product_ids, option_value_ids):
+    products = db.query(models.Product).filter(models.Product.store_id == store_id, models.Product.id.in_(product_ids)).all()
+    values = db.query(models.OptionValue).options(joinedload(models.OptionValue.option)).filter(
+        models.OptionValue.store_id == store_id, models.OptionValue.id.in_(option_value_ids)
+    ).all()
+    return products, values
+
+def _public_menu_query(db, store_id):
+    return db.query(models.Category).options(
+        subqueryload(models.Category.products).subqueryload(models.Product.options).joinedload(models.Option.values)
+    ).filter(models.Category.store_id == store_id).order_by(models.Category.display_order).all()
+
+
+# --- Cách mới: câu truy vấn dựng sẵn của crud.py ---
+def _cart_lookup_prepared(db, store_id, product_ids, option_value_ids):
+    products = db.execute(crud._PRODUCTS_BY_IDS, {"store_id": store_id, "ids": product_ids}).scalars().all()
+    values = db.execute(crud._OPTION_VALUES_WITH_OPTION_BY_IDS, {"store_id": store_id, "ids": option_value_ids}).scalars().all()
+    return products, values
+
+def _voucher_by_code_prepared(db, store_id, code):
+    return db.execute(crud._ACTIVE_VOUCHER_BY_CODE, {"store_id": store_id, "code": code}).scalars().first()
+
+
+def _measure(db, call, iterations: int):
+    for _ in range(min(50, iterations)): # Làm nóng: cache biên dịch của SQLAlchemy, kết nối
+        call()
+        db.expunge_all()
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        call()
+        db.expunge_all() # Mỗi lần như 1 request mới: không dùng lại object trong identity map
+    return (time.process_time() - cpu) / iterations * 1e6, (time.perf_counter() - wall) / iterations * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Đo chi phí Python của các truy vấn nóng trong crud.py")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--store", default="default", help="Slug cửa hàng")
+    args = parser.parse_args(argv)
+
+    db = models.SessionLocal()
+    try:
+        store_id = tenancy.directory.resolve(args.store, None)
+        if store_id is None:
+            logger.error("Không có cửa hàng '%s'", args.store)
+            return 1
+        product_ids = [p.id for p in db.query(models.Product.id).filter(models.Product.store_id == store_id).limit(5)]
+        option_value_ids = [v.id for v in db.query(models.OptionValue.id).filter(models.OptionValue.store_id == store_id).limit(5)]
+        voucher = db.query(models.Voucher.code).filter(models.Voucher.store_id == store_id).first()
+        code = voucher.code if voucher is not None else "KHONG-CO"
+
+        cases = [
+            ("get_admin_by_username",
+             lambda: _admin_by_username_query(db, store_id, "admin"),
+             lambda: crud.get_admin_by_username(db, store_id, "admin")),
+            ("get_voucher_by_code (DB)", # Bỏ qua voucher_cache để đo đúng câu truy vấn
+             lambda: _voucher_by_code_query(db, store_id, code),
+             lambda: _voucher_by_code_prepared(db, store_id, code)),
+            ("products + option values IN (...)",
+             lambda: _cart_lookup_query(db, store_id, product_ids, option_value_ids),
+             lambda: _cart_lookup_prepared(db, store_id, product_ids, option_value_ids)),
+            ("get_public_menu",
+             lambda: _public_menu_query(db, store_id),
+             lambda: crud.get_public_menu(db, store_id)),
+        ]
+        for name, before, after in cases:
+            before_cpu, before_wall = _measure(db, before, args.iterations)
+            after_cpu, after_wall = _measure(db, after, args.iterations)
+            cpu_change = (after_cpu - before_cpu) / before_cpu * 100
+            logger.info("%s: Query ORM %.1f / %.1f µs (cpu / thực), dựng sẵn %.1f / %.1f µs, cpu %+.1f%%",
+                        name, before_cpu, before_wall, after_cpu, after_wall, cpu_change, extra={
+                            "query": name, "iterations": args.iterations,
+                            "orm_cpu_us": round(before_cpu, 1), "orm_wall_us": round(before_wall, 1),
+                            "prepared_cpu_us": round(after_cpu, 1), "prepared_wall_us": round(after_wall, 1),
+                            "cpu_change_pct": round(cpu_change, 1),
+                        })
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    import app_logging # Kết quả đi qua log (LOG_FORMAT=text cho dễ đọc)
+    sys.exit(main())
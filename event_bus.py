@@ -0,0 +1,97 @@
+# Tệp: event_bus.py
+# Mục đích: Phát thông báo WebSocket tới admin đang kết nối ở BẤT KỲ worker nào
+#
+# - Chế độ "local" (1 worker): gửi thẳng cho các kết nối trong process
+# - Chế độ "postgres" (nhiều worker): pg_notify trên kênh EVENT_BUS_CHANNEL; mỗi worker có
+#   1 thread LISTEN (kết nối riêng, không chiếm pool) và chuyển thông báo về event loop của mình.
+#   Worker gửi cũng nhận lại thông báo của chính nó => mỗi kết nối nhận đúng 1 lần.
+#   Thông báo phát ra lúc thread đang kết nối lại sẽ bị mất (chỉ là thông báo, đơn đã nằm trong DB).
+
+import logging
+import os
+import json
+import time
+import select
+import asyncio
+import threading
+from sqlalchemy import text
+import models
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+EVENT_BUS_MODE = os.getenv("EVENT_BUS_MODE", "postgres" if WEB_CONCURRENCY > 1 else "local")
+EVENT_BUS_CHANNEL = "admin_events"
+RECONNECT_INTERVAL = 2.0
+
+
+class EventBus:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._handler = None
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def distributed(self) -> bool:
+        return self.mode == "postgres" and self._thread is not None
+
+    def start(self, handler):
+        """Gọi trong sự kiện startup (async) của MỖI worker, tức là sau khi fork"""
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        if self.mode != "postgres" or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="event-bus-listener", daemon=True)
+        self._thread.start()
+        logger.info("Event bus: LISTEN %s", EVENT_BUS_CHANNEL)
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    async def publish(self, message: dict):
+        await asyncio.to_thread(self._notify, json.dumps(message, ensure_ascii=False))
+
+    @staticmethod
+    def _notify(payload: str):
+        with models.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENT_BUS_CHANNEL, "payload": payload})
+
+    def _connect(self):
+        dialect = models.engine.dialect
+        cargs, cparams = dialect.create_connect_args(models.engine.url)
+        conn = dialect.connect(*cargs, **cparams)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENT_BUS_CHANNEL}")
+        return conn
+
+    def _listen_forever(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = self._connect()
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    asyncio.run_coroutine_threadsafe(self._handler(json.loads(notification.payload)), self._loop)
+            except Exception as e:
+                logger.warning("Event bus mất kết nối (%s), kết nối lại sau %ss...", e, RECONNECT_INTERVAL)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                time.sleep(RECONNECT_INTERVAL)
+        if conn is not None:
+            conn.close()
+
+
+bus = EventBus(EVENT_BUS_MODE)
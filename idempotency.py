@@ -0,0 +1,193 @@
+# Tệp: idempotency.py
+# Mục đích: Hỗ trợ header "Idempotency-Key" cho POST /orders
+#           Client gửi lại (retry) cùng key => trả lại đúng response cũ, KHÔNG tạo đơn mới
+#
+# - Bộ nhớ (LRU + TTL): trả lời request lặp lại mà không chạm DB
+# - Bảng idempotency_keys: nguồn tin cậy, dùng chung giữa các process;
+#   INSERT ... ON CONFLICT DO NOTHING đảm bảo chỉ 1 request "giữ chỗ" được key
+# - Trạng thái "completed" được ghi CÙNG transaction với đơn hàng (crud.create_order), chỉ khi
+#   dòng key vẫn đúng là lần giữ chỗ của request này (request_hash + lease_expires_at)
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from sqlalchemy import delete, or_, and_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# Request đang xử lý giữ key tối đa bấy nhiêu giây (phòng process chết giữa chừng)
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE", "30"))
+IDEMPOTENCY_MEMORY_SIZE = int(os.getenv("IDEMPOTENCY_MEMORY_SIZE", "10000"))
+MAX_KEY_LENGTH = 255
+# Cứ bấy nhiêu lần giữ chỗ thì dọn các key đã hết hạn trong DB 1 lần
+PURGE_EVERY_CLAIMS = 256
+
+
+def request_hash(order_data) -> str:
+    """Dấu vân tay nội dung request (cùng key phải cùng nội dung)"""
+    return hashlib.sha256(order_data.model_dump_json().encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int, lease_seconds: int, memory_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.memory_size = memory_size
+        self._lock = threading.Lock()
+        self._completed = OrderedDict()  # key -> (hết hạn lúc, request_hash, response dict)
+        self._in_flight = {}             # key đang được xử lý trong process này -> (request_hash, lease_expires_at đã ghi)
+        self._claims = 0
+
+    def begin(self, db: Session, key: str, req_hash: str):
+        """
+        Giữ chỗ key trước khi tạo đơn
+
+        Trả về response cũ (dict) nếu đây là request lặp lại,
+        hoặc None nếu request này được quyền tạo đơn (sau đó gọi finish() / release())
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Idempotency-Key dài tối đa {MAX_KEY_LENGTH} ký tự.")
+
+        with self._lock:
+            entry = self._completed.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._check_hash(entry[1], req_hash)
+                self._completed.move_to_end(key)
+                return entry[2]
+            if key in self._in_flight:
+                raise self._in_progress()
+            self._in_flight[key] = None
+
+        try:
+            replayed = self._claim_in_db(db, key, req_hash)
+        except Exception:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            raise
+        if replayed is not None:
+            self.finish(key, req_hash, replayed)
+        return replayed
+
+    def finish(self, key: str, req_hash: str, response: dict):
+        """Ghi nhớ response sau khi đơn đã commit"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._completed[key] = (time.monotonic() + self.ttl_seconds, req_hash, response)
+            self._completed.move_to_end(key)
+            while len(self._completed) > self.memory_size:
+                self._completed.popitem(last=False)
+
+    def release(self, db: Session, key: str):
+        """Tạo đơn thất bại: trả key lại để client có thể thử lại"""
+        with self._lock:
+            claim = self._in_flight.pop(key, None)
+        db.rollback()
+        if claim is None:
+            return
+        # Chỉ xóa lần giữ chỗ của chính mình: hết lease thì request khác có thể đã giành lại key
+        db.execute(delete(models.IdempotencyKey).where(
+            models.IdempotencyKey.key == key, models.IdempotencyKey.status == "pending", *self._owned_by(claim)
+        ))
+        db.commit()
+
+    def mark_completed(self, db: Session, key: str, response: dict):
+        """
+        Gọi trong transaction tạo đơn (trước commit): lưu response để phát lại
+
+        Lease đã hết và request khác đã giành lại key => 409, transaction của đơn phải rollback
+        (không thì 2 đơn cho cùng 1 key)
+        """
+        with self._lock:
+            claim = self._in_flight.get(key)
+        key_column = models.IdempotencyKey
+        updated = 0
+        if claim is not None:
+            updated = db.execute(update(key_column).where(
+                key_column.key == key, key_column.status == "pending", *self._owned_by(claim)
+            ).values(status="completed", response_body=json.dumps(response))).rowcount
+        if updated != 1:
+            raise self._in_progress()
+
+    @staticmethod
+    def _owned_by(claim: tuple) -> tuple:
+        req_hash, lease_expires_at = claim
+        return (models.IdempotencyKey.request_hash == req_hash, models.IdempotencyKey.lease_expires_at == lease_expires_at)
+
+    def _remember_claim(self, key: str, req_hash: str, lease_expires_at: datetime):
+        with self._lock:
+            self._in_flight[key] = (req_hash, lease_expires_at)
+
+    def _claim_in_db(self, db: Session, key: str, req_hash: str):
+        now = datetime.now(timezone.utc)
+        new_values = {
+            "request_hash": req_hash,
+            "status": "pending",
+            "response_body": None,
+            "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+            "expires_at": now + timedelta(seconds=self.ttl_seconds),
+        }
+        claimed = db.execute(
+            insert(models.IdempotencyKey).values(key=key, **new_values)
+            .on_conflict_do_nothing(index_elements=["key"])
+            .returning(models.IdempotencyKey.key)
+        ).scalar()
+        if claimed:
+            db.commit()
+            self._remember_claim(key, req_hash, new_values["lease_expires_at"])
+            self._maybe_purge(db, now)
+            return None
+
+        row = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).first()
+        if row is not None and row.expires_at > now:
+            self._check_hash(row.request_hash, req_hash)
+            if row.status == "completed":
+                db.rollback()
+                return json.loads(row.response_body)
+
+        # Key đã hết hạn, hoặc request giữ chỗ trước đó đã chết (hết lease): giành lại
+        key_column = models.IdempotencyKey
+        taken_over = db.execute(
+            update(key_column).where(
+                key_column.key == key,
+                or_(key_column.expires_at <= now,
+                    and_(key_column.status == "pending", key_column.lease_expires_at <= now)),
+            ).values(**new_values).returning(key_column.key)
+        ).scalar()
+        db.commit()
+        if taken_over:
+            self._remember_claim(key, req_hash, new_values["lease_expires_at"])
+            return None
+        raise self._in_progress()
+
+    def _maybe_purge(self, db: Session, now: datetime):
+        self._claims += 1
+        if self._claims % PURGE_EVERY_CLAIMS:
+            return
+        db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
+        db.commit()
+
+    @staticmethod
+    def _check_hash(stored_hash: str, req_hash: str):
+        if stored_hash != req_hash:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key đã được dùng cho một đơn hàng có nội dung khác.",
+            )
+
+    @staticmethod
+    def _in_progress():
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Đơn hàng với Idempotency-Key này đang được xử lý, vui lòng thử lại sau.",
+            headers={"Retry-After": "1"},
+        )
+
+
+store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_MEMORY_SIZE)
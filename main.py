@@ -1,28 +1,82 @@
 # File: main.py (Đã thêm WebSocket)
 # Mục đích: Backend API với WebSocket real-time
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, WebSocket, WebSocketDisconnect
+import logging
+import app_logging # Cấu hình log trước mọi thứ khác
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, WebSocket, WebSocketDisconnect, Header, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 import shutil
 import os
 import uuid
 
 import crud, models, schemas, security
+import query_profiler
+import reports
+import order_export
+import menu_io
+from menu_search import search_index
+import idempotency
+import admission
+import bootstrap
+import event_bus
+import tenancy
+import side_effects
+import order_counters
+import order_events
+import order_tracking
+import replica
+from cache import menu_cache, cache_versions, namespace
 from models import SessionLocal, engine, Base
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from datetime import date, datetime
+import json
+import asyncio
+
+logger = logging.getLogger(__name__)
 
 # IMPORT WEBSOCKET MANAGER
 try:
     from websocket_manager import manager
-    print("✅ WebSocket manager loaded successfully!")
+    logger.info("WebSocket manager loaded successfully!")
 except ImportError:
-    print("⚠️ websocket_manager.py not found - WebSocket disabled!")
+    logger.warning("websocket_manager.py not found - WebSocket disabled!")
     manager = None
 
+# Việc phụ sau khi đặt đơn: chạy nền, không giữ response của khách
+async def notify_admins_new_order(message: dict):
+    await manager.broadcast(message)
+    logger.info("Sent notification for order #%s", message["order_id"], extra={"order_id": message["order_id"], "store_id": message["store_id"]})
+
+async def deliver_admin_event(message: dict):
+    # Tin từ event bus (mọi worker): cập nhật bộ đếm, rồi gửi cho admin của worker này
+    order_counters.counters.apply_remote(message)
+    if event_bus.bus.distributed:
+        # Khách theo dõi đơn ở worker KHÁC; worker đổi trạng thái đã đánh thức khách của mình (crud.update_order_status)
+        order_tracking.waiters.notify(message)
+    if manager:
+        await manager.broadcast_local(message)
+
+async def publish_admin_event(message: dict):
+    # Nhiều worker: qua event bus (về lại deliver_admin_event ở mọi worker); 1 worker: gửi thẳng
+    if event_bus.bus.distributed:
+        await event_bus.bus.publish(message)
+    else:
+        await deliver_admin_event(message)
+
+# Status changes and counter deltas are coalesced per order / per store before being pushed
+order_events.coalescer.connect(publish_admin_event)
+side_effects.queue.subscribe("order_status_changed", order_events.coalescer.add_status_change)
+
+if manager:
+    side_effects.queue.subscribe("order_created", notify_admins_new_order)
+    side_effects.queue.subscribe("order_counts", order_events.coalescer.add_counts)
+    order_counters.counters.subscribe(lambda message: side_effects.queue.emit("order_counts", message))
+
 app = FastAPI(title="FNB Smart Menu - Backend API")
 
 # Upload directory
@@ -31,6 +85,9 @@ STATIC_PATH = "/static"
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 app.mount(STATIC_PATH, StaticFiles(directory=UPLOAD_DIRECTORY), name="static")
 
+# Admission control cho /menu, /orders/calculate, /orders (thêm TRƯỚC CORS để response 429/503 vẫn có header CORS)
+app.add_middleware(admission.AdmissionControlMiddleware)
+
 # CORS
 origins = [
     "http://localhost",
@@ -54,6 +111,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Query profiler: đếm truy vấn theo request, log truy vấn chậm & nghi N+1
+query_profiler.install(engine)
+if models.read_engine is not None:
+    query_profiler.install(models.read_engine)
+app.add_middleware(query_profiler.QueryProfilerMiddleware)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -63,59 +126,99 @@ def get_db():
 
 @app.on_event("startup")
 def on_startup():
-    print("Starting application...")
-    models.create_tables()
-    print("Database tables ready.")
-    db = SessionLocal()
-    admin = crud.get_admin_by_username(db, "admin")
-    if not admin:
-        print("Creating default admin (admin/admin)...")
-        admin_in = schemas.AdminCreate(username="admin", password="admin")
-        crud.create_admin(db, admin_in)
-        print("Admin created!")
-    else:
-        print("Admin already exists.")
-    db.close()
-    print("Startup complete.")
+    logger.info("Starting application...")
+    menu_cache.load_snapshots() # Có menu để phục vụ ngay, kể cả khi DB chưa lên
+    # Chạy qua bootstrap.py thì CSDL thường đã sẵn sàng, bước này không làm gì thêm;
+    # chạy thẳng "uvicorn main:app" thì chỉ tốn 1 câu SELECT schema_version.
+    # CSDL chưa lên: không chặn khởi động, thử lại ở nền rồi mới nạp danh sách cửa hàng
+    bootstrap.prepare_in_background(on_ready=tenancy.directory.warm)
+    logger.info("Startup complete.")
+
+@app.on_event("startup")
+async def start_event_bus():
+    # Mỗi worker tự LISTEN (sau khi fork), để thông báo WebSocket tới được admin ở mọi worker
+    event_bus.bus.start(deliver_admin_event)
+    side_effects.queue.start()
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await side_effects.queue.stop() # Gửi nốt thông báo đang chờ trước khi tắt bus
+    await order_events.coalescer.flush_all()
+    event_bus.bus.stop()
 
 # === PUBLIC ENDPOINTS ===
 
 @app.get("/menu", response_model=List[schemas.PublicCategory])
-def get_full_menu(db: Session = Depends(get_db)):
-    """PUBLIC API: Get full menu"""
-    return crud.get_public_menu(db)
+def get_full_menu(db: Session = Depends(replica.get_read_db), store_id: int = Depends(tenancy.get_store_id)):
+    """PUBLIC API: Get full menu (pre-serialized, rebuilt only when the menu version changes; served from the last snapshot with X-Menu-Stale: true while the DB is unreachable)"""
+    body, stale = crud.get_public_menu_json(db, store_id)
+    headers = {"X-Menu-Stale": "true", "Cache-Control": "no-store"} if stale else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/menu/search", response_model=List[schemas.MenuSearchResult])
+def search_menu(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(replica.get_read_db),
+    store_id: int = Depends(tenancy.get_store_id)
+):
+    """PUBLIC API: Accent-insensitive product search ("tra sua" finds "Trà Sữa"), ranked, from an in-memory index of the cached menu"""
+    body, _ = crud.get_public_menu_json(db, store_id)
+    return search_index.search(store_id, body, q, limit)
 
 @app.post("/orders/calculate", response_model=schemas.OrderCalculateResponse)
 def calculate_order(
     order_data: schemas.OrderCalculateRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(tenancy.get_store_id)
 ):
     """PUBLIC API: Calculate order total"""
     try:
-        return crud.calculate_order_total(db, order_data)
+        return crud.calculate_order_total(db, store_id, order_data)
     except HTTPException as e:
         if e.status_code < 500:
              raise e
-        print(f"Error calculating order: {e.detail}")
+        logger.error("Error calculating order: %s", e.detail, extra={"store_id": store_id})
         raise HTTPException(status_code=500, detail="System error calculating order.")
     except Exception as e:
-        print(f"Unknown error calculating order: {e}")
+        logger.exception("Unknown error calculating order: %s", e, extra={"store_id": store_id})
         raise HTTPException(status_code=500, detail="Unknown system error calculating order.")
 
 @app.post("/orders", response_model=schemas.PublicOrderResponse, status_code=status.HTTP_201_CREATED)
 async def submit_new_order(  # IMPORTANT: async here!
     order_data: schemas.OrderCreate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    store_id: int = Depends(tenancy.get_store_id),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """PUBLIC API: Submit order + Send WebSocket notification"""
+    """PUBLIC API: Submit order; admin notification is queued after commit (retries with the same Idempotency-Key replay the first response)"""
+    # Every DB round trip runs in the threadpool: this endpoint stays async for the event loop
+    request_hash = None
+    if idempotency_key:
+        idempotency_key = f"{store_id}:{idempotency_key}" # Key của client chỉ cần duy nhất trong 1 cửa hàng
+        request_hash = idempotency.request_hash(order_data)
+        replayed = await run_in_threadpool(idempotency.store.begin, db, idempotency_key, request_hash)
+        if replayed is not None:
+            logger.info("Replayed order #%s for a retried request", replayed["id"], extra={"order_id": replayed["id"], "store_id": store_id})
+            return JSONResponse(status_code=status.HTTP_201_CREATED, content=replayed, headers={"Idempotent-Replayed": "true"})
+
     try:
         # Step 1: Save order to database
-        db_order = crud.create_order(db, order_data)
-        
-        # Step 2: Send WebSocket notification to admin
-        if manager:
-            notification_message = {
+        try:
+            db_order = await run_in_threadpool(crud.create_order, db, store_id, order_data, idempotency_key=idempotency_key)
+        except Exception:
+            if idempotency_key:
+                await run_in_threadpool(idempotency.store.release, db, idempotency_key)
+            raise
+
+        # The order is committed from here on: whatever fails below, retries must replay it (never 409 forever)
+        try:
+            order_tracking.waiters.remember(db_order.store_id, db_order.id, db_order.status.value, db_order.updated_at.isoformat())
+
+            # Step 2: Queue admin notification (and other hooks), the response does not wait for them
+            side_effects.queue.emit("order_created", {
                 "type": "new_order",
+                "store_id": db_order.store_id,
                 "order_id": db_order.id,
                 "customer_name": db_order.customer_name,
                 "customer_phone": db_order.customer_phone,
@@ -124,37 +227,112 @@ async def submit_new_order(  # IMPORTANT: async here!
                 "payment_method": db_order.payment_method.value,
                 "timestamp": datetime.now().isoformat(),
                 "status": "MOI"
-            }
-            await manager.broadcast(notification_message)
-            print(f"📢 Sent notification for order #{db_order.id} to {len(manager.active_connections)} admins")
-        
+            })
+        finally:
+            if idempotency_key:
+                idempotency.store.finish(idempotency_key, request_hash, db_order.idempotent_response)
+
         return db_order
     except HTTPException as e:
         if e.status_code < 500:
             raise e
-        print(f"Error creating order: {e.detail}")
+        logger.error("Error creating order: %s", e.detail, extra={"store_id": store_id})
         raise HTTPException(status_code=500, detail="System error creating order.")
     except Exception as e:
-        print(f"Unknown error creating order: {e}")
+        logger.exception("Unknown error creating order: %s", e, extra={"store_id": store_id})
         raise HTTPException(status_code=500, detail="Cannot process order due to system error.")
 
+def _tracked_store(order_id: int, token: str) -> int:
+    store_id = security.verify_order_tracking_token(token, order_id)
+    if store_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid tracking token")
+    return store_id
+
+async def _tracked_status(store_id: int, order_id: int):
+    current = await order_tracking.waiters.current(store_id, order_id)
+    if current is None: # Đơn đã chuyển sang archive (hoặc không tồn tại)
+        raise HTTPException(status_code=404, detail="Order not found")
+    return current
+
+@app.get("/orders/{order_id}/track", response_model=schemas.OrderTrackingStatus)
+async def track_order(
+    order_id: int,
+    token: str,
+    known_status: Optional[models.OrderStatus] = Query(None, alias="status"),
+    timeout: float = Query(order_tracking.ORDER_TRACKING_TIMEOUT, ge=0, le=order_tracking.ORDER_TRACKING_TIMEOUT),
+):
+    """PUBLIC API: Long-poll an order's status with the tracking_token from POST /orders (returns as soon as it differs from ?status=)"""
+    store_id = _tracked_store(order_id, token)
+    current_status, updated_at = await _tracked_status(store_id, order_id)
+    if known_status is not None and current_status == known_status.value and current_status not in order_tracking.FINAL_STATUSES:
+        current_status, updated_at = await order_tracking.waiters.wait(store_id, order_id, current_status, timeout)
+    return {
+        "order_id": order_id, "status": current_status, "updated_at": updated_at,
+        "changed": known_status is not None and current_status != known_status.value,
+    }
+
+@app.get("/orders/{order_id}/events")
+async def stream_order_status(order_id: int, token: str):
+    """PUBLIC API: Server-Sent Events stream of an order's status (closes after HOAN_TAT / DA_HUY)"""
+    store_id = _tracked_store(order_id, token)
+    current = await _tracked_status(store_id, order_id)
+
+    async def events():
+        current_status, updated_at = current
+        while True:
+            yield f"event: status\ndata: {json.dumps({'order_id': order_id, 'status': current_status, 'updated_at': updated_at})}\n\n"
+            if current_status in order_tracking.FINAL_STATUSES:
+                return
+            known_status = current_status
+            while current_status == known_status:
+                current_status, updated_at = await order_tracking.waiters.wait(store_id, order_id, known_status, order_tracking.ORDER_TRACKING_KEEPALIVE)
+                if current_status == known_status:
+                    yield ": keep-alive\n\n" # Giữ kết nối qua proxy
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # === WEBSOCKET ENDPOINT ===
 
+WEBSOCKET_AUTH_TIMEOUT = float(os.getenv("WEBSOCKET_AUTH_TIMEOUT", "10")) # Chờ tin "auth" đầu tiên (giây)
+
+def _websocket_admin(token: str) -> Optional[models.Admin]:
+    db = SessionLocal()
+    try:
+        return security.admin_from_token(db, token)
+    finally:
+        db.close()
+
 @app.websocket("/ws/admin/orders")
 async def websocket_admin_orders(websocket: WebSocket):
     """
-    WebSocket endpoint for admin real-time notifications
+    WebSocket endpoint for admin real-time notifications (only orders of the resolved store):
+    new_order, order_status_changed (coalesced per order), order_counts (coalesced per store)
     
-    URL: ws://localhost:8000/ws/admin/orders
+    URL: ws://localhost:8000/ws/admin/orders?token=<admin JWT from POST /admin/token>
+    Without ?token= the first text message must be {"type": "auth", "token": "<admin JWT>"}
+    The store comes from the token, never from the URL
     """
     if not manager:
-        print("⚠️ WebSocket manager not available!")
+        logger.warning("WebSocket manager not available!")
         await websocket.close()
         return
-    
+
+    token = websocket.query_params.get("token")
+    if token is None:
+        await websocket.accept()
+        try:
+            message = json.loads(await asyncio.wait_for(websocket.receive_text(), WEBSOCKET_AUTH_TIMEOUT))
+            token = message.get("token") if isinstance(message, dict) and message.get("type") == "auth" else None
+        except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+            token = None
+    admin = await run_in_threadpool(_websocket_admin, token) if token else None
+    if admin is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
     # Accept and save connection
-    await manager.connect(websocket)
-    print("🔌 Admin connected via WebSocket")
+    await manager.connect(websocket, admin.store_id)
+    logger.debug("Admin connected via WebSocket")
     
     try:
         # Keep connection open
@@ -169,28 +347,44 @@ async def websocket_admin_orders(websocket: WebSocket):
     except WebSocketDisconnect:
         # Client disconnected
         manager.disconnect(websocket)
-        print("🔌 Admin disconnected from WebSocket")
+        logger.debug("Admin disconnected from WebSocket")
     except Exception as e:
         # Other errors
-        print(f"⚠️ WebSocket error: {e}")
+        logger.warning("WebSocket error: %s", e)
         manager.disconnect(websocket)
 
 # === ADMIN ENDPOINTS ===
 
+# Conditional GET for admin catalog lists: the ETag is built from the per-table version counters
+# (1 primary-key read of cache_versions), so a matching If-None-Match skips the list query entirely
+def catalog_etag(db: Session, store_id: int, groups: tuple, skip: int, limit: int) -> str:
+    versions = cache_versions.current(db, *[namespace(group, store_id) for group in groups])
+    return 'W/"%s"' % "-".join(str(part) for part in (store_id, *versions, skip, limit))
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """304 response if the client already has this version, otherwise tag the 200 response"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    client_tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if "*" in client_tags or etag.removeprefix("W/") in client_tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @app.post("/admin/token", response_model=schemas.Token)
 async def login_for_access_token(
     db: Session = Depends(get_db),
-    form_data: OAuth2PasswordRequestForm = Depends()
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    store_id: int = Depends(tenancy.get_store_id)
 ):
-    """ADMIN API: Login"""
-    admin = crud.get_admin_by_username(db, form_data.username)
+    """ADMIN API: Login (to the store resolved from X-Store / Host)"""
+    admin = crud.get_admin_by_username(db, store_id, form_data.username)
     if not admin or not security.verify_password(form_data.password, admin.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = security.create_access_token(data={"sub": admin.username})
+    access_token = security.create_access_token(data={"sub": admin.username, "store": admin.store_id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/admin/me", response_model=schemas.Admin)
@@ -227,22 +421,80 @@ async def upload_image(
         "url": public_url
     }
 
+# Menu import / export (whole menu in one call, one transaction)
+@app.get("/admin/menu/export")
+def export_menu(
+    format: str = "json", db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Export the whole menu (options, values, categories, products, links) as JSON or CSV"""
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format. Allowed: json, csv")
+    document = menu_io.export_menu(db, current_admin.store_id)
+    if format == "csv":
+        content, media_type = menu_io.document_to_csv(document), "text/csv; charset=utf-8"
+    else:
+        content, media_type = document.model_dump_json(), "application/json"
+    return Response(content=content, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="menu.{format}"'})
+
+@app.post("/admin/menu/import", response_model=schemas.MenuImportResult)
+def import_menu(
+    document: schemas.MenuDocument, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Upsert a whole menu by name in a single transaction (nothing is written on error)"""
+    try:
+        return menu_io.import_menu(db, current_admin.store_id, document)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@app.post("/admin/menu/import/csv", response_model=schemas.MenuImportResult)
+def import_menu_csv(
+    file: UploadFile = File(...), db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Same as /admin/menu/import, from a CSV file (see menu_io.CSV_COLUMNS)"""
+    try:
+        document = menu_io.document_from_csv(file.file.read().decode("utf-8-sig"))
+        return menu_io.import_menu(db, current_admin.store_id, document)
+    except ValueError as e: # Gồm cả lỗi kiểm tra của pydantic và lỗi giải mã UTF-8
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
 # Category endpoints
 @app.post("/admin/categories/", response_model=schemas.Category, status_code=status.HTTP_201_CREATED)
 def create_new_category(
     category: schemas.CategoryCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.create_category(db=db, category=category)
+): return crud.create_category(db, current_admin.store_id, category=category)
 
 @app.get("/admin/categories/", response_model=List[schemas.Category])
 def read_all_categories(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.get_categories(db, skip=skip, limit=limit)
+    request: Request, response: Response,
+    skip: int = 0, limit: int = 100, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: List categories; 304 Not Modified when If-None-Match matches the current ETag"""
+    cached = not_modified(request, response, catalog_etag(db, current_admin.store_id, ("categories",), skip, limit))
+    if cached is not None: return cached
+    return crud.get_categories(db, current_admin.store_id, skip=skip, limit=limit)
+
+# Bulk reorder routes are registered BEFORE the /{id} routes so "reorder" is not parsed as an id
+@app.put("/admin/categories/reorder", response_model=List[schemas.DisplayOrderItem])
+def reorder_categories(
+    order: schemas.ReorderRequest, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Set every category's display_order from an ordered list of IDs (one UPDATE)"""
+    return crud.reorder_categories(db, current_admin.store_id, order.ids)
+
+@app.put("/admin/categories/{category_id}/products/reorder", response_model=List[schemas.DisplayOrderItem])
+def reorder_products_in_category(
+    category_id: int, order: schemas.ReorderRequest, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Set display_order of the products in one category from an ordered list of IDs (one UPDATE)"""
+    if not crud.get_category(db, current_admin.store_id, category_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+    return crud.reorder_products(db, current_admin.store_id, category_id, order.ids)
 
 @app.put("/admin/categories/{category_id}", response_model=schemas.Category)
 def update_existing_category(
     category_id: int, category: schemas.CategoryUpdate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_category = crud.update_category(db, category_id, category)
+    db_category = crud.update_category(db, current_admin.store_id, category_id, category)
     if db_category is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return db_category
 
@@ -250,7 +502,7 @@ def update_existing_category(
 def delete_existing_category(
     category_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_category = crud.delete_category(db, category_id)
+    db_category = crud.delete_category(db, current_admin.store_id, category_id)
     if db_category is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return db_category
 
@@ -259,20 +511,25 @@ def delete_existing_category(
 def create_new_product(
     product: schemas.ProductCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_category = crud.get_category(db, product.category_id)
+    db_category = crud.get_category(db, current_admin.store_id, product.category_id)
     if not db_category: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Category ID {product.category_id} not found.")
-    return crud.create_product(db=db, product=product)
+    return crud.create_product(db, current_admin.store_id, product=product)
 
 @app.get("/admin/products/", response_model=List[schemas.Product])
 def read_all_products(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.get_products(db, skip=skip, limit=limit)
+    request: Request, response: Response,
+    skip: int = 0, limit: int = 100, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: List products (with their options); 304 Not Modified when If-None-Match matches the current ETag"""
+    cached = not_modified(request, response, catalog_etag(db, current_admin.store_id, ("products", "options"), skip, limit))
+    if cached is not None: return cached
+    return crud.get_products(db, current_admin.store_id, skip=skip, limit=limit)
 
 @app.get("/admin/products/{product_id}", response_model=schemas.Product)
 def read_one_product(
     product_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_product = crud.get_product(db, product_id)
+    db_product = crud.get_product(db, current_admin.store_id, product_id)
     if db_product is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return db_product
 
@@ -281,9 +538,9 @@ def update_existing_product(
     product_id: int, product: schemas.ProductUpdate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
     if product.category_id is not None:
-        db_category = crud.get_category(db, product.category_id)
+        db_category = crud.get_category(db, current_admin.store_id, product.category_id)
         if not db_category: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Category ID {product.category_id} not found.")
-    db_product = crud.update_product(db, product_id, product)
+    db_product = crud.update_product(db, current_admin.store_id, product_id, product)
     if db_product is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return db_product
 
@@ -291,7 +548,7 @@ def update_existing_product(
 def delete_existing_product(
     product_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_product = crud.delete_product(db, product_id)
+    db_product = crud.delete_product(db, current_admin.store_id, product_id)
     if db_product is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return db_product
 
@@ -299,18 +556,30 @@ def delete_existing_product(
 @app.post("/admin/options/", response_model=schemas.Option, status_code=status.HTTP_201_CREATED)
 def create_new_option(
     option: schemas.OptionCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.create_option(db=db, option=option)
+): return crud.create_option(db, current_admin.store_id, option=option)
 
 @app.get("/admin/options/", response_model=List[schemas.Option])
 def read_all_options(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.get_options(db, skip=skip, limit=limit)
+    request: Request, response: Response,
+    skip: int = 0, limit: int = 100, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: List options; 304 Not Modified when If-None-Match matches the current ETag"""
+    cached = not_modified(request, response, catalog_etag(db, current_admin.store_id, ("options",), skip, limit))
+    if cached is not None: return cached
+    return crud.get_options(db, current_admin.store_id, skip=skip, limit=limit)
+
+@app.put("/admin/options/reorder", response_model=List[schemas.DisplayOrderItem]) # Before /admin/options/{option_id}
+def reorder_options(
+    order: schemas.ReorderRequest, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: Set every option group's display_order from an ordered list of IDs (one UPDATE)"""
+    return crud.reorder_options(db, current_admin.store_id, order.ids)
 
 @app.delete("/admin/options/{option_id}", response_model=schemas.Option)
 def delete_existing_option(
     option_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_option = crud.delete_option(db, option_id)
+    db_option = crud.delete_option(db, current_admin.store_id, option_id)
     if db_option is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Option group not found")
     return db_option
 
@@ -322,7 +591,7 @@ def update_existing_option(
     current_admin: models.Admin = Depends(security.get_current_admin)
 ):
     """ADMIN API: Update option group"""
-    db_option = crud.update_option(db, option_id, option)
+    db_option = crud.update_option(db, current_admin.store_id, option_id, option)
     if db_option is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Option group not found")
     return db_option
@@ -331,9 +600,9 @@ def update_existing_option(
 def create_new_option_value(
     option_id: int, option_value: schemas.OptionValueCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_option = crud.get_option(db, option_id)
+    db_option = crud.get_option(db, current_admin.store_id, option_id)
     if not db_option: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Option group ID {option_id} not found.")
-    return crud.create_option_value(db=db, option_value=option_value, option_id=option_id)
+    return crud.create_option_value(db, current_admin.store_id, option_value=option_value, option_id=option_id)
 
 @app.put("/admin/values/{value_id}", response_model=schemas.OptionValue)
 def update_existing_option_value(
@@ -343,7 +612,7 @@ def update_existing_option_value(
     current_admin: models.Admin = Depends(security.get_current_admin)
 ):
     """ADMIN API: Update option value"""
-    db_value = crud.update_option_value(db, value_id, option_value)
+    db_value = crud.update_option_value(db, current_admin.store_id, value_id, option_value)
     if db_value is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Option value not found")
     return db_value
@@ -352,7 +621,7 @@ def update_existing_option_value(
 def delete_existing_option_value(
     value_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_value = crud.delete_option_value(db, value_id)
+    db_value = crud.delete_option_value(db, current_admin.store_id, value_id)
     if db_value is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Option value not found")
     return db_value
 
@@ -360,9 +629,9 @@ def delete_existing_option_value(
 def link_options_to_product(
     product_id: int, link_request: schemas.ProductLinkOptionsRequest, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_product_check = crud.get_product(db, product_id)
+    db_product_check = crud.get_product(db, current_admin.store_id, product_id)
     if not db_product_check: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    db_product = crud.link_product_to_options(db, product_id, link_request.option_ids)
+    db_product = crud.link_product_to_options(db, current_admin.store_id, product_id, link_request.option_ids)
     return db_product
 
 # Voucher endpoints
@@ -370,22 +639,27 @@ def link_options_to_product(
 def create_new_voucher(
     voucher: schemas.VoucherCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    existing = db.query(models.Voucher).filter(models.Voucher.code == voucher.code).first()
+    existing = db.query(models.Voucher).filter(models.Voucher.store_id == current_admin.store_id, models.Voucher.code == voucher.code).first()
     if existing: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Voucher code '{voucher.code}' already exists.")
-    return crud.create_voucher(db=db, voucher=voucher)
+    return crud.create_voucher(db, current_admin.store_id, voucher=voucher)
 
 @app.get("/admin/vouchers/", response_model=List[schemas.Voucher])
 def read_all_vouchers(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
-): return crud.get_vouchers(db, skip=skip, limit=limit)
+    request: Request, response: Response,
+    skip: int = 0, limit: int = 100, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    """ADMIN API: List vouchers; 304 Not Modified when If-None-Match matches the current ETag"""
+    cached = not_modified(request, response, catalog_etag(db, current_admin.store_id, ("vouchers",), skip, limit))
+    if cached is not None: return cached
+    return crud.get_vouchers(db, current_admin.store_id, skip=skip, limit=limit)
 
 @app.put("/admin/vouchers/{voucher_id}", response_model=schemas.Voucher)
 def update_existing_voucher(
     voucher_id: int, voucher: schemas.VoucherCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    existing_check = db.query(models.Voucher).filter(models.Voucher.code == voucher.code, models.Voucher.id != voucher_id).first()
+    existing_check = db.query(models.Voucher).filter(models.Voucher.store_id == current_admin.store_id, models.Voucher.code == voucher.code, models.Voucher.id != voucher_id).first()
     if existing_check: raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Voucher code '{voucher.code}' already exists.")
-    db_voucher = crud.update_voucher(db, voucher_id=voucher_id, voucher=voucher)
+    db_voucher = crud.update_voucher(db, current_admin.store_id, voucher_id=voucher_id, voucher=voucher)
     if db_voucher is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voucher not found")
     return db_voucher
 
@@ -393,22 +667,43 @@ def update_existing_voucher(
 def delete_existing_voucher(
     voucher_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_voucher = crud.delete_voucher(db, voucher_id=voucher_id)
+    db_voucher = crud.delete_voucher(db, current_admin.store_id, voucher_id=voucher_id)
     if db_voucher is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Voucher not found")
     return db_voucher
 
 # Order endpoints
 @app.get("/admin/orders/", response_model=List[schemas.AdminOrderListResponse])
 def read_all_orders(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
+    skip: int = 0, limit: int = 100, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+):
+    return crud.get_orders(db, current_admin.store_id, skip=skip, limit=limit)
+
+@app.get("/admin/orders/export")
+def export_orders(
+    start_date: date, end_date: date, format: str = "csv", current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    return crud.get_orders(db, skip=skip, limit=limit)
+    """ADMIN API: Stream every order (with items & options) in a date range as CSV or NDJSON"""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format. Allowed: csv, ndjson")
+    if end_date < start_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_date must not be before start_date")
+    filename = f"orders_{start_date.isoformat()}_{end_date.isoformat()}.{format}"
+    if format == "csv":
+        content, media_type = order_export.iter_csv(current_admin.store_id, start_date, end_date), "text/csv; charset=utf-8"
+    else:
+        content, media_type = order_export.iter_ndjson(current_admin.store_id, start_date, end_date), "application/x-ndjson"
+    return StreamingResponse(content, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/admin/orders/summary", response_model=schemas.OrderStatusSummary) # Before /admin/orders/{order_id}
+def read_order_summary(db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Order count per status for dashboard badges (in-memory counters; deltas are pushed over the admin WebSocket as "order_counts")"""
+    return order_counters.summary(order_counters.counters.get(db, current_admin.store_id))
 
 @app.get("/admin/orders/{order_id}", response_model=schemas.OrderDetail)
 def read_order_details(
     order_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_order = crud.get_order_details(db, order_id=order_id)
+    db_order = crud.get_order_details(db, current_admin.store_id, order_id=order_id)
     if db_order is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
     return db_order
 
@@ -416,6 +711,53 @@ def read_order_details(
 def update_order_status(
     order_id: int, status: models.OrderStatus, db: Session = Depends(get_db), current_admin: models.Admin = Depends(security.get_current_admin)
 ):
-    db_order = crud.update_order_status(db, order_id, status)
+    db_order = crud.update_order_status(db, current_admin.store_id, order_id, status)
     if db_order is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
-    return db_order
\ No newline at end of file
+    return db_order
+
+# Report endpoints (chỉ đọc từ bảng rollup). Gross figures: cancelled orders are only split out
+# in the daily cancelled_* columns and the "status" breakdown (see reports.py)
+@app.get("/admin/reports/daily", response_model=List[schemas.DailySalesReport])
+def read_daily_report(
+    start_date: Optional[date] = None, end_date: Optional[date] = None, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+): return reports.get_daily_report(db, current_admin.store_id, start_date, end_date)
+
+@app.get("/admin/reports/hourly", response_model=List[schemas.HourlySalesReport])
+def read_hourly_report(
+    day: Optional[date] = None, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+): return reports.get_hourly_report(db, current_admin.store_id, day)
+
+@app.get("/admin/reports/breakdown", response_model=List[schemas.DimensionSalesReport])
+def read_dimension_report(
+    start_date: Optional[date] = None, end_date: Optional[date] = None, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+): return reports.get_dimension_report(db, current_admin.store_id, start_date, end_date)
+
+@app.get("/admin/reports/products", response_model=List[schemas.ProductSalesReport])
+def read_product_report(
+    start_date: Optional[date] = None, end_date: Optional[date] = None, limit: int = 50, db: Session = Depends(replica.get_read_db), current_admin: models.Admin = Depends(security.get_current_admin)
+): return reports.get_product_report(db, current_admin.store_id, start_date, end_date, limit)
+
+@app.get("/admin/system/admission")
+def read_admission_stats(current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Admission control counters per route class"""
+    return admission.stats()
+
+@app.get("/admin/system/side-effects")
+def read_side_effect_stats(current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Post-commit side-effect queue counters (depth, retries, drops)"""
+    return side_effects.queue.stats()
+
+@app.get("/admin/system/order-tracking")
+def read_order_tracking_stats(current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Orders remembered for customer tracking and customers currently waiting"""
+    return order_tracking.waiters.stats()
+
+@app.get("/admin/system/read-replica")
+def read_replica_stats(current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Read replica routing state (last measured lag, sessions routed to the replica, fallbacks to the primary)"""
+    return replica.router.stats()
+
+@app.get("/admin/system/logging")
+def read_logging_stats(current_admin: models.Admin = Depends(security.get_current_admin)):
+    """ADMIN API: Log queue depth and records dropped because the queue was full"""
+    return app_logging.stats()
@@ -0,0 +1,278 @@
+# Tệp: menu_io.py
+# Mục đích: Nhập / xuất toàn bộ menu của 1 cửa hàng (nhóm tùy chọn, lựa chọn, danh mục, món, liên kết)
+#
+# - Nhập = upsert theo TÊN, cả menu trong 1 transaction bằng vài câu lệnh hàng loạt
+#   (thay vì hàng trăm request POST, mỗi request 1 commit):
+#     nhóm tùy chọn: tên | lựa chọn: (nhóm, tên) | danh mục: tên | món: (danh mục, tên)
+#   Thứ không có trong file được giữ nguyên; liên kết món <-> nhóm tùy chọn của các món
+#   có trong file được thay bằng danh sách trong file
+# - Định dạng: JSON (schemas.MenuDocument) hoặc CSV (mỗi dòng 1 bản ghi, phân biệt bằng cột "record")
+#
+# CLI:  python menu_io.py export <slug cửa hàng> [--format csv] > menu.json
+#       python menu_io.py import <slug cửa hàng> menu.json|menu.csv
+
+import io
+import csv
+import sys
+import logging
+import argparse
+from collections import Counter
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import Session, selectinload
+import models
+import schemas
+from cache import cache_versions, catalog_namespaces
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = [
+    "record", "category", "product", "option", "value", "option_type", "description", "base_price",
+    "price_adjustment", "image_url", "is_best_seller", "is_out_of_stock", "display_order", "options",
+]
+CSV_LIST_SEPARATOR = "|" # Cột "options" của dòng món: "Đường|Đá|Topping"
+
+
+def _order(display_order, index: int) -> int:
+    return display_order if display_order is not None else index + 1
+
+
+def _ensure_unique(names, what: str):
+    duplicated = [name for name, count in Counter(names).items() if count > 1]
+    if duplicated:
+        raise ValueError(f"Trùng tên {what}: {', '.join(map(str, duplicated))}")
+
+
+def _validate(document: schemas.MenuDocument):
+    _ensure_unique([o.name for o in document.options], "nhóm tùy chọn")
+    for option in document.options:
+        _ensure_unique([v.name for v in option.values], f"lựa chọn trong '{option.name}'")
+    _ensure_unique([c.name for c in document.categories], "danh mục")
+    for category in document.categories:
+        _ensure_unique([p.name for p in category.products], f"món trong '{category.name}'")
+
+
+def _existing_ids(db: Session, key_columns, model, store_id: int) -> dict:
+    """Khóa tự nhiên -> id của các dòng đã có (trùng tên trong DB thì lấy id nhỏ nhất)"""
+    rows = db.execute(
+        select(model.id, *key_columns).where(model.store_id == store_id).order_by(model.id.desc())
+    ).all()
+    return {tuple(row[1:]) if len(key_columns) > 1 else row[1]: row[0] for row in rows}
+
+
+def _upsert(db: Session, model, rows: list, existing: dict, key_of):
+    """UPDATE hàng loạt theo id cho dòng đã có, INSERT ... RETURNING hàng loạt cho dòng mới"""
+    updates, inserts = [], []
+    for row in rows:
+        row_id = existing.get(key_of(row))
+        if row_id is None:
+            inserts.append(row)
+        else:
+            updates.append({"id": row_id, **row})
+    if updates:
+        db.execute(update(model), updates)
+    ids = dict(existing)
+    if inserts:
+        new_ids = db.execute(insert(model).returning(model.id, sort_by_parameter_order=True), inserts).scalars()
+        for row, new_id in zip(inserts, new_ids):
+            ids[key_of(row)] = new_id
+    return ids, len(inserts), len(updates)
+
+
+def import_menu(db: Session, store_id: int, document: schemas.MenuDocument) -> schemas.MenuImportResult:
+    """Ghi cả menu trong 1 transaction; lỗi (ValueError) thì không ghi gì"""
+    _validate(document)
+    created, updated = {}, {}
+    try:
+        # 1. Nhóm tùy chọn + lựa chọn
+        option_ids, created["options"], updated["options"] = _upsert(
+            db, models.Option,
+            [{"store_id": store_id, "name": o.name, "type": o.type, "display_order": _order(o.display_order, i)}
+             for i, o in enumerate(document.options)],
+            _existing_ids(db, [models.Option.name], models.Option, store_id), lambda row: row["name"],
+        )
+        _, created["option_values"], updated["option_values"] = _upsert(
+            db, models.OptionValue,
+            [{"store_id": store_id, "option_id": option_ids[o.name], "name": v.name,
+              "price_adjustment": v.price_adjustment, "is_out_of_stock": v.is_out_of_stock}
+             for o in document.options for v in o.values],
+            _existing_ids(db, [models.OptionValue.option_id, models.OptionValue.name], models.OptionValue, store_id),
+            lambda row: (row["option_id"], row["name"]),
+        )
+
+        # 2. Danh mục + món
+        category_ids, created["categories"], updated["categories"] = _upsert(
+            db, models.Category,
+            [{"store_id": store_id, "name": c.name, "display_order": _order(c.display_order, i)}
+             for i, c in enumerate(document.categories)],
+            _existing_ids(db, [models.Category.name], models.Category, store_id), lambda row: row["name"],
+        )
+        product_rows, product_options = [], []
+        for category in document.categories:
+            for i, p in enumerate(category.products):
+                product_rows.append({
+                    "store_id": store_id, "category_id": category_ids[category.name], "name": p.name,
+                    "description": p.description, "base_price": p.base_price, "image_url": p.image_url,
+                    "is_best_seller": p.is_best_seller, "is_out_of_stock": p.is_out_of_stock,
+                    "display_order": _order(p.display_order, i),
+                })
+                product_options.append(p.options)
+        product_ids, created["products"], updated["products"] = _upsert(
+            db, models.Product, product_rows,
+            _existing_ids(db, [models.Product.category_id, models.Product.name], models.Product, store_id),
+            lambda row: (row["category_id"], row["name"]),
+        )
+
+        # 3. Liên kết món <-> nhóm tùy chọn (nhóm có thể là nhóm đã có sẵn của cửa hàng)
+        links, imported_product_ids = [], []
+        for row, option_names in zip(product_rows, product_options):
+            product_id = product_ids[(row["category_id"], row["name"])]
+            imported_product_ids.append(product_id)
+            for option_name in dict.fromkeys(option_names):
+                if option_name not in option_ids:
+                    raise ValueError(f"Món '{row['name']}' dùng nhóm tùy chọn không tồn tại: '{option_name}'")
+                links.append({"product_id": product_id, "option_id": option_ids[option_name]})
+        if imported_product_ids:
+            db.execute(delete(models.ProductOptionAssociation).where(
+                models.ProductOptionAssociation.product_id.in_(imported_product_ids)
+            ))
+        if links:
+            db.execute(insert(models.ProductOptionAssociation), links)
+        created["links"] = len(links)
+
+        # Câu lệnh hàng loạt không qua flush của ORM => tự tăng version menu + các bảng (1 lần cho cả lô)
+        cache_versions.touch(db, *catalog_namespaces(store_id, models.Category, models.Product, models.Option))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info("Đã nhập menu", extra={"store_id": store_id, "rows_created": created, "rows_updated": updated})
+    return schemas.MenuImportResult(created=created, updated=updated)
+
+
+def export_menu(db: Session, store_id: int) -> schemas.MenuDocument:
+    options = (
+        db.query(models.Option)
+        .options(selectinload(models.Option.values))
+        .filter(models.Option.store_id == store_id)
+        .order_by(models.Option.display_order, models.Option.id)
+        .all()
+    )
+    categories = (
+        db.query(models.Category)
+        .options(selectinload(models.Category.products).selectinload(models.Product.options))
+        .filter(models.Category.store_id == store_id)
+        .order_by(models.Category.display_order, models.Category.id)
+        .all()
+    )
+    return schemas.MenuDocument(
+        options=[
+            schemas.MenuDocumentOption(
+                name=o.name, type=o.type, display_order=o.display_order,
+                values=[
+                    schemas.MenuDocumentOptionValue(name=v.name, price_adjustment=v.price_adjustment, is_out_of_stock=v.is_out_of_stock)
+                    for v in sorted(o.values, key=lambda v: v.id)
+                ],
+            )
+            for o in options
+        ],
+        categories=[
+            schemas.MenuDocumentCategory(
+                name=c.name, display_order=c.display_order,
+                products=[
+                    schemas.MenuDocumentProduct(
+                        name=p.name, description=p.description, base_price=p.base_price, image_url=p.image_url,
+                        is_best_seller=bool(p.is_best_seller), is_out_of_stock=p.is_out_of_stock, display_order=p.display_order,
+                        options=[o.name for o in sorted(p.options, key=lambda o: (o.display_order or 0, o.id))],
+                    )
+                    for p in c.products
+                ],
+            )
+            for c in categories
+        ],
+    )
+
+
+# --- CSV ---
+def document_to_csv(document: schemas.MenuDocument) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for o in document.options:
+        writer.writerow({"record": "option", "option": o.name, "option_type": o.type.value, "display_order": o.display_order})
+        for v in o.values:
+            writer.writerow({"record": "value", "option": o.name, "value": v.name, "price_adjustment": v.price_adjustment,
+                             "is_out_of_stock": int(v.is_out_of_stock)})
+    for c in document.categories:
+        writer.writerow({"record": "category", "category": c.name, "display_order": c.display_order})
+        for p in c.products:
+            writer.writerow({
+                "record": "product", "category": c.name, "product": p.name, "description": p.description,
+                "base_price": p.base_price, "image_url": p.image_url, "is_best_seller": int(p.is_best_seller),
+                "is_out_of_stock": int(p.is_out_of_stock), "display_order": p.display_order,
+                "options": CSV_LIST_SEPARATOR.join(p.options),
+            })
+    return buffer.getvalue()
+
+
+def document_from_csv(content: str) -> schemas.MenuDocument:
+    """Dòng "value" / "product" có thể đứng trước dòng "option" / "category" của nó"""
+    options, categories = {}, {}
+    for line, row in enumerate(csv.DictReader(io.StringIO(content)), start=2):
+        if row.get(None): # DictReader gom các ô thừa (nhiều hơn header) vào khóa None
+            raise ValueError(f"Dòng {line}: có {len(row[None])} ô thừa so với dòng tiêu đề")
+        fields = {key: value.strip() for key, value in row.items() if key and value and value.strip()}
+        record = fields.pop("record", "")
+        if record == "option":
+            option = options.setdefault(fields.get("option"), {"name": fields.get("option"), "values": []})
+            option.update(type=fields.get("option_type", "CHON_NHIEU"), display_order=fields.get("display_order"))
+        elif record == "value":
+            option = options.setdefault(fields.get("option"), {"name": fields.get("option"), "values": []})
+            option["values"].append({"name": fields.get("value"), **{
+                key: fields[key] for key in ("price_adjustment", "is_out_of_stock") if key in fields
+            }})
+        elif record == "category":
+            category = categories.setdefault(fields.get("category"), {"name": fields.get("category"), "products": []})
+            category["display_order"] = fields.get("display_order")
+        elif record == "product":
+            category = categories.setdefault(fields.get("category"), {"name": fields.get("category"), "products": []})
+            product = {key: fields[key] for key in (
+                "description", "base_price", "image_url", "is_best_seller", "is_out_of_stock", "display_order"
+            ) if key in fields}
+            product["name"] = fields.get("product")
+            product["options"] = [name.strip() for name in fields.get("options", "").split(CSV_LIST_SEPARATOR) if name.strip()]
+            category["products"].append(product)
+        else:
+            raise ValueError(f"Dòng {line}: cột record phải là option / value / category / product")
+    return schemas.MenuDocument(options=list(options.values()), categories=list(categories.values()))
+
+
+if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
+    from tenancy import directory
+
+    parser = argparse.ArgumentParser(description="Nhập / xuất menu của 1 cửa hàng")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("store")
+    export_parser.add_argument("--format", choices=["json", "csv"], default="json")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("store")
+    import_parser.add_argument("file", help="File .json hoặc .csv")
+    args = parser.parse_args()
+
+    store_id = directory.resolve(args.store, None)
+    if store_id is None:
+        parser.error(f"Không có cửa hàng '{args.store}'")
+    db = models.SessionLocal()
+    try:
+        if args.command == "export":
+            document = export_menu(db, store_id)
+            sys.stdout.write(document_to_csv(document) if args.format == "csv" else document.model_dump_json(indent=2))
+        else:
+            with open(args.file, encoding="utf-8-sig") as f:
+                content = f.read()
+            document = document_from_csv(content) if args.file.endswith(".csv") else schemas.MenuDocument.model_validate_json(content)
+            result = import_menu(db, store_id, document)
+            logger.info("Tạo mới: %s | Cập nhật: %s", result.created, result.updated)
+    finally:
+        db.close()
@@ -0,0 +1,139 @@
+# Tệp: menu_search.py
+# Mục đích: Tìm món trong menu công khai, không phân biệt dấu ("tra sua" -> "Trà Sữa Matcha")
+#
+# - Chỉ mục trong bộ nhớ, mỗi cửa hàng 1 bản: từ (đã bỏ dấu) -> {món: trọng số} + danh sách từ đã sắp xếp
+#   để tra tiền tố bằng bisect; kết quả theo tiền tố được nhớ lại (gõ từng phím lặp lại cùng tiền tố)
+#   Nguồn: tên món, tên danh mục, tên lựa chọn (vd. topping), lấy từ JSON menu đã cache
+#   => dựng chỉ mục không tốn thêm truy vấn, mất DB vẫn tìm được trên menu snapshot
+# - Chỉ dựng lại chỉ mục của cửa hàng có menu đổi (menu_cache trả về bản JSON mới),
+#   lần tìm kiếm sau đó dựng lại; cửa hàng khác giữ nguyên
+# - Tìm: mọi từ trong câu tìm đều phải khớp (khớp tiền tố); điểm = tổng trọng số trường khớp,
+#   khớp trọn từ được gấp đôi; hòa điểm thì giữ thứ tự trên menu
+
+import re
+import json
+import heapq
+import bisect
+import threading
+import unicodedata
+from typing import List
+from cache import cache_versions
+
+# Trọng số theo trường
+NAME_WEIGHT = 3.0
+CATEGORY_WEIGHT = 1.0
+OPTION_VALUE_WEIGHT = 0.5
+EXACT_WORD_BONUS = 2.0
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def fold(text: str) -> str:
+    """Bỏ dấu tiếng Việt + chữ thường ("Trà Sữa Đá" -> "tra sua da")"""
+    decomposed = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", stripped).strip()
+
+
+def _words(text) -> List[str]:
+    return fold(text).split() if text else []
+
+
+class _StoreIndex:
+    def __init__(self, categories: list):
+        self.products = [] # Theo thứ tự trên menu
+        self._word_postings = {} # từ -> {vị trí món: trọng số}
+        self._prefix_postings = {} # tiền tố -> {vị trí món: điểm}, dựng dần theo các lần tìm
+        self._prefix_ranked = {} # tiền tố -> [(-điểm, vị trí)] đã sắp xếp, cho câu tìm 1 từ (đang gõ)
+        words_of = {} # Tên topping lặp lại ở rất nhiều món: bỏ dấu 1 lần cho mỗi chuỗi
+        for category in categories:
+            for product in category["products"]:
+                position = len(self.products)
+                self.products.append({
+                    "id": product["id"],
+                    "name": product["name"],
+                    "category_id": category["id"],
+                    "category_name": category["name"],
+                    "base_price": product["base_price"],
+                    "image_url": product["image_url"],
+                    "is_out_of_stock": product["is_out_of_stock"],
+                })
+                fields = [(product["name"], NAME_WEIGHT), (category["name"], CATEGORY_WEIGHT)]
+                fields += [(value["name"], OPTION_VALUE_WEIGHT) for option in product["options"] for value in option["values"]]
+                for text, weight in fields:
+                    words = words_of.get(text)
+                    if words is None:
+                        words = words_of[text] = _words(text)
+                    for word in words:
+                        postings = self._word_postings.setdefault(word, {})
+                        if weight > postings.get(position, 0):
+                            postings[position] = weight
+        self._vocabulary = sorted(self._word_postings)
+
+    def _postings(self, prefix: str) -> dict:
+        """Điểm của mọi món có từ bắt đầu bằng prefix (khớp trọn từ được gấp đôi)"""
+        cached = self._prefix_postings.get(prefix)
+        if cached is not None:
+            return cached
+        scores = {}
+        for i in range(bisect.bisect_left(self._vocabulary, prefix), len(self._vocabulary)):
+            word = self._vocabulary[i]
+            if not word.startswith(prefix):
+                break
+            bonus = EXACT_WORD_BONUS if word == prefix else 1.0
+            for position, weight in self._word_postings[word].items():
+                if weight * bonus > scores.get(position, 0):
+                    scores[position] = weight * bonus
+        if scores: # Chỉ giữ tiền tố có thật trong menu => bộ nhớ không tăng theo câu tìm bất kỳ
+            self._prefix_postings[prefix] = scores
+        return scores
+
+    def _ranked(self, prefix: str) -> list:
+        ranked = self._prefix_ranked.get(prefix)
+        if ranked is None:
+            ranked = sorted((-score, position) for position, score in self._postings(prefix).items())
+            if ranked:
+                self._prefix_ranked[prefix] = ranked
+        return ranked
+
+    def _results(self, ranked) -> list:
+        return [dict(self.products[position], score=-score) for score, position in ranked]
+
+    def search(self, query: str, limit: int) -> list:
+        words = _words(query)
+        if not words:
+            return []
+        if len(words) == 1:
+            return self._results(self._ranked(words[0])[:limit])
+        # Duyệt từ có ít món nhất trước => tập ứng viên nhỏ ngay từ đầu
+        matches = sorted((self._postings(word) for word in words), key=len)
+        totals = matches[0]
+        for scores in matches[1:]:
+            totals = {position: total + scores[position] for position, total in totals.items() if position in scores}
+            if not totals:
+                return []
+        return self._results(heapq.nsmallest(limit, [(-score, position) for position, score in totals.items()]))
+
+
+class MenuSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {} # store_id -> (menu body đã dùng để dựng, _StoreIndex)
+
+    def search(self, store_id: int, menu_body: bytes, query: str, limit: int = 20) -> list:
+        """menu_body: JSON menu hiện tại của cửa hàng (crud.get_public_menu_json)"""
+        with self._lock:
+            entry = self._indexes.get(store_id)
+        if entry is None or entry[0] is not menu_body:
+            entry = (menu_body, _StoreIndex(json.loads(menu_body)))
+            with self._lock:
+                self._indexes[store_id] = entry
+        return entry[1].search(query, limit)
+
+    def clear(self, store_id: int):
+        with self._lock:
+            self._indexes.pop(store_id, None)
+
+
+search_index = MenuSearchIndex()
+cache_versions.on_change("menu", search_index.clear) # Menu đổi => bỏ chỉ mục cũ ngay, không giữ bộ nhớ
@@ -0,0 +1,165 @@
+# Tệp: migrations.py
+# Mục đích: Quản lý phiên bản schema CSDL (bảng schema_version)
+#           Chỉ chạy migration khi version trong DB khác LATEST_VERSION;
+#           lần khởi động bình thường chỉ tốn đúng 1 câu SELECT
+#
+# Quy ước khi thêm migration mới:
+# - Thêm hàm _vN_... và 1 dòng vào MIGRATIONS (không sửa migration cũ)
+# - Viết DDL dạng idempotent (IF NOT EXISTS ...): DB mới tạo bằng v1 (create_all
+#   theo models hiện tại) đã có sẵn mọi cột/index, các bước sau phải "không làm gì"
+
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+import models
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = "schema_version"
+# Khóa advisory của Postgres: nhiều container/worker khởi động cùng lúc chỉ 1 cái được migrate
+MIGRATION_LOCK_ID = 74300001
+
+
+def _v1_create_tables(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+
+def _v2_order_foreign_key_indexes(conn: Connection):
+    # get_order_details / archive.py lọc order_items theo order_id, order_item_options theo order_item_id
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_item_options_order_item_id ON order_item_options (order_item_id)"))
+
+
+def _v3_cache_versions(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.CacheVersion.__table__])
+
+
+# Bảng có cột store_id (tham chiếu stores) và các index bắt đầu bằng store_id
+_STORE_SCOPED_TABLES = ("categories", "products", "options", "option_values", "orders", "vouchers", "admins")
+_ROLLUP_PRIMARY_KEYS = {
+    "sales_rollup_daily": ("bucket_date",),
+    "sales_rollup_hourly": ("bucket_hour",),
+    "sales_rollup_dimension": ("bucket_date", "dimension", "dimension_value"),
+    "sales_rollup_product": ("bucket_date", "product_name"),
+}
+
+
+def _v4_stores(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.Store.__table__, models.StoreDomain.__table__])
+    conn.execute(text(
+        "INSERT INTO stores (id, slug, name, is_active) VALUES (:id, 'default', 'Cửa hàng mặc định', true) "
+        "ON CONFLICT (id) DO NOTHING"
+    ), {"id": models.DEFAULT_STORE_ID})
+    conn.execute(text("SELECT setval(pg_get_serial_sequence('stores', 'id'), (SELECT max(id) FROM stores))"))
+
+    # Dữ liệu có sẵn thuộc về cửa hàng mặc định
+    default = models.DEFAULT_STORE_ID
+    for table in _STORE_SCOPED_TABLES:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS store_id INTEGER NOT NULL DEFAULT {default} REFERENCES stores (id)"))
+    conn.execute(text(f"ALTER TABLE orders_archive ADD COLUMN IF NOT EXISTS store_id INTEGER NOT NULL DEFAULT {default}"))
+
+    # Mã voucher / username chỉ cần duy nhất trong 1 cửa hàng
+    conn.execute(text("DROP INDEX IF EXISTS ix_vouchers_code"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_admins_username"))
+    for model in (models.Category, models.Product, models.Option, models.Order, models.Voucher, models.Admin, models.ArchivedOrder):
+        for index in model.__table__.indexes:
+            if "store_id" in index.columns:
+                index.create(bind=conn, checkfirst=True)
+
+    # Rollup báo cáo: khóa chính thêm store_id ở đầu
+    for table, key_columns in _ROLLUP_PRIMARY_KEYS.items():
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS store_id INTEGER NOT NULL DEFAULT {default}"))
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN store_id DROP DEFAULT"))
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey"))
+        conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (store_id, {', '.join(key_columns)})"))
+
+    # Bộ đếm cache giờ tính theo cửa hàng ("menu:{store_id}", "vouchers:{store_id}")
+    conn.execute(text("DELETE FROM cache_versions WHERE name IN ('categories', 'products', 'options', 'vouchers')"))
+
+
+# Bản chụp món của đơn cũ dựng lại từ order_items / order_item_options (cùng dạng với crud._items_snapshot)
+_ITEMS_SNAPSHOT_BACKFILL = """
+UPDATE {orders} o SET items_snapshot = COALESCE((
+    SELECT jsonb_agg(jsonb_build_object(
+        'id', i.id, 'product_name', i.product_name, 'quantity', i.quantity,
+        'item_price', i.item_price, 'item_note', i.item_note,
+        'options_selected', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'option_name', io.option_name, 'value_name', io.value_name, 'added_price', io.added_price
+            ) ORDER BY io.id)
+            FROM {item_options} io WHERE io.order_item_id = i.id
+        ), '[]'::jsonb)
+    ) ORDER BY i.id)
+    FROM {items} i WHERE i.order_id = o.id
+), '[]'::jsonb)
+WHERE o.items_snapshot IS NULL
+"""
+
+
+def _v5_order_items_snapshot(conn: Connection):
+    for orders, items, item_options in (
+        ("orders", "order_items", "order_item_options"),
+        ("orders_archive", "order_items_archive", "order_item_options_archive"),
+    ):
+        conn.execute(text(f"ALTER TABLE {orders} ADD COLUMN IF NOT EXISTS items_snapshot JSONB"))
+        conn.execute(text(_ITEMS_SNAPSHOT_BACKFILL.format(orders=orders, items=items, item_options=item_options)))
+
+
+def _v6_order_status_counts(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.OrderStatusCount.__table__])
+    conn.execute(text(
+        "INSERT INTO order_status_counts (store_id, status, order_count) "
+        "SELECT store_id, status::text, count(*) FROM ("
+        "SELECT store_id, status FROM orders UNION ALL SELECT store_id, status FROM orders_archive"
+        ") o GROUP BY store_id, status "
+        "ON CONFLICT (store_id, status) DO NOTHING"
+    ))
+
+
+MIGRATIONS = [
+    (1, "Tạo các bảng", _v1_create_tables),
+    (2, "Index khóa ngoại của đơn hàng", _v2_order_foreign_key_indexes),
+    (3, "Bảng cache_versions", _v3_cache_versions),
+    (4, "Nhiều cửa hàng (stores, store_id)", _v4_stores),
+    (5, "Bản chụp món trong đơn hàng (items_snapshot)", _v5_order_items_snapshot),
+    (6, "Bộ đếm đơn theo trạng thái", _v6_order_status_counts),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> int:
+    """Version hiện tại của DB (0 nếu chưa từng migrate)"""
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": SCHEMA_VERSION_TABLE}).scalar() is None:
+        return 0
+    return conn.execute(text(f"SELECT version FROM {SCHEMA_VERSION_TABLE}")).scalar() or 0
+
+
+def upgrade(engine):
+    """
+    Đưa schema lên LATEST_VERSION (1 transaction, DDL của Postgres có rollback)
+
+    Trả về (version cũ, version mới)
+    """
+    with engine.connect() as conn: # Đường nhanh: đã mới nhất thì không khóa gì cả
+        version = current_version(conn)
+    if version == LATEST_VERSION:
+        return version, version
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        version = current_version(conn) # Đọc lại sau khi có khóa
+        old_version = version
+        if version > LATEST_VERSION:
+            raise RuntimeError(f"Schema DB (v{version}) mới hơn code (v{LATEST_VERSION}), hãy triển khai code mới hơn.")
+
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (version INTEGER NOT NULL)"))
+        for migration_version, description, apply in MIGRATIONS:
+            if migration_version > version:
+                logger.info("Đang chạy migration v%s: %s...", migration_version, description)
+                apply(conn)
+
+        updated = conn.execute(text(f"UPDATE {SCHEMA_VERSION_TABLE} SET version = :v"), {"v": LATEST_VERSION}).rowcount
+        if not updated:
+            conn.execute(text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version) VALUES (:v)"), {"v": LATEST_VERSION})
+    return old_version, LATEST_VERSION
@@ -0,0 +1,74 @@
+# Tệp: order_counters.py
+# Mục đích: Số đơn theo trạng thái ("3 mới, 2 đang làm, 1 đang giao") cho dashboard admin
+#
+# - Nguồn tin cậy: bảng order_status_counts, được cộng/trừ CÙNG transaction với đơn
+#   (reports.record_order_created / record_status_change)
+# - Mỗi worker giữ 1 bản trong bộ nhớ: nạp từ DB ở lần đọc đầu (1 truy vấn), sau đó cộng delta
+#   của đơn do chính worker ghi (sau commit); delta của worker khác tới qua event bus
+# - Tin qua event bus có thể mất (lúc LISTEN kết nối lại) => đọc lại từ DB
+#   tối đa 1 lần / ORDER_COUNTS_RESYNC_SECONDS
+# - Admin nhận delta qua WebSocket: {"type": "order_counts", "store_id": 1, "delta": {"MOI": -1, "DA_XAC_NHAN": 1}}
+
+import os
+import time
+import threading
+from sqlalchemy.orm import Session
+import models
+import reports
+
+ORDER_COUNTS_RESYNC_SECONDS = float(os.getenv("ORDER_COUNTS_RESYNC_SECONDS", "60"))
+# Đơn đã xong, không tính vào badge "đang xử lý"
+FINISHED_STATUSES = (models.OrderStatus.HOAN_TAT.value, models.OrderStatus.DA_HUY.value)
+MESSAGE_TYPE = "order_counts"
+
+
+class OrderStatusCounters:
+    def __init__(self, resync_seconds: float):
+        self.resync_seconds = resync_seconds
+        self._lock = threading.Lock()
+        self._counts = {} # store_id -> (thời điểm nạp, {trạng thái: số đơn})
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """listener(message) được gọi sau mỗi thay đổi do worker này ghi (vd. đẩy qua WebSocket)"""
+        self._listeners.append(listener)
+
+    def get(self, db: Session, store_id: int) -> dict:
+        with self._lock:
+            entry = self._counts.get(store_id)
+            if entry is not None and time.monotonic() - entry[0] < self.resync_seconds:
+                return dict(entry[1])
+        counts = reports.get_status_counts(db, store_id)
+        with self._lock:
+            self._counts[store_id] = (time.monotonic(), counts)
+        return dict(counts)
+
+    def _apply(self, store_id: int, delta: dict):
+        with self._lock:
+            entry = self._counts.get(store_id)
+            if entry is None: # Chưa nạp: lần đọc đầu sẽ lấy số đúng từ DB
+                return
+            for status, change in delta.items():
+                entry[1][status] = entry[1].get(status, 0) + change
+
+    def record(self, store_id: int, delta: dict):
+        """Gọi SAU commit với thay đổi của đơn, vd. {"MOI": -1, "DA_XAC_NHAN": 1}"""
+        delta = {status: change for status, change in delta.items() if change}
+        if not delta:
+            return
+        self._apply(store_id, delta)
+        message = {"type": MESSAGE_TYPE, "store_id": store_id, "delta": delta, "origin": os.getpid()} # pid lúc gửi: preload_app import trước khi fork
+        for listener in self._listeners:
+            listener(message)
+
+    def apply_remote(self, message: dict):
+        """Tin từ event bus: chỉ cộng delta do worker KHÁC ghi (của mình đã cộng trong record)"""
+        if message.get("type") == MESSAGE_TYPE and message.get("origin") != os.getpid():
+            self._apply(message["store_id"], message["delta"])
+
+
+def summary(counts: dict) -> dict:
+    return {"counts": counts, "active": sum(n for status, n in counts.items() if status not in FINISHED_STATUSES)}
+
+
+counters = OrderStatusCounters(ORDER_COUNTS_RESYNC_SECONDS)
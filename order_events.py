@@ -0,0 +1,78 @@
+# Tệp: order_events.py
+# Mục đích: Gom các sự kiện đổi trạng thái đơn trước khi đẩy qua WebSocket admin
+#
+# - Bếp bấm liên tục (MOI -> DA_XAC_NHAN -> DANG_THUC_HIEN) trong ORDER_EVENT_COALESCE_MS
+#   => admin nhận 1 tin cho mỗi đơn:
+#       {"type": "order_status_changed", "store_id": 1, "order_id": 12, "previous_status": "MOI",
+#        "status": "DANG_THUC_HIEN", "transitions": 2, "updated_at": "..."}
+#   Bấm qua lại rồi về đúng trạng thái ban đầu => không gửi gì
+# - Delta bộ đếm (order_counts, xem order_counters.py) trong cùng khoảng được cộng lại: 1 tin mỗi cửa hàng
+# - Sự kiện tới qua side_effects (sau commit); mỗi worker gom sự kiện do chính nó ghi
+
+import logging
+import os
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENT_COALESCE_MS = float(os.getenv("ORDER_EVENT_COALESCE_MS", "250"))
+
+
+class OrderEventCoalescer:
+    def __init__(self, window_seconds: float):
+        self.window = window_seconds
+        self._publish = None
+        self._pending = {} # store_id -> {"orders": {order_id: tin}, "counts": {trạng thái: delta}, "origin": pid}
+        self._timers = {} # store_id -> TimerHandle của lần gửi sắp tới
+
+    def connect(self, publish):
+        """publish(message): hàm async gửi tin cho admin (manager.broadcast)"""
+        self._publish = publish
+
+    def _pending_for(self, store_id: int) -> dict:
+        pending = self._pending.get(store_id)
+        if pending is None: # Sự kiện đầu tiên của cửa hàng trong khoảng gom: hẹn giờ gửi
+            pending = self._pending[store_id] = {"orders": {}, "counts": {}, "origin": None}
+            loop = asyncio.get_running_loop()
+            self._timers[store_id] = loop.call_later(self.window, lambda: loop.create_task(self._flush(store_id)))
+        return pending
+
+    async def add_status_change(self, message: dict):
+        """Handler side_effects cho "order_status_changed" """
+        orders = self._pending_for(message["store_id"])["orders"]
+        current = orders.get(message["order_id"])
+        if current is None:
+            orders[message["order_id"]] = dict(message, transitions=1)
+        else: # Giữ previous_status của lần đầu, lấy trạng thái mới nhất
+            current.update(status=message["status"], updated_at=message["updated_at"], transitions=current["transitions"] + 1)
+
+    async def add_counts(self, message: dict):
+        """Handler side_effects cho "order_counts" """
+        pending = self._pending_for(message["store_id"])
+        for status, change in message["delta"].items():
+            pending["counts"][status] = pending["counts"].get(status, 0) + change
+        pending["origin"] = message["origin"]
+
+    async def _flush(self, store_id: int):
+        self._timers.pop(store_id, None)
+        pending = self._pending.pop(store_id, None)
+        if pending is None:
+            return
+        messages = [message for message in pending["orders"].values() if message["status"] != message["previous_status"]]
+        delta = {status: change for status, change in pending["counts"].items() if change}
+        if delta:
+            messages.append({"type": "order_counts", "store_id": store_id, "delta": delta, "origin": pending["origin"]})
+        for message in messages:
+            try:
+                await self._publish(message)
+            except Exception as e: # Chỉ là thông báo: trạng thái đã nằm trong DB
+                logger.warning("Không gửi được %s: %s", message["type"], e, extra={"store_id": store_id})
+
+    async def flush_all(self):
+        """Gửi ngay mọi tin đang gom (lúc tắt server)"""
+        for store_id, timer in list(self._timers.items()):
+            timer.cancel()
+            await self._flush(store_id)
+
+
+coalescer = OrderEventCoalescer(ORDER_EVENT_COALESCE_MS / 1000)
@@ -0,0 +1,137 @@
+# Tệp: order_export.py
+# Mục đích: Xuất toàn bộ đơn hàng của 1 cửa hàng (kèm món & tùy chọn, cả đơn đã lưu trữ) theo khoảng ngày, dạng CSV / NDJSON
+#           Đọc bằng server-side cursor (yield_per) và stream từng đoạn => bộ nhớ không tăng theo số dòng
+
+import io
+import os
+import csv
+import json
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import select
+import models
+import replica
+from reports import REPORT_OFFSET
+
+# Số dòng mỗi lần lấy từ cursor phía server
+EXPORT_BATCH_SIZE = int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "1000"))
+# Gom bao nhiêu dòng thì đẩy 1 đoạn ra response
+EXPORT_CHUNK_ROWS = 500
+
+CSV_COLUMNS = [
+    "order_id", "created_at", "status", "customer_name", "customer_phone", "customer_address",
+    "customer_note", "payment_method", "delivery_method", "voucher_code", "sub_total",
+    "delivery_fee", "discount_amount", "total_amount", "item_id", "product_name", "quantity",
+    "item_price", "item_note", "option_name", "value_name", "added_price",
+]
+
+
+def _utc_range(start_date: date, end_date: date):
+    """Khoảng ngày theo giờ báo cáo -> [start, end) theo UTC"""
+    start = datetime.combine(start_date, time.min, tzinfo=timezone.utc) - REPORT_OFFSET
+    end = datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=timezone.utc) - REPORT_OFFSET
+    return start, end
+
+
+# Đọc bảng archive trước (đơn cũ), rồi bảng "nóng"
+_SOURCES = (
+    (models.ArchivedOrder, models.ArchivedOrderItem, models.ArchivedOrderItemOption),
+    (models.Order, models.OrderItem, models.OrderItemOption),
+)
+
+
+def _export_statement(store_id: int, start_date: date, end_date: date, order, item, option):
+    """1 dòng cho mỗi (đơn, món, tùy chọn), sắp theo đơn -> món -> tùy chọn"""
+    start, end = _utc_range(start_date, end_date)
+    return select(
+        order.id, order.created_at, order.status, order.customer_name, order.customer_phone,
+        order.customer_address, order.customer_note, order.payment_method, order.delivery_method_selected,
+        order.voucher_code, order.sub_total, order.delivery_fee, order.discount_amount, order.total_amount,
+        item.id, item.product_name, item.quantity, item.item_price, item.item_note,
+        option.option_name, option.value_name, option.added_price,
+    ).select_from(order).outerjoin(
+        item, item.order_id == order.id
+    ).outerjoin(
+        option, option.order_item_id == item.id
+    ).where(
+        order.store_id == store_id, order.created_at >= start, order.created_at < end
+    ).order_by(
+        order.id, item.id, option.id
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE) # psycopg2: dùng server-side cursor
+
+
+def _iter_rows(store_id: int, start_date: date, end_date: date):
+    """Duyệt từng dòng bằng Session riêng (sống đến khi stream xong), ưu tiên bản sao đọc"""
+    db = replica.router.session()
+    try:
+        # 1 snapshot cho cả 2 bảng: đơn được archive_orders() chuyển đi giữa 2 câu SELECT không bị mất
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        for order, item, option in _SOURCES:
+            for row in db.execute(_export_statement(store_id, start_date, end_date, order, item, option)):
+                yield row
+    finally:
+        db.close()
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if hasattr(value, "value"): # Enum
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(store_id: int, start_date: date, end_date: date):
+    """Sinh CSV theo từng đoạn"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    rows_in_buffer = 0
+    for row in _iter_rows(store_id, start_date, end_date):
+        writer.writerow([_cell(value) for value in row])
+        rows_in_buffer += 1
+        if rows_in_buffer >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows_in_buffer = 0
+    yield buffer.getvalue()
+
+
+def iter_ndjson(store_id: int, start_date: date, end_date: date):
+    """Sinh NDJSON: mỗi dòng là 1 đơn hàng đầy đủ (items[].options_selected[])"""
+    chunk = []
+    current = None
+    current_item = None
+
+    for row in _iter_rows(store_id, start_date, end_date):
+        values = dict(zip(CSV_COLUMNS, (_cell(value) if value is not None else None for value in row)))
+        if current is None or current["id"] != values["order_id"]:
+            if current is not None:
+                chunk.append(json.dumps(current, ensure_ascii=False))
+                if len(chunk) >= EXPORT_CHUNK_ROWS:
+                    yield "\n".join(chunk) + "\n"
+                    chunk = []
+            current = {
+                "id": values["order_id"],
+                **{key: values[key] for key in CSV_COLUMNS[1:14]},
+                "items": [],
+            }
+            current_item = None
+        if values["item_id"] is not None and (current_item is None or current_item["id"] != values["item_id"]):
+            current_item = {
+                "id": values["item_id"],
+                **{key: values[key] for key in ("product_name", "quantity", "item_price", "item_note")},
+                "options_selected": [],
+            }
+            current["items"].append(current_item)
+        if values["option_name"] is not None:
+            current_item["options_selected"].append(
+                {key: values[key] for key in ("option_name", "value_name", "added_price")}
+            )
+
+    if current is not None:
+        chunk.append(json.dumps(current, ensure_ascii=False))
+    if chunk:
+        yield "\n".join(chunk) + "\n"
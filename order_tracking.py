@@ -0,0 +1,123 @@
+# Tệp: order_tracking.py
+# Mục đích: Khách theo dõi trạng thái đơn (long-poll / SSE) mà không truy vấn DB liên tục
+#
+# - POST /orders trả về tracking_token (ký bằng SECRET_KEY, chỉ mở được đúng 1 đơn)
+# - Mỗi worker giữ trạng thái mới nhất của các đơn đang được theo dõi (LRU ORDER_TRACKING_CACHE_SIZE)
+#   và danh sách khách đang chờ theo từng đơn. Đơn vừa tạo ở worker này có sẵn trạng thái MOI;
+#   đơn chưa có trong bộ nhớ tốn đúng 1 truy vấn rồi được nhớ lại
+# - crud.update_order_status gọi changed() ngay sau commit: khách chờ ở worker này được đánh thức
+#   luôn, không qua hàng đợi side effect / gom tin của admin => chờ bao lâu cũng 0 truy vấn
+# - Worker khác nhận cùng sự kiện "order_status_changed" qua event bus (main.deliver_admin_event -> notify())
+# - Tin qua event bus có thể mất lúc LISTEN kết nối lại => trạng thái nhớ quá
+#   ORDER_TRACKING_RESYNC_SECONDS thì đọc lại DB ở lần hỏi sau
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+import models
+
+ORDER_TRACKING_CACHE_SIZE = int(os.getenv("ORDER_TRACKING_CACHE_SIZE", "10000"))
+ORDER_TRACKING_RESYNC_SECONDS = float(os.getenv("ORDER_TRACKING_RESYNC_SECONDS", "300"))
+ORDER_TRACKING_TIMEOUT = float(os.getenv("ORDER_TRACKING_TIMEOUT", "25")) # Long-poll tối đa (giây)
+ORDER_TRACKING_KEEPALIVE = float(os.getenv("ORDER_TRACKING_KEEPALIVE", "15")) # SSE: comment giữ kết nối
+# Trạng thái cuối: SSE đóng luồng, long-poll trả về ngay
+FINAL_STATUSES = (models.OrderStatus.HOAN_TAT.value, models.OrderStatus.DA_HUY.value)
+
+
+def _load_status(store_id: int, order_id: int):
+    """(status, updated_at) từ DB, hoặc None nếu không có đơn (chạy trong thread)"""
+    db = models.SessionLocal()
+    try:
+        row = db.query(models.Order.status, models.Order.updated_at).filter(
+            models.Order.store_id == store_id, models.Order.id == order_id
+        ).first()
+    finally:
+        db.close()
+    return (row.status.value, row.updated_at.isoformat()) if row is not None else None
+
+
+class OrderWaiters:
+    def __init__(self, cache_size: int, resync_seconds: float):
+        self.cache_size = cache_size
+        self.resync_seconds = resync_seconds
+        self._latest = OrderedDict() # (store_id, order_id) -> (status, updated_at, lúc ghi nhận)
+        self._waiters = {} # (store_id, order_id) -> {Future} của khách đang chờ (cùng event loop)
+        self._loop = None # Event loop của các Future trên (ghi lúc có khách chờ đầu tiên)
+
+    def remember(self, store_id: int, order_id: int, status: str, updated_at: str):
+        key = (store_id, order_id)
+        self._latest[key] = (status, updated_at, time.monotonic())
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.cache_size:
+            self._latest.popitem(last=False)
+
+    async def current(self, store_id: int, order_id: int):
+        """(status, updated_at) mới nhất; chỉ đọc DB khi chưa nhớ hoặc đã quá hạn"""
+        entry = self._latest.get((store_id, order_id))
+        if entry is not None and time.monotonic() - entry[2] < self.resync_seconds:
+            return entry[:2]
+        loaded = await asyncio.to_thread(_load_status, store_id, order_id)
+        if loaded is not None:
+            self.remember(store_id, order_id, *loaded)
+        return loaded
+
+    async def wait(self, store_id: int, order_id: int, known_status: str, timeout: float):
+        """Chờ trạng thái khác known_status; hết giờ thì trả về trạng thái hiện tại (có thể vẫn như cũ)"""
+        key = (store_id, order_id)
+        entry = self._latest.get(key)
+        if entry is not None and entry[0] != known_status:
+            return entry[:2]
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        self._waiters.setdefault(key, set()).add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            entry = self._latest.get(key)
+            return entry[:2] if entry is not None else (known_status, None)
+        finally:
+            waiting = self._waiters.get(key)
+            if waiting is not None:
+                waiting.discard(future)
+                if not waiting:
+                    del self._waiters[key]
+
+    def changed(self, message: dict):
+        """Đơn vừa đổi trạng thái ở worker này; gọi được từ thread của endpoint sync (chuyển về event loop)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.notify(message) # Chưa ai chờ: chỉ cập nhật trạng thái đã nhớ
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.notify(message)
+        else:
+            loop.call_soon_threadsafe(self.notify, message)
+
+    def notify(self, message: dict):
+        """Cập nhật trạng thái + đánh thức khách đang chờ (chạy trên event loop); chỉ xử lý "order_status_changed" """
+        if message.get("type") != "order_status_changed":
+            return
+        key = (message["store_id"], message["order_id"])
+        entry = self._latest.get(key)
+        if entry is not None and entry[1] and datetime.fromisoformat(entry[1]) > datetime.fromisoformat(message["updated_at"]):
+            return # Tin đến trễ, đã có trạng thái mới hơn
+        self.remember(*key, message["status"], message["updated_at"])
+        for future in self._waiters.pop(key, ()):
+            if not future.done():
+                future.set_result((message["status"], message["updated_at"]))
+
+    def stats(self) -> dict:
+        return {
+            "tracked_orders": len(self._latest),
+            "waiting_orders": len(self._waiters),
+            "waiting_clients": sum(len(waiting) for waiting in self._waiters.values()),
+        }
+
+
+waiters = OrderWaiters(ORDER_TRACKING_CACHE_SIZE, ORDER_TRACKING_RESYNC_SECONDS)
@@ -0,0 +1,226 @@
+# Tệp: query_profiler.py
+# Mục đích: Đếm truy vấn SQL theo từng request, log truy vấn chậm,
+#           phát hiện N+1 (lazy load lặp lại) và kiểm tra "ngân sách truy vấn"
+
+import logging
+import os
+import time
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# --- Cấu hình (đọc từ biến môi trường) ---
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Cùng 1 quan hệ bị lazy load từ N lần trở lên trong 1 request => nghi N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "3"))
+
+# Ngân sách truy vấn cho các hàm CRUD "nóng" (đã tính cả lúc serialize response)
+# Test dùng: with query_profiler.within_budget("get_products"): ...
+CRUD_QUERY_BUDGETS = {
+    "get_products": 2,       # products+options (joined) + values (subquery)
+    "get_options": 1,        # options+values (joined)
+    "get_public_menu": 4,    # categories + products + options + values
+    "get_order_details": 1,  # 1 dòng orders (món + tùy chọn nằm trong items_snapshot)
+}
+
+# Ngân sách theo endpoint (middleware log cảnh báo khi vượt), đã gồm 1 truy vấn xác thực admin
+ENDPOINT_QUERY_BUDGETS = {
+    # + kiểm tra cache_versions, + version menu trên bản sao đọc khi dựng lại từ bản sao (replica.py)
+    "GET /menu": CRUD_QUERY_BUDGETS["get_public_menu"] + 2,
+    "GET /menu/search": CRUD_QUERY_BUDGETS["get_public_menu"] + 1, # Chỉ mục dựng từ cùng menu đã cache
+    # Danh sách danh mục: + 1 truy vấn đọc version cho ETag (304 thì chỉ còn xác thực + version)
+    "GET /admin/products/": CRUD_QUERY_BUDGETS["get_products"] + 2,
+    "GET /admin/options/": CRUD_QUERY_BUDGETS["get_options"] + 2,
+    # +1 khi đơn đã được lưu trữ: 1 truy vấn trượt ở bảng "nóng" trước khi đọc archive
+    "GET /admin/orders/{order_id}": CRUD_QUERY_BUDGETS["get_order_details"] + 2,
+    "GET /admin/orders/summary": 2, # + nạp lại bộ đếm từ DB (lần đầu / mỗi ORDER_COUNTS_RESYNC_SECONDS)
+    # Theo dõi đơn: chỉ đọc DB khi đơn chưa có trong bộ nhớ (order_tracking.py), thời gian chờ = 0 truy vấn
+    "GET /orders/{order_id}/track": 1,
+    "GET /orders/{order_id}/events": 1,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Số truy vấn vượt ngân sách đã khai báo (dùng trong test)"""
+
+
+class QueryStats:
+    """Thống kê truy vấn của 1 request (hoặc 1 khối code trong test)"""
+
+    def __init__(self, label: str, parent: "QueryStats" = None):
+        self.label = label
+        self.parent = parent
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = []         # Giữ lại vài câu SQL để báo lỗi dễ đọc
+        self.lazy_loads = Counter()  # "Option.values" -> số lần lazy load
+
+    def record_query(self, statement: str, elapsed_ms: float):
+        stats = self
+        while stats is not None:  # Cộng dồn lên các khối cha (budget lồng nhau)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            if len(stats.statements) < 20:
+                stats.statements.append(statement)
+            stats = stats.parent
+
+    def record_lazy_load(self, relationship: str):
+        stats = self
+        while stats is not None:
+            stats.lazy_loads[relationship] += 1
+            stats = stats.parent
+
+    def suspected_n_plus_one(self):
+        """Các quan hệ bị lazy load lặp lại (dấu hiệu N+1)"""
+        return {rel: n for rel, n in self.lazy_loads.items() if n >= N_PLUS_ONE_THRESHOLD}
+
+
+_current_stats = contextvars.ContextVar("query_stats", default=None)
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+# --- Lắng nghe sự kiện SQLAlchemy ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record_query(statement, elapsed_ms)
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms)", elapsed_ms, extra={
+            "route": stats.label if stats is not None else None,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "statement": " ".join(statement.split())[:500],
+        })
+
+
+def _on_orm_execute(orm_execute_state):
+    # lazy_loaded_from chỉ có giá trị khi đây là lazy load (không phải joinedload/subqueryload)
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return
+    stats = _current_stats.get()
+    if stats is not None:
+        relationship = str(orm_execute_state.loader_strategy_path.path[-1])
+        stats.record_lazy_load(relationship)
+
+
+_installed_engines = set()
+
+
+def install(engine):
+    """Gắn profiler vào engine (gọi 1 lần lúc khởi động app)"""
+    if not QUERY_PROFILER_ENABLED or id(engine) in _installed_engines:
+        return
+    _installed_engines.add(id(engine))
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if not event.contains(Session, "do_orm_execute", _on_orm_execute):
+        event.listen(Session, "do_orm_execute", _on_orm_execute)
+
+
+# --- Ngân sách truy vấn (dùng trong test) ---
+@contextmanager
+def query_budget(max_queries: int, label: str = "block"):
+    """
+    Đếm truy vấn trong khối `with`, raise QueryBudgetExceeded nếu vượt max_queries
+
+    Ví dụ:
+        with query_budget(2, "get_products"):
+            products = crud.get_products(db, store_id)
+            [schemas.Product.model_validate(p) for p in products]
+    """
+    stats = QueryStats(label, parent=_current_stats.get())
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+    _check_budget(stats, max_queries, label)
+
+
+def _check_budget(stats: QueryStats, max_queries: int, label: str):
+    if stats.count > max_queries:
+        statements = "\n".join(f"  - {' '.join(s.split())[:200]}" for s in stats.statements)
+        raise QueryBudgetExceeded(
+            f"{label}: {stats.count} truy vấn, vượt ngân sách {max_queries} "
+            f"(lazy loads: {dict(stats.lazy_loads)})\n{statements}"
+        )
+
+
+def within_budget(crud_function_name: str):
+    """Kiểm tra theo ngân sách đã khai báo trong CRUD_QUERY_BUDGETS"""
+    return query_budget(CRUD_QUERY_BUDGETS[crud_function_name], crud_function_name)
+
+
+_request_observers = [] # Nhận (route_key, QueryStats) của mỗi request xong (endpoint_within_budget)
+
+
+@contextmanager
+def endpoint_within_budget(route_key: str):
+    """
+    Request HTTP gửi trong khối `with` (vd. qua TestClient) không vượt ENDPOINT_QUERY_BUDGETS[route_key]
+
+    Ví dụ:
+        with endpoint_within_budget("GET /menu"):
+            client.get("/menu")
+
+    Đếm bằng chính QueryProfilerMiddleware => đúng số truy vấn của request, kể cả phần chạy trong threadpool
+    """
+    budget = ENDPOINT_QUERY_BUDGETS[route_key]
+    handled = []
+    observer = lambda key, stats: handled.append(stats) if key == route_key else None
+    _request_observers.append(observer)
+    try:
+        yield handled
+    finally:
+        _request_observers.remove(observer)
+    if not handled:
+        raise AssertionError(f"{route_key}: không có request nào qua QueryProfilerMiddleware")
+    for stats in handled:
+        _check_budget(stats, budget, route_key)
+
+
+# --- Middleware: thống kê theo từng request ---
+class QueryProfilerMiddleware:
+    """ASGI middleware: mở QueryStats cho mỗi request HTTP, log N+1 và vượt ngân sách"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not QUERY_PROFILER_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(f"{scope['method']} {scope['path']}")
+        token = _current_stats.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_stats.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope, stats: QueryStats):
+        suspected = stats.suspected_n_plus_one()
+        if suspected:
+            logger.warning("N+1 suspected [%s]: %s (%s queries)", stats.label, suspected, stats.count, extra={"route": stats.label})
+
+        route = scope.get("route")
+        route_key = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+        for observer in list(_request_observers):
+            observer(route_key, stats)
+        budget = ENDPOINT_QUERY_BUDGETS.get(route_key)
+        if budget is not None and stats.count > budget:
+            logger.warning("Query budget exceeded [%s]: %s > %s (%.1f ms)", route_key, stats.count, budget, stats.total_ms,
+                           extra={"route": route_key, "queries": stats.count, "budget": budget})
@@ -0,0 +1,128 @@
+# Tệp: replica.py
+# Mục đích: Đưa các endpoint CHỈ ĐỌC sang bản sao (READ_DATABASE_URL), ghi luôn ở DB chính
+#
+# - Endpoint chỉ đọc (menu, danh sách admin, báo cáo, export) dùng get_read_db() thay cho get_db()
+#   => Session của bản sao nếu bản sao dùng được, ngược lại Session của DB chính
+# - "Dùng được": kiểm tra độ trễ (1 truy vấn nhẹ, tối đa 1 lần / REPLICA_CHECK_SECONDS mỗi worker)
+#   trễ hơn REPLICA_MAX_LAG_SECONDS => tạm về DB chính cho tới lần kiểm tra sau
+# - Lỗi kết nối (lúc kiểm tra hoặc giữa request) => bỏ bản sao REPLICA_RETRY_SECONDS rồi thử lại
+# - DB thường (không phải bản sao streaming, vd. 2 URL khác nhau khi thử ở máy dev) luôn có độ trễ 0
+# - Đặt đơn, sửa menu, đăng nhập, chi tiết đơn... vẫn dùng get_db() (DB chính): đọc ngay sau khi ghi
+
+import os
+import time
+import logging
+import threading
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+import models
+
+logger = logging.getLogger(__name__)
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "2"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Độ trễ (giây) của bản sao; đã phát lại hết WAL nhận được thì 0 (DB chính ít ghi không bị tính là trễ)
+_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReadRouter:
+    def __init__(self, engine, session_factory, max_lag: float, check_interval: float, retry_after: float):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._usable = False
+        self._checked_at = None
+        self._down_until = 0.0
+        self.lag = None # Độ trễ đo được gần nhất (giây)
+        self.replica_sessions = 0
+        self.primary_fallbacks = 0
+        self.failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    def usable(self) -> bool:
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now < self._down_until:
+                return False
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._usable
+            self._checked_at = now # Các request khác dùng kết quả cũ trong lúc đang kiểm tra
+        try:
+            with self.engine.connect() as conn:
+                lag = float(conn.execute(_LAG_SQL).scalar())
+        except Exception as e:
+            self.mark_failed(e)
+            return False
+        usable = lag <= self.max_lag
+        with self._lock:
+            if usable != self._usable:
+                logger.log(logging.INFO if usable else logging.WARNING,
+                           "Bản sao đọc: %s (trễ %.1fs)", "dùng lại" if usable else "trễ quá, về DB chính", lag)
+            self.lag, self._usable = lag, usable
+        return usable
+
+    def mark_failed(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self._usable = False
+            self._down_until = time.monotonic() + self.retry_after
+        logger.warning("Bản sao đọc lỗi, dùng DB chính trong %ss: %s", self.retry_after, error)
+
+    def session(self) -> Session:
+        if self.usable():
+            self.replica_sessions += 1
+            return self.session_factory()
+        if self.enabled:
+            self.primary_fallbacks += 1
+        return models.SessionLocal()
+
+    def serving_engine(self):
+        """Engine mà request đọc tiếp theo sẽ dùng, theo lần kiểm tra gần nhất (không truy vấn, gọi được trên event loop)"""
+        return self.engine if self._cached_usable() else models.engine
+
+    def _cached_usable(self) -> bool:
+        return self.enabled and self._usable and time.monotonic() >= self._down_until
+
+    def is_replica(self, db: Session) -> bool:
+        return self.enabled and db.get_bind() is self.engine
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "usable": self._cached_usable(),
+            "lag_seconds": self.lag,
+            "replica_sessions": self.replica_sessions,
+            "primary_fallbacks": self.primary_fallbacks,
+            "failures": self.failures,
+        }
+
+
+router = ReadRouter(models.read_engine, models.ReadSessionLocal, REPLICA_MAX_LAG_SECONDS, REPLICA_CHECK_SECONDS, REPLICA_RETRY_SECONDS)
+
+
+def get_read_db():
+    """Dependency cho endpoint chỉ đọc (thay get_db)"""
+    db = router.session()
+    try:
+        yield db
+    except (OperationalError, PoolTimeoutError) as e:
+        if router.is_replica(db): # Request này lỗi, các request sau về DB chính
+            router.mark_failed(e)
+        raise
+    finally:
+        db.close()
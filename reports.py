@@ -0,0 +1,289 @@
+# Tệp: reports.py
+# Mục đích: Cập nhật bảng tổng hợp doanh số (rollup) theo từng đơn hàng,
+#           và đọc báo cáo CHỈ từ các bảng rollup (không quét orders/order_items)
+#
+# Mọi số liệu là GỘP (gross): tính theo đơn đã đặt, kể cả đơn bị hủy sau đó, theo ngày / giờ TẠO đơn.
+# Đơn hủy chỉ được tách riêng ở 2 chỗ:
+# - Theo ngày: cancelled_count / cancelled_revenue (thuần = revenue - cancelled_revenue)
+# - Breakdown "status": nhóm DA_HUY (đơn chuyển trạng thái => chuyển nhóm)
+# Theo giờ, theo thanh toán / hình thức giao và theo món KHÔNG trừ đơn hủy.
+#
+# Dựng lại toàn bộ rollup từ lịch sử:  python reports.py backfill
+
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import Date, String, cast, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models
+
+logger = logging.getLogger(__name__)
+
+# Báo cáo theo giờ Việt Nam (UTC+7, không có giờ mùa hè) trừ khi cấu hình khác
+REPORT_UTC_OFFSET_HOURS = int(os.getenv("REPORT_UTC_OFFSET_HOURS", "7"))
+REPORT_OFFSET = timedelta(hours=REPORT_UTC_OFFSET_HOURS)
+
+DIMENSION_STATUS = "status"
+DIMENSION_PAYMENT = "payment_method"
+DIMENSION_DELIVERY = "delivery_method"
+
+
+def _local_time(created_at: datetime) -> datetime:
+    """Đổi thời điểm tạo đơn (có tz) sang giờ báo cáo (không tz)"""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(timezone.utc).replace(tzinfo=None) + REPORT_OFFSET
+
+
+def _upsert_add(db: Session, model, keys: dict, increments: dict):
+    """INSERT ... ON CONFLICT DO UPDATE SET cột = cột + giá trị mới (cộng dồn nguyên tử)"""
+    stmt = insert(model).values(**keys, **increments)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys.keys()),
+        set_={col: getattr(model, col) + stmt.excluded[col] for col in increments},
+    )
+    db.execute(stmt)
+
+
+# --- Cập nhật tăng dần (gọi trong transaction của crud, TRƯỚC commit) ---
+# Thứ tự khóa dòng CHUNG cho mọi hàm ghi: daily -> hourly -> dimension -> status count -> product,
+# trong mỗi nhóm theo khóa tăng dần => đặt đơn và đổi trạng thái song song không deadlock
+def record_order_created(db: Session, db_order: models.Order, order_items: list):
+    """Cộng đơn hàng mới vào các rollup"""
+    local_time = _local_time(db_order.created_at)
+    day = local_time.date()
+    revenue = db_order.total_amount
+    store_id = db_order.store_id
+
+    _upsert_add(db, models.SalesDailyRollup, {"store_id": store_id, "bucket_date": day}, {
+        "order_count": 1,
+        "sub_total": db_order.sub_total,
+        "delivery_fee": db_order.delivery_fee,
+        "discount_amount": db_order.discount_amount,
+        "revenue": revenue,
+        "cancelled_count": 0,
+        "cancelled_revenue": 0.0,
+    })
+    _upsert_add(db, models.SalesHourlyRollup,
+                {"store_id": store_id, "bucket_hour": local_time.replace(minute=0, second=0, microsecond=0)},
+                {"order_count": 1, "revenue": revenue})
+
+    for dimension, value in sorted((
+        (DIMENSION_STATUS, db_order.status.value),
+        (DIMENSION_PAYMENT, db_order.payment_method.value),
+        (DIMENSION_DELIVERY, db_order.delivery_method_selected.value),
+    )):
+        _upsert_add(db, models.OrderDimensionRollup,
+                    {"store_id": store_id, "bucket_date": day, "dimension": dimension, "dimension_value": value},
+                    {"order_count": 1, "revenue": revenue})
+
+    _upsert_add(db, models.OrderStatusCount, {"store_id": store_id, "status": db_order.status.value}, {"order_count": 1})
+
+    # Gộp theo tên món trước để mỗi món chỉ 1 câu upsert
+    per_product = defaultdict(lambda: [0, 0.0])
+    for item in order_items:
+        per_product[item.product_name][0] += item.quantity
+        per_product[item.product_name][1] += item.item_price * item.quantity
+    for product_name, (quantity, item_revenue) in sorted(per_product.items()):
+        _upsert_add(db, models.ProductSalesRollup,
+                    {"store_id": store_id, "bucket_date": day, "product_name": product_name},
+                    {"quantity": quantity, "revenue": item_revenue})
+
+
+def record_status_change(db: Session, db_order: models.Order,
+                         old_status: models.OrderStatus, new_status: models.OrderStatus):
+    """
+    Chuyển số đếm của đơn từ trạng thái cũ sang trạng thái mới (theo ngày tạo đơn)
+
+    Chỉ đụng tới cancelled_* của ngày, breakdown "status" và order_status_counts:
+    các rollup khác là số gộp (xem đầu tệp), không đổi khi đơn bị hủy / bỏ hủy
+    """
+    if old_status == new_status:
+        return
+    day = _local_time(db_order.created_at).date()
+    revenue = db_order.total_amount
+    store_id = db_order.store_id
+
+    cancelled = models.OrderStatus.DA_HUY
+    if cancelled in (old_status, new_status): # Daily trước tiên, cùng thứ tự khóa với record_order_created
+        sign = 1 if new_status == cancelled else -1
+        _upsert_add(db, models.SalesDailyRollup, {"store_id": store_id, "bucket_date": day}, {
+            "order_count": 0, "sub_total": 0.0, "delivery_fee": 0.0,
+            "discount_amount": 0.0, "revenue": 0.0,
+            "cancelled_count": sign, "cancelled_revenue": sign * revenue,
+        })
+
+    changes = sorted(((old_status.value, -1), (new_status.value, 1)))
+    for status, sign in changes:
+        _upsert_add(db, models.OrderDimensionRollup,
+                    {"store_id": store_id, "bucket_date": day, "dimension": DIMENSION_STATUS, "dimension_value": status},
+                    {"order_count": sign, "revenue": sign * revenue})
+    for status, sign in changes:
+        _upsert_add(db, models.OrderStatusCount, {"store_id": store_id, "status": status}, {"order_count": sign})
+
+
+# --- Đọc báo cáo (chỉ từ rollup) ---
+def _default_range(start_date: date = None, end_date: date = None):
+    end_date = end_date or (datetime.now(timezone.utc) + REPORT_OFFSET).date()
+    start_date = start_date or end_date - timedelta(days=29)
+    return start_date, end_date
+
+
+def get_daily_report(db: Session, store_id: int, start_date: date = None, end_date: date = None):
+    """Doanh thu theo ngày (gộp; cancelled_count / cancelled_revenue là phần đã hủy)"""
+    start_date, end_date = _default_range(start_date, end_date)
+    return db.query(models.SalesDailyRollup).filter(
+        models.SalesDailyRollup.store_id == store_id,
+        models.SalesDailyRollup.bucket_date.between(start_date, end_date)
+    ).order_by(models.SalesDailyRollup.bucket_date).all()
+
+
+def get_hourly_report(db: Session, store_id: int, day: date = None):
+    """Doanh thu theo giờ trong 1 ngày (gộp, kể cả đơn đã hủy)"""
+    day = day or _default_range()[1]
+    start = datetime.combine(day, datetime.min.time())
+    return db.query(models.SalesHourlyRollup).filter(
+        models.SalesHourlyRollup.store_id == store_id,
+        models.SalesHourlyRollup.bucket_hour >= start,
+        models.SalesHourlyRollup.bucket_hour < start + timedelta(days=1),
+    ).order_by(models.SalesHourlyRollup.bucket_hour).all()
+
+
+def get_dimension_report(db: Session, store_id: int, start_date: date = None, end_date: date = None):
+    """
+    Số đơn & doanh thu theo trạng thái / phương thức thanh toán / hình thức giao
+
+    Mỗi nhóm dimension cộng lại đều bằng tổng gộp; đơn hủy chỉ tách riêng trong "status" (DA_HUY)
+    """
+    start_date, end_date = _default_range(start_date, end_date)
+    rollup = models.OrderDimensionRollup
+    rows = db.query(
+        rollup.dimension, rollup.dimension_value,
+        func.sum(rollup.order_count).label("order_count"),
+        func.sum(rollup.revenue).label("revenue"),
+    ).filter(
+        rollup.store_id == store_id,
+        rollup.bucket_date.between(start_date, end_date)
+    ).group_by(rollup.dimension, rollup.dimension_value).order_by(rollup.dimension, rollup.dimension_value).all()
+    return [row._asdict() for row in rows]
+
+
+def get_product_report(db: Session, store_id: int, start_date: date = None, end_date: date = None, limit: int = 50):
+    """Số lượng bán & doanh thu theo tên món, bán chạy nhất lên đầu (gộp, kể cả đơn đã hủy)"""
+    start_date, end_date = _default_range(start_date, end_date)
+    rollup = models.ProductSalesRollup
+    rows = db.query(
+        rollup.product_name,
+        func.sum(rollup.quantity).label("quantity"),
+        func.sum(rollup.revenue).label("revenue"),
+    ).filter(
+        rollup.store_id == store_id,
+        rollup.bucket_date.between(start_date, end_date)
+    ).group_by(rollup.product_name).order_by(func.sum(rollup.quantity).desc()).limit(limit).all()
+    return [row._asdict() for row in rows]
+
+
+def get_status_counts(db: Session, store_id: int) -> dict:
+    """Số đơn ở mỗi trạng thái {"MOI": 3, ...} (đủ mọi trạng thái, kể cả 0)"""
+    counts = {status.value: 0 for status in models.OrderStatus}
+    rows = db.query(models.OrderStatusCount.status, models.OrderStatusCount.order_count).filter(
+        models.OrderStatusCount.store_id == store_id
+    ).all()
+    counts.update({status: order_count for status, order_count in rows})
+    return counts
+
+
+# --- Dựng lại rollup từ lịch sử ---
+def _union_all_rows(model_pair, columns):
+    """SELECT các cột từ bảng "nóng" UNION ALL bảng archive tương ứng"""
+    return union_all(*(
+        select(*[model.__table__.c[name] for name in columns]) for model in model_pair
+    )).subquery()
+
+
+def backfill(db: Session):
+    """
+    Xóa và tính lại toàn bộ rollup từ orders/order_items + bảng archive (1 transaction)
+
+    Khóa bảng orders ở SHARE MODE trong lúc chạy: đơn mới phải chờ (vài giây),
+    nhưng không có đơn nào bị đếm thiếu hoặc đếm 2 lần.
+    """
+    db.connection().exec_driver_sql("LOCK TABLE orders IN SHARE MODE")
+
+    for model in (models.SalesDailyRollup, models.SalesHourlyRollup,
+                  models.OrderDimensionRollup, models.ProductSalesRollup, models.OrderStatusCount):
+        db.query(model).delete(synchronize_session=False)
+
+    # Gộp bảng "nóng" và bảng archive (đơn cũ đã được archive.py chuyển đi)
+    order = _union_all_rows(
+        (models.Order, models.ArchivedOrder),
+        ("id", "store_id", "created_at", "status", "payment_method", "delivery_method_selected",
+         "sub_total", "delivery_fee", "discount_amount", "total_amount"),
+    )
+    item = _union_all_rows(
+        (models.OrderItem, models.ArchivedOrderItem),
+        ("order_id", "product_name", "quantity", "item_price"),
+    )
+    local_ts = func.timezone("UTC", order.c.created_at) + literal(REPORT_OFFSET)
+    day = cast(local_ts, Date)
+    cancelled = order.c.status == models.OrderStatus.DA_HUY
+    store_id = order.c.store_id
+
+    db.execute(insert(models.SalesDailyRollup).from_select(
+        ["store_id", "bucket_date", "order_count", "sub_total", "delivery_fee", "discount_amount",
+         "revenue", "cancelled_count", "cancelled_revenue"],
+        select(
+            store_id, day, func.count(order.c.id), func.sum(order.c.sub_total), func.sum(order.c.delivery_fee),
+            func.sum(order.c.discount_amount), func.sum(order.c.total_amount),
+            func.count(order.c.id).filter(cancelled),
+            func.coalesce(func.sum(order.c.total_amount).filter(cancelled), 0),
+        ).group_by(store_id, day)
+    ))
+
+    hour = func.date_trunc("hour", local_ts)
+    db.execute(insert(models.SalesHourlyRollup).from_select(
+        ["store_id", "bucket_hour", "order_count", "revenue"],
+        select(store_id, hour, func.count(order.c.id), func.sum(order.c.total_amount)).group_by(store_id, hour)
+    ))
+
+    for dimension, column in ((DIMENSION_STATUS, order.c.status),
+                              (DIMENSION_PAYMENT, order.c.payment_method),
+                              (DIMENSION_DELIVERY, order.c.delivery_method_selected)):
+        value = cast(column, String)
+        db.execute(insert(models.OrderDimensionRollup).from_select(
+            ["store_id", "bucket_date", "dimension", "dimension_value", "order_count", "revenue"],
+            select(store_id, day, literal(dimension), value, func.count(order.c.id), func.sum(order.c.total_amount))
+            .group_by(store_id, day, value)
+        ))
+
+    status = cast(order.c.status, String)
+    db.execute(insert(models.OrderStatusCount).from_select(
+        ["store_id", "status", "order_count"],
+        select(store_id, status, func.count(order.c.id)).group_by(store_id, status)
+    ))
+
+    db.execute(insert(models.ProductSalesRollup).from_select(
+        ["store_id", "bucket_date", "product_name", "quantity", "revenue"],
+        select(store_id, day, item.c.product_name, func.sum(item.c.quantity), func.sum(item.c.item_price * item.c.quantity))
+        .join(order, item.c.order_id == order.c.id)
+        .group_by(store_id, day, item.c.product_name)
+    ))
+
+    db.commit()
+
+
+if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
+    if sys.argv[1:] != ["backfill"]:
+        logger.error("Cách dùng: python reports.py backfill")
+        sys.exit(1)
+    logger.info("Đang dựng lại bảng tổng hợp doanh số từ lịch sử đơn hàng...")
+    db = models.SessionLocal()
+    try:
+        backfill(db)
+    finally:
+        db.close()
+    logger.info("Đã dựng lại bảng tổng hợp doanh số!")
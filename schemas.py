@@ -2,9 +2,9 @@
 # Mục đích: Định nghĩa các "biểu mẫu" (schemas) Pydantic
 
 from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 import models # Import models để dùng Enums
-from datetime import datetime
+from datetime import date, datetime
 
 # --- Biểu mẫu cho Admin ---
 class AdminBase(BaseModel):
@@ -113,6 +113,14 @@ class CategoryUpdate(BaseModel):
     name: Optional[str] = None
     display_order: Optional[int] = None
 
+# --- Biểu mẫu Sắp xếp hàng loạt (kéo-thả) ---
+class ReorderRequest(BaseModel):
+    ids: List[int] # Thứ tự mới, phần tử đầu tiên có display_order = 1
+
+class DisplayOrderItem(BaseModel):
+    id: int
+    display_order: int
+
 # --- Biểu mẫu cho Voucher ---
 class VoucherBase(BaseModel):
     code: str
@@ -130,6 +138,43 @@ class Voucher(VoucherBase):
     id: int
     model_config = ConfigDict(from_attributes=True) # Sửa orm_mode
 
+# --- Biểu mẫu Nhập / Xuất menu (menu_io.py) ---
+# Tham chiếu bằng TÊN (không dùng id) để chuyển menu giữa các môi trường / cửa hàng
+# display_order bỏ trống => lấy theo thứ tự trong danh sách
+class MenuDocumentOptionValue(BaseModel):
+    name: str
+    price_adjustment: float = 0
+    is_out_of_stock: bool = False
+
+class MenuDocumentOption(BaseModel):
+    name: str
+    type: models.OptionType = models.OptionType.CHON_NHIEU
+    display_order: Optional[int] = None
+    values: List[MenuDocumentOptionValue] = []
+
+class MenuDocumentProduct(BaseModel):
+    name: str
+    description: Optional[str] = None
+    base_price: float
+    image_url: Optional[str] = None
+    is_best_seller: bool = False
+    is_out_of_stock: bool = False
+    display_order: Optional[int] = None
+    options: List[str] = [] # Tên các Nhóm Tùy chọn gắn với món
+
+class MenuDocumentCategory(BaseModel):
+    name: str
+    display_order: Optional[int] = None
+    products: List[MenuDocumentProduct] = []
+
+class MenuDocument(BaseModel):
+    options: List[MenuDocumentOption] = []
+    categories: List[MenuDocumentCategory] = []
+
+class MenuImportResult(BaseModel):
+    created: dict # {"categories": 2, "products": 10, ...}
+    updated: dict
+
 # --- Biểu mẫu Công khai (Public Schemas) ---
 class PublicOptionValue(BaseModel):
     id: int
@@ -165,6 +210,16 @@ class PublicCategory(BaseModel):
     products: List[PublicProduct] = [] # Products đã chứa options sắp xếp
     model_config = ConfigDict(from_attributes=True)
 
+class MenuSearchResult(BaseModel):
+    id: int
+    name: str
+    category_id: int
+    category_name: str
+    base_price: float
+    image_url: Optional[str]
+    is_out_of_stock: bool
+    score: float
+
 # --- Biểu mẫu cho Luồng Đặt hàng (Công khai) ---
 class OrderItemOptionCreate(BaseModel):
     option_value_id: int
@@ -197,8 +252,15 @@ class PublicOrderResponse(BaseModel): # Dùng cho xác nhận đặt hàng thàn
     id: int
     status: models.OrderStatus
     total_amount: float
+    tracking_token: Optional[str] = None # Cho GET /orders/{id}/track và /orders/{id}/events
     model_config = ConfigDict(from_attributes=True)
 
+class OrderTrackingStatus(BaseModel):
+    order_id: int
+    status: models.OrderStatus
+    updated_at: Optional[datetime] = None
+    changed: bool # Khác trạng thái khách gửi lên (?status=...)
+
 # --- Biểu mẫu Chi tiết Đơn hàng cho Admin ---
 class OrderItemOptionDetail(BaseModel):
     option_name: str
@@ -240,4 +302,38 @@ class AdminOrderListResponse(BaseModel):
     total_amount: float
     status: models.OrderStatus
     created_at: datetime
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+# --- Biểu mẫu Báo cáo (đọc từ bảng rollup) ---
+# Số gộp: kể cả đơn đã hủy (xem reports.py); đơn hủy tách riêng ở cancelled_* và breakdown "status"
+class DailySalesReport(BaseModel):
+    bucket_date: date
+    order_count: int
+    sub_total: float
+    delivery_fee: float
+    discount_amount: float
+    revenue: float
+    cancelled_count: int
+    cancelled_revenue: float
+    model_config = ConfigDict(from_attributes=True)
+
+class HourlySalesReport(BaseModel):
+    bucket_hour: datetime
+    order_count: int
+    revenue: float
+    model_config = ConfigDict(from_attributes=True)
+
+class DimensionSalesReport(BaseModel):
+    dimension: str # "status" | "payment_method" | "delivery_method" (chỉ "status" tách đơn hủy: DA_HUY)
+    dimension_value: str
+    order_count: int
+    revenue: float
+
+class OrderStatusSummary(BaseModel):
+    counts: Dict[str, int] # Mọi trạng thái, kể cả 0: {"MOI": 3, "DANG_GIAO": 1, ...}
+    active: int # Đơn chưa xong (chưa HOAN_TAT / DA_HUY)
+
+class ProductSalesReport(BaseModel):
+    product_name: str
+    quantity: int
+    revenue: float
@@ -24,6 +24,8 @@ if SECRET_KEY is None:
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # Thẻ từ có hạn 7 ngày
+ORDER_TRACKING_TOKEN_HOURS = int(os.getenv("ORDER_TRACKING_TOKEN_HOURS", "24"))
+ORDER_TRACKING_TOKEN_TYPE = "order_tracking"
 
 # 3. Các hàm bảo mật
 def verify_password(plain_password, hashed_password):
@@ -42,6 +44,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_order_tracking_token(store_id: int, order_id: int) -> str:
+    """Token cho khách theo dõi ĐÚNG 1 đơn (không dùng được cho API admin)"""
+    return create_access_token(
+        {"sub": f"order:{order_id}", "typ": ORDER_TRACKING_TOKEN_TYPE, "store": store_id, "order": order_id},
+        timedelta(hours=ORDER_TRACKING_TOKEN_HOURS),
+    )
+
+def verify_order_tracking_token(token: str, order_id: int) -> Optional[int]:
+    """store_id của đơn nếu token hợp lệ cho đúng order_id, ngược lại None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("typ") != ORDER_TRACKING_TOKEN_TYPE or payload.get("order") != order_id:
+        return None
+    return payload.get("store")
+
 # 4. "Người bảo vệ" đứng gác
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/admin/token")
 
@@ -52,22 +71,25 @@ def get_db():
     finally:
         db.close()
 
-async def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Không thể xác thực, vui lòng đăng nhập lại",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def admin_from_token(db: Session, token: str) -> Optional[models.Admin]:
+    """Admin của JWT đăng nhập (cửa hàng lấy từ claim "store"), None nếu token không hợp lệ"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        if username is None or payload.get("typ") is not None: # Token theo dõi đơn không phải token admin
+            return None
         token_data = schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    admin = crud.get_admin_by_username(db, username=token_data.username)
+        store_id = int(payload.get("store", models.DEFAULT_STORE_ID)) # Token cũ (chưa có "store") thuộc cửa hàng mặc định
+    except (JWTError, ValueError):
+        return None
+    return crud.get_admin_by_username(db, store_id, username=token_data.username)
+
+async def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    admin = admin_from_token(db, token)
     if admin is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Không thể xác thực, vui lòng đăng nhập lại",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return admin
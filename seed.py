@@ -1,6 +1,7 @@
 # Tệp: seed.py (ĐÃ CẬP NHẬT THỨ TỰ)
 # Mục đích: "Nhập hàng mẫu" (Seed) vào database để kiểm tra.
 
+import logging
 from sqlalchemy.orm import Session
 from models import (
     SessionLocal, 
@@ -9,22 +10,25 @@ from models import (
     Option, 
     OptionValue, 
     OptionType, 
+    DEFAULT_STORE_ID,
     create_tables
 )
 from crud import link_product_to_options
 
+logger = logging.getLogger(__name__)
+
 def seed_data():
     db: Session = SessionLocal()
     
     try:
-        print("Đang kiểm tra dữ liệu mẫu...")
+        logger.info("Đang kiểm tra dữ liệu mẫu...")
         
         category = db.query(Category).filter(Category.name == "Trà Sữa").first()
         if category:
-            print("Dữ liệu mẫu đã tồn tại. Bỏ qua.")
+            logger.info("Dữ liệu mẫu đã tồn tại. Bỏ qua.")
             return
 
-        print("Đang thêm dữ liệu mẫu...")
+        logger.info("Đang thêm dữ liệu mẫu...")
         
         # 3. TẠO DANH MỤC
         cat_tra_sua = Category(name="Trà Sữa", display_order=1)
@@ -84,24 +88,27 @@ def seed_data():
         # (Thứ tự ID ở đây không còn quan trọng, vì "Bộ não" sẽ tự sắp xếp)
         link_product_to_options(
             db, 
+            DEFAULT_STORE_ID,
             product_id=prod_matcha.id, 
             option_ids=[opt_size.id, opt_topping.id, opt_duong.id]
         )
         
         link_product_to_options(
             db, 
+            DEFAULT_STORE_ID,
             product_id=prod_cafe_den.id, 
             option_ids=[opt_duong.id]
         )
         
-        print("Đã thêm dữ liệu mẫu thành công!")
+        logger.info("Đã thêm dữ liệu mẫu thành công!")
 
     except Exception as e:
-        print(f"Lỗi khi thêm dữ liệu mẫu: {e}")
+        logger.exception("Lỗi khi thêm dữ liệu mẫu: %s", e)
         db.rollback()
     finally:
         db.close()
 
 if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
     create_tables() 
     seed_data()
\ No newline at end of file
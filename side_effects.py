@@ -0,0 +1,145 @@
+# Tệp: side_effects.py
+# Mục đích: Hàng đợi việc phụ chạy SAU khi đơn đã commit (thông báo admin, log, máy in bill...)
+#
+# - Endpoint chỉ gọi emit() (không chờ) rồi trả response ngay => khách không phải chờ WebSocket/pg_notify
+# - Hàng đợi có giới hạn (SIDE_EFFECT_QUEUE_SIZE); đầy thì bỏ việc và đếm "dropped"
+#   (đơn đã nằm trong DB, chỉ mất thông báo) thay vì làm chậm request
+# - Mỗi handler chạy độc lập, lỗi thì thử lại với backoff tăng dần (tối đa SIDE_EFFECT_MAX_ATTEMPTS lần)
+# - Rollup báo cáo KHÔNG đi qua đây: phải cùng transaction với đơn (xem crud.create_order)
+#
+# Thêm việc phụ:  side_effects.queue.subscribe("order_created", ham_xu_ly)  (hàm async hoặc sync)
+
+import logging
+import os
+import time
+import asyncio
+import inspect
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+SIDE_EFFECT_QUEUE_SIZE = int(os.getenv("SIDE_EFFECT_QUEUE_SIZE", "1000"))
+SIDE_EFFECT_WORKERS = int(os.getenv("SIDE_EFFECT_WORKERS", "2"))
+SIDE_EFFECT_MAX_ATTEMPTS = int(os.getenv("SIDE_EFFECT_MAX_ATTEMPTS", "3"))
+SIDE_EFFECT_RETRY_DELAY = float(os.getenv("SIDE_EFFECT_RETRY_DELAY", "0.5")) # giây, nhân đôi sau mỗi lần lỗi
+SIDE_EFFECT_DRAIN_TIMEOUT = float(os.getenv("SIDE_EFFECT_DRAIN_TIMEOUT", "5"))
+
+
+class SideEffectQueue:
+    def __init__(self, maxsize: int, workers: int, max_attempts: int, retry_delay: float):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._handlers = defaultdict(list) # tên sự kiện -> [handler]
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+        # Số liệu
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self.max_wait_ms = 0.0
+
+    def subscribe(self, event: str, handler):
+        self._handlers[event].append(handler)
+
+    def start(self):
+        """Gọi trong sự kiện startup (async) của mỗi worker"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = SIDE_EFFECT_DRAIN_TIMEOUT):
+        """Chờ làm nốt việc còn trong hàng đợi (tối đa timeout giây) rồi dừng worker"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Side effects: dừng khi còn %s việc chưa làm", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        self._tasks, self._queue, self._loop = [], None, None
+
+    def emit(self, event: str, payload: dict) -> int:
+        """Xếp mỗi handler của sự kiện thành 1 việc; trả về số việc đã nhận (không bao giờ chờ)"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError: # Gọi từ thread khác (endpoint sync chạy trong threadpool)
+            handlers = self._handlers.get(event, ())
+            if self._loop is None:
+                self.dropped += len(handlers)
+                logger.warning("Side effects: chưa khởi động, bỏ %s", event)
+                return 0
+            self._loop.call_soon_threadsafe(self.emit, event, payload)
+            return len(handlers)
+        self.start() # Chạy không qua startup (vd. TestClient) thì khởi động tại đây
+        accepted = 0
+        for handler in self._handlers.get(event, ()):
+            try:
+                self._queue.put_nowait((handler, payload, time.perf_counter()))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.warning("Side effects: hàng đợi đầy, bỏ %s -> %s", event, handler.__name__)
+                continue
+            accepted += 1
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return accepted
+
+    async def _work(self):
+        queue = self._queue
+        while True:
+            handler, payload, queued_at = await queue.get()
+            self.max_wait_ms = max(self.max_wait_ms, (time.perf_counter() - queued_at) * 1000)
+            self.in_flight += 1
+            try:
+                await self._run(handler, payload)
+            finally:
+                self.in_flight -= 1
+                queue.task_done()
+
+    async def _run(self, handler, payload: dict):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    await handler(payload)
+                else:
+                    await asyncio.to_thread(handler, payload) # Hàm sync (DB, máy in...) không được chặn event loop
+                self.completed += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self.failed += 1
+                    logger.error("Side effect %s lỗi sau %s lần: %s", handler.__name__, attempt, e, exc_info=True)
+                    return
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def stats(self) -> dict:
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "capacity": self.maxsize,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "max_depth": self.max_depth,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+queue = SideEffectQueue(SIDE_EFFECT_QUEUE_SIZE, SIDE_EFFECT_WORKERS, SIDE_EFFECT_MAX_ATTEMPTS, SIDE_EFFECT_RETRY_DELAY)
@@ -0,0 +1,177 @@
+# Tệp: tenancy.py
+# Mục đích: Xác định cửa hàng (tenant) của mỗi request
+#
+# Thứ tự: header X-Store (slug) -> query ?store=slug (WebSocket không gửi được header)
+#         -> Host khớp bảng store_domains -> cửa hàng mặc định
+# API admin KHÔNG dùng cách này: admin luôn làm việc trên cửa hàng của chính mình (admins.store_id)
+#
+# Thêm cửa hàng:  python tenancy.py add-store <slug> "<Tên>" [host ...]
+# Thêm admin:     python tenancy.py add-admin <slug> <username> <password>
+
+import logging
+import os
+import json
+import argparse
+import threading
+from typing import Optional
+from fastapi import HTTPException, status
+from starlette.requests import HTTPConnection
+import models
+from cache import cache_versions, atomic_write, MENU_SNAPSHOT_DIR
+
+logger = logging.getLogger(__name__)
+
+STORE_HEADER = "X-Store"
+STORE_QUERY_PARAM = "store"
+# Bản sao danh bạ cửa hàng trên đĩa: worker khởi động lúc mất DB vẫn biết host nào thuộc cửa hàng nào
+STORE_DIRECTORY_SNAPSHOT = os.path.join(MENU_SNAPSHOT_DIR, "_stores.json") if MENU_SNAPSHOT_DIR else ""
+
+
+def _normalize_host(host: str) -> str:
+    return host.split(":")[0].strip().lower()
+
+
+class StoreDirectory:
+    """slug -> store_id và host -> store_id, nạp 1 lần, nạp lại khi bộ đếm "stores" đổi"""
+
+    def __init__(self, snapshot_path: str):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._by_slug = None
+        self._by_host = None
+
+    def clear(self):
+        with self._lock:
+            self._by_slug = self._by_host = None
+
+    def warm(self):
+        """Nạp trước lúc khởi động để request đầu tiên không phải chờ"""
+        try:
+            self._maps()
+        except Exception as e:
+            logger.warning("Chưa nạp được danh sách cửa hàng: %s", e)
+
+    def resolve(self, slug: Optional[str], host: Optional[str]) -> Optional[int]:
+        """store_id của request, hoặc None nếu slug được chỉ định nhưng không tồn tại"""
+        cache_versions.get("stores") # Cửa hàng / tên miền đổi ở worker khác => clear()
+        by_slug, by_host = self._maps()
+        if slug:
+            return by_slug.get(slug.strip().lower())
+        if host:
+            store_id = by_host.get(_normalize_host(host))
+            if store_id is not None:
+                return store_id
+        return models.DEFAULT_STORE_ID
+
+    def _maps(self):
+        with self._lock:
+            if self._by_slug is not None:
+                return self._by_slug, self._by_host
+        try:
+            by_slug, by_host = self._load_from_db()
+        except Exception as e:
+            by_slug, by_host = self._load_snapshot()
+            if by_slug is None:
+                raise
+            logger.warning("Không đọc được danh sách cửa hàng từ DB, dùng bản lưu trên đĩa: %s", e)
+            return by_slug, by_host # Không giữ lại: DB lên lại thì nạp bản mới
+        with self._lock:
+            self._by_slug, self._by_host = by_slug, by_host
+        self._write_snapshot(by_slug, by_host)
+        return by_slug, by_host
+
+    @staticmethod
+    def _load_from_db():
+        db = models.SessionLocal()
+        try:
+            stores = db.query(models.Store.id, models.Store.slug).filter(models.Store.is_active == True).all()
+            by_slug = {slug.lower(): store_id for store_id, slug in stores}
+            active = set(by_slug.values())
+            by_host = {
+                _normalize_host(host): store_id
+                for host, store_id in db.query(models.StoreDomain.host, models.StoreDomain.store_id).all()
+                if store_id in active
+            }
+            return by_slug, by_host
+        finally:
+            db.close()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path:
+            return None, None
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = json.load(f)
+            return data["by_slug"], data["by_host"]
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def _write_snapshot(self, by_slug: dict, by_host: dict):
+        if not self.snapshot_path:
+            return
+        try:
+            atomic_write(self.snapshot_path, json.dumps({"by_slug": by_slug, "by_host": by_host}).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Không ghi được danh sách cửa hàng (%s): %s", self.snapshot_path, e)
+
+
+directory = StoreDirectory(STORE_DIRECTORY_SNAPSHOT)
+cache_versions.on_change("stores", directory.clear)
+
+
+def resolve_store_id(connection: HTTPConnection) -> Optional[int]:
+    """Dùng được cho cả Request lẫn WebSocket"""
+    slug = connection.headers.get(STORE_HEADER) or connection.query_params.get(STORE_QUERY_PARAM)
+    return directory.resolve(slug, connection.headers.get("host"))
+
+
+def get_store_id(connection: HTTPConnection) -> int:
+    """Dependency cho các API công khai"""
+    store_id = resolve_store_id(connection)
+    if store_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Store not found")
+    return store_id
+
+
+def add_store(slug: str, name: str, hosts: list) -> models.Store:
+    db = models.SessionLocal()
+    try:
+        store = models.Store(slug=slug.lower(), name=name)
+        db.add(store)
+        db.flush()
+        db.add_all([models.StoreDomain(host=_normalize_host(host), store_id=store.id) for host in hosts])
+        db.commit()
+        db.refresh(store)
+        return store
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
+    parser = argparse.ArgumentParser(description="Quản lý cửa hàng")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_store_parser = commands.add_parser("add-store")
+    add_store_parser.add_argument("slug")
+    add_store_parser.add_argument("name")
+    add_store_parser.add_argument("hosts", nargs="*")
+    add_admin_parser = commands.add_parser("add-admin")
+    add_admin_parser.add_argument("slug")
+    add_admin_parser.add_argument("username")
+    add_admin_parser.add_argument("password")
+    args = parser.parse_args()
+
+    if args.command == "add-store":
+        store = add_store(args.slug, args.name, args.hosts)
+        logger.info("Đã tạo cửa hàng #%s (%s)", store.id, store.slug)
+    else:
+        import crud, schemas
+        store_id = directory.resolve(args.slug, None)
+        if store_id is None:
+            parser.error(f"Không có cửa hàng '{args.slug}'")
+        db = models.SessionLocal()
+        try:
+            admin = crud.create_admin(db, store_id, schemas.AdminCreate(username=args.username, password=args.password))
+            logger.info("Đã tạo admin '%s' cho cửa hàng #%s", admin.username, store_id)
+        finally:
+            db.close()
@@ -0,0 +1,88 @@
+# Tệp: tests/conftest.py
+# Mục đích: Fixture dùng chung cho test cần Postgres THẬT (đếm truy vấn không giả lập được)
+#
+# CSDL cấu hình như server (POSTGRES_*, DB_HOST, DB_PORT). Test migrate + seed nếu DB trống
+# và GHI thêm vài đơn => chỉ chạy trên DB dev/test. Không kết nối được => bỏ qua (skip).
+#
+# Chạy:  DB_HOST=localhost python -m pytest -q tests
+
+import os
+import sys
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "test-secret") # security.py bắt buộc phải có
+
+import models
+import bootstrap
+import query_profiler
+import crud
+import schemas
+
+
+@pytest.fixture(scope="session")
+def database():
+    try:
+        with models.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        pytest.skip(f"Không kết nối được CSDL test ({models.DB_HOST}): {e}")
+    bootstrap.prepare_database(wait=False)
+    query_profiler.install(models.engine)
+    return models.engine
+
+
+@pytest.fixture(scope="session")
+def client(database):
+    """TestClient của app (chạy startup/shutdown như server thật)"""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    token = client.post("/admin/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def db(database):
+    session = models.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope="session")
+def store_id(database):
+    return models.DEFAULT_STORE_ID
+
+
+@pytest.fixture(scope="session")
+def order_data(database, store_id):
+    """Nội dung 1 đơn hợp lệ của cửa hàng mặc định: món đầu tiên, nhóm CHON_1 chọn lựa chọn đầu"""
+    session = models.SessionLocal()
+    try:
+        product = crud.get_products(session, store_id, limit=1)[0]
+        options = [option.values[0].id for option in product.options
+                   if option.type == models.OptionType.CHON_1 and option.values]
+        return schemas.OrderCreate(
+            customer_name="pytest", customer_phone="0900000000", customer_address="test",
+            payment_method=models.PaymentMethod.TIEN_MAT, delivery_method=models.DeliveryMethod.TIEU_CHUAN,
+            items=[schemas.OrderItemCreate(product_id=product.id, quantity=1, options=options)],
+        )
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope="session")
+def order_id(database, store_id, order_data):
+    session = models.SessionLocal()
+    try:
+        return crud.create_order(session, store_id, order_data).id
+    finally:
+        session.close()
@@ -0,0 +1,135 @@
+# Tệp: tests/test_admission.py
+# Mục đích: admission.py - token bucket (đồng hồ giả), 429 / 503 của AdmissionControlMiddleware (không cần CSDL)
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+import admission
+import models
+import replica
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def _route_class(rate=2.0, burst=3, max_concurrency=10, queue_deadline=0.1, yields_to_orders=True, reads_replica=False):
+    return admission.RouteClass("test", rate=rate, burst=burst, max_concurrency=max_concurrency,
+                                queue_deadline=queue_deadline, yields_to_orders=yields_to_orders, reads_replica=reads_replica)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def buckets(clock):
+    return admission.TokenBuckets(max_clients=2, clock=clock)
+
+
+def test_burst_then_wait_for_next_token(buckets):
+    route_class = _route_class(rate=2.0, burst=3)
+    assert [buckets.take(route_class, "a") for _ in range(3)] == [0, 0, 0]
+    assert buckets.take(route_class, "a") == pytest.approx(0.5) # 1 token / (2 token/giây)
+
+
+def test_refill_by_elapsed_time(buckets, clock):
+    route_class = _route_class(rate=2.0, burst=3)
+    for _ in range(3):
+        buckets.take(route_class, "a")
+    clock.advance(0.25)
+    assert buckets.take(route_class, "a") == pytest.approx(0.25) # Mới có nửa token
+    clock.advance(0.25)
+    assert buckets.take(route_class, "a") == 0
+    assert buckets.take(route_class, "a") == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_burst(buckets, clock):
+    route_class = _route_class(rate=2.0, burst=3)
+    buckets.take(route_class, "a")
+    clock.advance(60)
+    assert [buckets.take(route_class, "a") for _ in range(4)] == [0, 0, 0, pytest.approx(0.5)]
+
+
+def test_clients_and_route_classes_are_independent(buckets):
+    route_class = _route_class(rate=1.0, burst=1)
+    other_class = admission.RouteClass("other", rate=1.0, burst=1, max_concurrency=1, queue_deadline=0.1, yields_to_orders=True)
+    assert buckets.take(route_class, "a") == 0
+    assert buckets.take(route_class, "a") > 0
+    assert buckets.take(route_class, "b") == 0
+    assert buckets.take(other_class, "a") == 0
+
+
+def test_least_recently_used_client_is_evicted(buckets):
+    route_class = _route_class(rate=1.0, burst=1)
+    buckets.take(route_class, "a")
+    buckets.take(route_class, "b")
+    buckets.take(route_class, "c") # max_clients=2 => quên "a"
+    assert buckets.take(route_class, "a") == 0
+    assert buckets.take(route_class, "c") > 0
+
+
+# --- Middleware ---
+def _client(monkeypatch, route_class):
+    monkeypatch.setitem(admission.ROUTE_CLASSES, ("GET", "/limited"), route_class)
+    app = Starlette(routes=[Route("/limited", lambda request: PlainTextResponse("ok"))])
+    return TestClient(admission.AdmissionControlMiddleware(app))
+
+
+def test_rate_limited_client_gets_429(monkeypatch):
+    route_class = _route_class(rate=0.5, burst=1)
+    client = _client(monkeypatch, route_class)
+    assert client.get("/limited").status_code == 200
+    response = client.get("/limited")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert (route_class.admitted, route_class.rejected_rate) == (1, 1)
+
+
+def test_no_free_slot_before_deadline_gets_503(monkeypatch):
+    route_class = _route_class(max_concurrency=0, queue_deadline=0.01)
+    response = _client(monkeypatch, route_class).get("/limited")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert route_class.rejected_overload == 1
+
+
+def test_primary_pool_reserve_gets_503(monkeypatch):
+    route_class = _route_class()
+    monkeypatch.setattr(models.engine.pool, "checkedout", lambda: admission.POOL_CAPACITY - admission.RESERVED_FOR_ORDERS)
+    assert _client(monkeypatch, route_class).get("/limited").status_code == 503
+    order_class = _route_class(yields_to_orders=False) # Đặt đơn được dùng phần giữ riêng
+    assert _client(monkeypatch, order_class).get("/limited").status_code == 200
+
+
+class FakeEngine:
+    def __init__(self, checked_out: int):
+        self.pool = type("FakePool", (), {"checkedout": lambda pool: checked_out})()
+
+
+def test_replica_reads_check_the_replica_pool(monkeypatch):
+    route_class = _route_class(reads_replica=True)
+    monkeypatch.setattr(models.engine.pool, "checkedout", lambda: admission.POOL_CAPACITY) # DB chính cạn
+    monkeypatch.setattr(replica.router, "serving_engine", lambda: FakeEngine(0))
+    assert not admission._pool_nearly_exhausted(route_class)
+    monkeypatch.setattr(replica.router, "serving_engine", lambda: FakeEngine(admission.READ_POOL_CAPACITY))
+    assert admission._pool_nearly_exhausted(route_class)
+
+
+def test_replica_reads_fall_back_to_the_primary_pool(monkeypatch):
+    route_class = _route_class(reads_replica=True)
+    monkeypatch.setattr(replica.router, "serving_engine", lambda: models.engine) # Bản sao không dùng được
+    monkeypatch.setattr(models.engine.pool, "checkedout", lambda: admission.POOL_CAPACITY - admission.RESERVED_FOR_ORDERS)
+    assert admission._pool_nearly_exhausted(route_class)
+    monkeypatch.setattr(models.engine.pool, "checkedout", lambda: 0)
+    assert not admission._pool_nearly_exhausted(route_class)
@@ -0,0 +1,61 @@
+# Tệp: tests/test_conditional_get.py
+# Mục đích: GET có điều kiện của danh sách admin (main.not_modified): ETag / If-None-Match -> 304
+
+import pytest
+
+PATH = "/admin/categories/"
+
+
+@pytest.fixture
+def etag(client, admin_headers):
+    response = client.get(PATH, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    return response.headers["ETag"]
+
+
+def _get(client, admin_headers, if_none_match):
+    return client.get(PATH, headers={**admin_headers, "If-None-Match": if_none_match})
+
+
+def _assert_not_modified(response, etag):
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_etag_is_weak(etag):
+    assert etag.startswith('W/"') and etag.endswith('"')
+
+
+def test_weak_tag_matches(client, admin_headers, etag):
+    _assert_not_modified(_get(client, admin_headers, etag), etag)
+
+
+def test_strong_form_of_the_tag_matches(client, admin_headers, etag):
+    # If-None-Match so sánh yếu (RFC 9110): bỏ "W/" vẫn là cùng phiên bản
+    _assert_not_modified(_get(client, admin_headers, etag.removeprefix("W/")), etag)
+
+
+def test_star_matches(client, admin_headers, etag):
+    _assert_not_modified(_get(client, admin_headers, "*"), etag)
+
+
+def test_comma_separated_list(client, admin_headers, etag):
+    _assert_not_modified(_get(client, admin_headers, f'"khac", {etag} ,W/"cu"'), etag)
+    response = _get(client, admin_headers, 'W/"khac", "cu"')
+    assert response.status_code == 200 and response.headers["ETag"] == etag
+
+
+def test_other_page_has_another_tag(client, admin_headers, etag):
+    response = client.get(PATH, params={"limit": 1}, headers={**admin_headers, "If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+
+def test_change_invalidates_the_tag(client, admin_headers, etag):
+    created = client.post(PATH, json={"name": "pytest ETag"}, headers=admin_headers)
+    assert created.status_code == 201
+    response = _get(client, admin_headers, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert created.json()["id"] in [category["id"] for category in response.json()]
@@ -0,0 +1,70 @@
+# Tệp: tests/test_endpoint_budgets.py
+# Mục đích: Mỗi endpoint trong query_profiler.ENDPOINT_QUERY_BUDGETS không vượt ngân sách truy vấn
+#           (đếm bằng QueryProfilerMiddleware, gồm cả xác thực admin và serialize response)
+
+import pytest
+from sqlalchemy import update
+import crud
+import models
+import query_profiler
+import security
+from cache import cache_versions, namespace
+
+
+def test_every_budgeted_endpoint_is_tested():
+    tested = {"GET /menu", "GET /menu/search", "GET /admin/products/", "GET /admin/options/",
+              "GET /admin/orders/{order_id}", "GET /admin/orders/summary",
+              "GET /orders/{order_id}/track", "GET /orders/{order_id}/events"}
+    assert set(query_profiler.ENDPOINT_QUERY_BUDGETS) == tested
+
+
+def _invalidate_menu(db, store_id):
+    """Tăng version menu => request sau đi đường đắt nhất: dựng lại menu từ DB"""
+    cache_versions.touch(db, namespace("menu", store_id))
+    db.commit()
+    cache_versions.current(db, namespace("menu", store_id))
+
+
+def test_menu_within_budget(client, db, store_id):
+    _invalidate_menu(db, store_id)
+    with query_profiler.endpoint_within_budget("GET /menu"):
+        response = client.get("/menu")
+    assert response.status_code == 200 and response.json()
+
+
+def test_menu_search_within_budget(client, db, store_id):
+    _invalidate_menu(db, store_id)
+    with query_profiler.endpoint_within_budget("GET /menu/search"):
+        response = client.get("/menu/search", params={"q": "tra"})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/admin/products/", "/admin/options/", "/admin/orders/summary"])
+def test_admin_lists_within_budget(client, admin_headers, path):
+    with query_profiler.endpoint_within_budget(f"GET {path}"):
+        response = client.get(path, headers=admin_headers)
+    assert response.status_code == 200
+
+
+def test_admin_order_detail_within_budget(client, admin_headers, order_id):
+    with query_profiler.endpoint_within_budget("GET /admin/orders/{order_id}"):
+        response = client.get(f"/admin/orders/{order_id}", headers=admin_headers)
+    assert response.status_code == 200 and response.json()["id"] == order_id
+
+
+def test_order_tracking_within_budget(client, store_id, order_id):
+    token = security.create_order_tracking_token(store_id, order_id)
+    with query_profiler.endpoint_within_budget("GET /orders/{order_id}/track"):
+        response = client.get(f"/orders/{order_id}/track", params={"token": token})
+    assert response.status_code == 200 and response.json()["order_id"] == order_id
+
+
+def test_order_events_within_budget(client, db, store_id, order_data):
+    # Đơn đã HOAN_TAT ở worker khác (worker này chưa nhớ => 1 truy vấn): luồng SSE gửi trạng thái rồi đóng
+    order = crud.create_order(db, store_id, order_data)
+    db.execute(update(models.Order).where(models.Order.id == order.id).values(status=models.OrderStatus.HOAN_TAT))
+    db.commit()
+    token = security.create_order_tracking_token(store_id, order.id)
+    with query_profiler.endpoint_within_budget("GET /orders/{order_id}/events"):
+        response = client.get(f"/orders/{order.id}/events", params={"token": token})
+    assert response.status_code == 200 and "HOAN_TAT" in response.text
@@ -0,0 +1,49 @@
+# Tệp: tests/test_idempotency.py
+# Mục đích: Chỉ request đang giữ key mới được ghi "completed" (và tạo đơn) cho Idempotency-Key đó
+
+import uuid
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, update
+import crud
+import idempotency
+import models
+
+
+def _order_count(db, store_id):
+    return db.query(func.count(models.Order.id)).filter(models.Order.store_id == store_id).scalar()
+
+
+def test_create_order_completes_own_claim(db, store_id, order_data):
+    key = f"{store_id}:pytest-{uuid.uuid4()}"
+    assert idempotency.store.begin(db, key, idempotency.request_hash(order_data)) is None
+
+    order = crud.create_order(db, store_id, order_data, idempotency_key=key)
+
+    row = db.get(models.IdempotencyKey, key)
+    assert row.status == "completed"
+    assert order.idempotent_response["id"] == order.id
+
+
+def test_create_order_rolls_back_when_key_was_taken_over(db, store_id, order_data):
+    key = f"{store_id}:pytest-{uuid.uuid4()}"
+    assert idempotency.store.begin(db, key, idempotency.request_hash(order_data)) is None
+    # Lease hết hạn, request khác giành lại key (ghi lease mới)
+    other = models.SessionLocal()
+    try:
+        other.execute(update(models.IdempotencyKey).where(models.IdempotencyKey.key == key).values(
+            lease_expires_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, 30),
+        ))
+        other.commit()
+    finally:
+        other.close()
+    before = _order_count(db, store_id)
+
+    with pytest.raises(HTTPException) as error:
+        crud.create_order(db, store_id, order_data, idempotency_key=key)
+    idempotency.store.release(db, key)
+
+    assert error.value.status_code == 409
+    assert _order_count(db, store_id) == before
+    row = db.get(models.IdempotencyKey, key)
+    assert row.status == "pending" # Lần giữ chỗ của request kia vẫn còn nguyên
@@ -0,0 +1,111 @@
+# Tệp: tests/test_menu_search.py
+# Mục đích: menu_search.py - bỏ dấu, khớp tiền tố, nhiều từ (AND), xếp hạng, bỏ chỉ mục khi menu đổi (không cần CSDL)
+
+import json
+import pytest
+from cache import cache_versions, namespace
+from menu_search import MenuSearchIndex, search_index, fold
+
+STORE_ID = 987654 # Không trùng cửa hàng thật: test đổi version "menu:<store_id>" trong bộ nhớ
+
+
+def _product(product_id, name, toppings=()):
+    return {
+        "id": product_id, "name": name, "base_price": 30000, "image_url": None, "is_out_of_stock": False,
+        "options": [{"id": 1, "name": "Topping", "values": [{"id": 100 + i, "name": t} for i, t in enumerate(toppings)]}],
+    }
+
+
+def _menu(*categories) -> bytes:
+    return json.dumps([
+        {"id": category_id, "name": name, "products": products} for category_id, name, products in categories
+    ]).encode("utf-8")
+
+
+MENU = _menu(
+    (1, "Trà Sữa", [
+        _product(1, "Trà Sữa Matcha", ["Trân châu đen"]),
+        _product(2, "Trà Sữa Truyền Thống", ["Thạch dừa"]),
+    ]),
+    (2, "Cà Phê", [
+        _product(3, "Cà Phê Sữa Đá"),
+        _product(4, "Bạc Xỉu"),
+    ]),
+)
+
+
+def _names(results):
+    return [result["name"] for result in results]
+
+
+@pytest.fixture
+def index():
+    return MenuSearchIndex()
+
+
+def test_fold_removes_vietnamese_accents():
+    assert fold("Trà Sữa Đá") == "tra sua da"
+    assert fold("  CÀ-PHÊ, sữa!! ") == "ca phe sua"
+
+
+def test_accent_insensitive(index):
+    assert _names(index.search(STORE_ID, MENU, "tra sua")) == ["Trà Sữa Matcha", "Trà Sữa Truyền Thống"]
+    assert _names(index.search(STORE_ID, MENU, "TRÀ SỮA")) == ["Trà Sữa Matcha", "Trà Sữa Truyền Thống"]
+
+
+def test_prefix_match(index):
+    assert _names(index.search(STORE_ID, MENU, "matc")) == ["Trà Sữa Matcha"]
+    assert _names(index.search(STORE_ID, MENU, "bac x")) == ["Bạc Xỉu"]
+
+
+def test_every_word_must_match(index):
+    assert _names(index.search(STORE_ID, MENU, "sua da")) == ["Cà Phê Sữa Đá"]
+    assert index.search(STORE_ID, MENU, "matcha xiu") == []
+    assert index.search(STORE_ID, MENU, "khong co") == []
+    assert index.search(STORE_ID, MENU, "  !! ") == []
+
+
+def test_name_outranks_category_and_options(index):
+    # Tên lựa chọn cũng được tìm: "tran" chỉ khớp topping "Trân châu đen" của món 1
+    assert _names(index.search(STORE_ID, MENU, "tran")) == ["Trà Sữa Matcha"]
+    # "ca phe": tên món "Cà Phê Sữa Đá" (trọng số tên) đứng trước "Bạc Xỉu" (chỉ khớp tên danh mục)
+    results = index.search(STORE_ID, MENU, "ca phe")
+    assert _names(results) == ["Cà Phê Sữa Đá", "Bạc Xỉu"]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_exact_word_scores_higher_than_prefix(index):
+    menu = _menu((1, "Đồ uống", [_product(1, "Tràng An"), _product(2, "Trà Đào")]))
+    # "tra": khớp trọn "Trà" (gấp đôi) đứng trước khớp tiền tố "Tràng", dù thứ tự trên menu ngược lại
+    results = index.search(STORE_ID, menu, "tra")
+    assert _names(results) == ["Trà Đào", "Tràng An"]
+    assert results[0]["score"] == 2 * results[1]["score"]
+
+
+def test_ties_keep_menu_order(index):
+    menu = _menu(
+        (1, "Sinh tố", [_product(5, "Sinh Tố Xoài"), _product(6, "Sinh Tố Bơ")]),
+        (2, "Sinh tố đặc biệt", [_product(7, "Sinh Tố Dâu")]),
+    )
+    assert _names(index.search(STORE_ID, menu, "sinh")) == ["Sinh Tố Xoài", "Sinh Tố Bơ", "Sinh Tố Dâu"]
+    assert _names(index.search(STORE_ID, menu, "sinh to")) == ["Sinh Tố Xoài", "Sinh Tố Bơ", "Sinh Tố Dâu"]
+
+
+def test_limit(index):
+    assert _names(index.search(STORE_ID, MENU, "tra", limit=1)) == ["Trà Sữa Matcha"]
+    assert len(index.search(STORE_ID, MENU, "tra sua", limit=1)) == 1
+
+
+def test_new_menu_body_rebuilds_the_index(index):
+    assert _names(index.search(STORE_ID, MENU, "matcha")) == ["Trà Sữa Matcha"]
+    renamed = MENU.replace("Matcha".encode(), "Hojicha".encode())
+    assert index.search(STORE_ID, renamed, "matcha") == []
+    assert _names(index.search(STORE_ID, renamed, "hoji")) == ["Trà Sữa Hojicha"]
+
+
+def test_menu_version_change_drops_the_index():
+    search_index.search(STORE_ID, MENU, "tra")
+    assert STORE_ID in search_index._indexes
+    name = namespace("menu", STORE_ID)
+    cache_versions._apply({name: cache_versions.get(name) + 1}) # Như khi đọc được version mới từ DB
+    assert STORE_ID not in search_index._indexes
@@ -0,0 +1,57 @@
+# Tệp: tests/test_option_rules.py
+# Mục đích: cache.OptionRules.violation - kiểm tra tùy chọn của giỏ hàng (không cần CSDL)
+
+import pytest
+import models
+from cache import OptionRules
+
+# Món 1: "Size" (CHON_1: 10, 11) + "Topping" (CHON_NHIEU: 20, 21)
+# Món 2: chỉ "Topping"; nhóm "Đá" (CHON_1, id 4) không có lựa chọn nào => không bắt buộc
+SIZE, TOPPING, SUGAR, ICE = 1, 2, 3, 4
+
+
+@pytest.fixture
+def rules():
+    return OptionRules(
+        links=[(1, SIZE), (1, TOPPING), (2, TOPPING), (2, ICE)],
+        options=[
+            (SIZE, "Size", models.OptionType.CHON_1),
+            (TOPPING, "Topping", models.OptionType.CHON_NHIEU),
+            (SUGAR, "Đường", models.OptionType.CHON_1),
+            (ICE, "Đá", models.OptionType.CHON_1),
+        ],
+        values=[(10, SIZE), (11, SIZE), (20, TOPPING), (21, TOPPING), (30, SUGAR)],
+    )
+
+
+@pytest.mark.parametrize("product_id, option_value_ids", [
+    (1, [10]),
+    (1, [11, 20, 21]),
+    (2, []),
+    (2, [21]),
+])
+def test_valid_selection(rules, product_id, option_value_ids):
+    assert rules.violation(product_id, option_value_ids) is None
+
+
+def test_unknown_value(rules):
+    assert rules.violation(1, [10, 999]) == "Tùy chọn ID 999 không áp dụng cho món này."
+
+
+def test_value_of_option_not_linked_to_product(rules):
+    assert rules.violation(1, [10, 30]) == "Tùy chọn ID 30 không áp dụng cho món này."
+    assert rules.violation(2, [10]) == "Tùy chọn ID 10 không áp dụng cho món này."
+
+
+def test_product_without_options(rules):
+    assert rules.violation(99, [10]) == "Tùy chọn ID 10 không áp dụng cho món này."
+    assert rules.violation(99, []) is None
+
+
+def test_duplicate_value(rules):
+    assert rules.violation(1, [10, 20, 20]) == "Tùy chọn ID 20 bị chọn lặp lại."
+
+
+@pytest.mark.parametrize("option_value_ids", [[], [20], [10, 11]])
+def test_single_choice_needs_exactly_one(rules, option_value_ids):
+    assert rules.violation(1, option_value_ids) == "Nhóm 'Size' phải chọn đúng 1 lựa chọn."
@@ -0,0 +1,43 @@
+# Tệp: tests/test_query_budgets.py
+# Mục đích: Hàm CRUD "nóng" (kể cả lúc serialize response) không vượt ngân sách truy vấn
+#           trong query_profiler.CRUD_QUERY_BUDGETS => bắt hồi quy N+1 khi sửa crud/schemas
+
+import pytest
+import crud
+import query_profiler
+import schemas
+
+
+def test_get_products_within_budget(db, store_id):
+    with query_profiler.within_budget("get_products"):
+        products = crud.get_products(db, store_id)
+        [schemas.Product.model_validate(product).model_dump() for product in products]
+    assert products
+
+
+def test_get_options_within_budget(db, store_id):
+    with query_profiler.within_budget("get_options"):
+        options = crud.get_options(db, store_id)
+        [schemas.Option.model_validate(option).model_dump() for option in options]
+    assert options
+
+
+def test_get_public_menu_within_budget(db, store_id):
+    with query_profiler.within_budget("get_public_menu"):
+        categories = crud.get_public_menu(db, store_id)
+        [schemas.PublicCategory.model_validate(category).model_dump() for category in categories]
+    assert categories
+
+
+def test_get_order_details_within_budget(db, store_id, order_id):
+    with query_profiler.within_budget("get_order_details"):
+        order = crud.get_order_details(db, store_id, order_id)
+        detail = schemas.OrderDetail.model_validate(order).model_dump()
+    assert detail["id"] == order_id and detail["items"]
+
+
+def test_budget_exceeded_fails():
+    # Chính cơ chế kiểm tra phải làm test đỏ khi vượt ngân sách
+    with pytest.raises(query_profiler.QueryBudgetExceeded):
+        with query_profiler.query_budget(0, "empty") as stats:
+            stats.record_query("SELECT 1", 0.1)
@@ -1,10 +1,15 @@
 # File: websocket_manager.py
 # Mục đích: Quản lý các kết nối WebSocket với admin
 
+import logging
 from fastapi import WebSocket
-from typing import List
+from starlette.websockets import WebSocketState
+from typing import Dict, List
 import json
 from datetime import datetime
+from event_bus import bus
+
+logger = logging.getLogger(__name__)
 
 class ConnectionManager:
     """
@@ -14,24 +19,28 @@ class ConnectionManager:
     - active_connections: Danh sách các admin đang kết nối
     - connect(): Thêm admin mới vào danh sách
     - disconnect(): Xóa admin ra khỏi danh sách
-    - broadcast(): Gửi thông báo đến TẤT CẢ admin đang online
+    - broadcast(): Gửi thông báo đến TẤT CẢ admin đang online của cửa hàng trong message["store_id"]
     """
     
     def __init__(self):
         # Danh sách lưu các kết nối WebSocket đang active
         self.active_connections: List[WebSocket] = []
+        # Kết nối -> cửa hàng (admin chỉ nhận thông báo của cửa hàng mình)
+        self.connection_stores: Dict[WebSocket, int] = {}
     
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, store_id: int):
         """
         Khi admin mở trang, function này được gọi
         
         Bước thực hiện:
-        1. Accept (chấp nhận) kết nối từ admin
+        1. Accept (chấp nhận) kết nối từ admin (nếu chưa accept để nhận tin "auth")
         2. Thêm vào danh sách active_connections
         """
-        await websocket.accept()
+        if websocket.client_state == WebSocketState.CONNECTING:
+            await websocket.accept()
         self.active_connections.append(websocket)
-        print(f"✅ Admin mới kết nối! Tổng: {len(self.active_connections)} admin đang online")
+        self.connection_stores[websocket] = store_id
+        logger.info("Admin mới kết nối! Tổng: %s admin đang online", len(self.active_connections), extra={"store_id": store_id})
     
     def disconnect(self, websocket: WebSocket):
         """
@@ -41,11 +50,23 @@ class ConnectionManager:
         1. Xóa khỏi danh sách active_connections
         """
         self.active_connections.remove(websocket)
-        print(f"❌ Admin ngắt kết nối! Còn: {len(self.active_connections)} admin đang online")
+        self.connection_stores.pop(websocket, None)
+        logger.info("Admin ngắt kết nối! Còn: %s admin đang online", len(self.active_connections))
     
     async def broadcast(self, message: dict):
         """
-        Gửi thông báo đến TẤT CẢ admin đang online
+        Gửi thông báo đến TẤT CẢ admin đang online (ở mọi worker)
+
+        Chạy nhiều worker: phát qua event_bus, mỗi worker tự gửi cho kết nối của mình
+        """
+        if bus.distributed:
+            await bus.publish(message)
+        else:
+            await self.broadcast_local(message)
+
+    async def broadcast_local(self, message: dict):
+        """
+        Gửi thông báo đến các admin đang kết nối vào worker NÀY
         
         Tham số:
         - message: Dictionary chứa thông tin cần gửi
@@ -62,21 +83,28 @@ class ConnectionManager:
         # Danh sách admin bị lỗi kết nối
         disconnected = []
         
-        # Gửi đến từng admin
+        # Gửi đến từng admin (của đúng cửa hàng)
+        store_id = message.get("store_id")
+        sent = 0
         for connection in self.active_connections:
+            if store_id is not None and self.connection_stores.get(connection) != store_id:
+                continue
             try:
                 # Gửi dữ liệu dạng JSON
                 await connection.send_json(message)
-                print(f"📤 Đã gửi thông báo: {message['type']}")
+                sent += 1
             except Exception as e:
                 # Nếu gửi lỗi (admin đã offline), đánh dấu để xóa
-                print(f"⚠️ Lỗi gửi đến admin: {e}")
+                logger.warning("Lỗi gửi đến admin: %s", e)
                 disconnected.append(connection)
         
+        logger.debug("Đã gửi thông báo %s tới %s admin", message.get("type"), sent, extra={"store_id": store_id})
+        
         # Xóa các kết nối lỗi
         for connection in disconnected:
             try:
                 self.active_connections.remove(connection)
+                self.connection_stores.pop(connection, None)
             except:
                 pass
 
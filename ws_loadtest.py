@@ -0,0 +1,315 @@
+# Tệp: ws_loadtest.py
+# Mục đích: Kiểm tra tải WebSocket thông báo đơn cho admin (/ws/admin/orders)
+#
+# - Mở N kết nối admin cùng lúc, bắn đơn qua POST /orders với tốc độ cấu hình
+# - Đo: độ trễ từ lúc gửi đơn -> admin nhận "new_order" (p50/p95/p99/max), RAM server tăng thêm
+#   mỗi kết nối, kết nối bị rớt, thông báo bị mất (admin không nhận được)
+# - Vượt ngưỡng => in lý do và thoát với mã 1 (dùng trong CI để bắt hồi quy)
+#
+# Mặc định tự chạy server (python bootstrap.py) trên 127.0.0.1, CSDL cấu hình như server (POSTGRES_*, DB_HOST)
+# (đơn thử THẬT sự được ghi vào DB => chỉ dùng DB dev/test); --url để nhắm server đang chạy
+# (khi đó RAM chỉ đo được nếu có --server-pid, và admission control của server vẫn áp dụng).
+#
+# Dùng:  python ws_loadtest.py --clients 300 --orders 200 --rate 20 [--workers 2] [--max-p99-ms 500]
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+import websockets
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_PREFIX = "loadtest-"
+SERVER_START_TIMEOUT = 60.0
+
+
+# --- Server ---
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, rate: float) -> tuple:
+    """Chạy bootstrap.py ở cổng trống; admission control nới rộng để chỉ đo phần WebSocket"""
+    port = _free_port()
+    env = dict(
+        os.environ, HOST="127.0.0.1", PORT=str(port), WEB_CONCURRENCY=str(workers),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+        ADMISSION_ORDER_RATE=str(max(rate * 2, 10)), ADMISSION_ORDER_BURST=str(max(rate * 2, 100)),
+        ADMISSION_MENU_BURST="1000",
+    )
+    process = subprocess.Popen([sys.executable, "bootstrap.py"], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def _http(method: str, url: str, store: str, body: dict = None, timeout: float = 10.0, form: dict = None):
+    if form is not None:
+        data, content_type = urllib.parse.urlencode(form).encode(), "application/x-www-form-urlencoded"
+    else:
+        data, content_type = (json.dumps(body).encode() if body is not None else None), "application/json"
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": content_type, "X-Store": store})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def wait_until_ready(base_url: str, store: str, process: subprocess.Popen = None) -> list:
+    """Chờ GET /menu trả 200 (server đã migrate + seed xong); trả về menu"""
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"Server thoát sớm (mã {process.returncode})")
+        try:
+            status, menu = _http("GET", f"{base_url}/menu", store, timeout=2.0)
+            if status == 200:
+                return menu
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server không sẵn sàng sau {SERVER_START_TIMEOUT:.0f}s")
+
+
+def _rss_kb(pid: int) -> int:
+    """RSS (KB) của process và mọi process con (worker Gunicorn), đọc từ /proc (Linux)"""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            total += sum(_rss_kb(int(child)) for child in f.read().split())
+    except (OSError, StopIteration):
+        pass
+    return total
+
+
+def _percentile(values: list, percent: float) -> float:
+    """Nearest-rank trên danh sách đã sắp xếp"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def sample_order(menu: list) -> dict:
+    """Món đầu tiên còn hàng + lựa chọn đầu tiên còn hàng của mỗi nhóm CHON_1"""
+    for category in menu:
+        for product in category["products"]:
+            if product["is_out_of_stock"]:
+                continue
+            options = []
+            for option in product["options"]:
+                if option["type"] == "CHON_1" and option["values"]:
+                    in_stock = [value for value in option["values"] if not value["is_out_of_stock"]]
+                    if not in_stock:
+                        break
+                    options.append(in_stock[0]["id"])
+            else:
+                return {
+                    "customer_phone": "0900000000", "customer_address": "Load test",
+                    "payment_method": "TIEN_MAT", "delivery_method": "TIEU_CHUAN",
+                    "items": [{"product_id": product["id"], "quantity": 1, "options": options}],
+                }
+    raise SystemExit("Menu không có món nào đặt được")
+
+
+# --- Đo ---
+class Run:
+    def __init__(self, clients: int):
+        self.sent_at = {} # seq -> perf_counter lúc gửi đơn
+        self.created = set() # seq của đơn tạo thành công (201)
+        self.rejected = {} # mã HTTP -> số đơn bị từ chối
+        self.latencies_ms = []
+        self.received = [set() for _ in range(clients)]
+        self.connected = set() # chỉ số client đã kết nối
+        self.connect_failures = 0
+        self.dropped = 0
+
+
+async def admin_client(run: Run, index: int, ws_url: str, ready: asyncio.Queue, stop: asyncio.Event, open_timeout: float):
+    try:
+        connection = await websockets.connect(ws_url, open_timeout=open_timeout, ping_interval=None, max_queue=None)
+    except Exception as e:
+        run.connect_failures += 1
+        logger.debug("Client %s không kết nối được: %s", index, e)
+        await ready.put(None)
+        return
+    run.connected.add(index)
+    await ready.put(connection)
+    received = run.received[index]
+    try:
+        async for raw in connection: # Dừng khi run_load đóng kết nối
+            now = time.perf_counter()
+            if '"new_order"' not in raw: # Lọc rẻ trước khi parse: client không được là nút thắt
+                continue
+            name = json.loads(raw).get("customer_name") or ""
+            if not name.startswith(CUSTOMER_PREFIX):
+                continue
+            seq = int(name[len(CUSTOMER_PREFIX):])
+            if seq in run.sent_at and seq not in received:
+                received.add(seq)
+                run.latencies_ms.append((now - run.sent_at[seq]) * 1000)
+    except websockets.ConnectionClosed:
+        pass
+    if not stop.is_set():
+        run.dropped += 1 # Server đóng kết nối giữa chừng
+
+
+async def fire_orders(run: Run, base_url: str, store: str, order: dict, count: int, rate: float):
+    async def place(seq: int):
+        body = dict(order, customer_name=f"{CUSTOMER_PREFIX}{seq}")
+        run.sent_at[seq] = time.perf_counter()
+        status, _ = await asyncio.to_thread(_http, "POST", f"{base_url}/orders", store, body)
+        if status == 201:
+            run.created.add(seq)
+        else:
+            run.rejected[status] = run.rejected.get(status, 0) + 1
+
+    started = time.perf_counter()
+    tasks = []
+    for seq in range(count):
+        delay = started + seq / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(place(seq)))
+    await asyncio.gather(*tasks)
+
+
+async def run_load(args, base_url: str, menu: list, server_pid: int = None) -> dict:
+    store = args.store
+    order = sample_order(menu)
+    status, token = await asyncio.to_thread(
+        _http, "POST", f"{base_url}/admin/token", store, form={"username": args.admin_user, "password": args.admin_password}
+    )
+    if status != 200:
+        raise SystemExit(f"Không đăng nhập được admin '{args.admin_user}' (HTTP {status})")
+    ws_url = base_url.replace("http", "ws", 1) + f"/ws/admin/orders?token={token['access_token']}"
+    run = Run(args.clients)
+    stop = asyncio.Event()
+    ready = asyncio.Queue()
+
+    rss_before = _rss_kb(server_pid) if server_pid else 0
+    connect_started = time.perf_counter()
+    clients = []
+    for index in range(args.clients): # Mở dần theo lô để không dồn hết SYN vào backlog cùng lúc
+        clients.append(asyncio.create_task(admin_client(run, index, ws_url, ready, stop, args.connect_timeout)))
+        if index % 50 == 49:
+            await asyncio.sleep(0.05)
+    connections = [await ready.get() for _ in range(args.clients)]
+    connect_seconds = time.perf_counter() - connect_started
+    await asyncio.sleep(args.settle) # Để server đăng ký hết kết nối trước khi đo RAM
+    rss_connected = _rss_kb(server_pid) if server_pid else 0
+    logger.info("%s/%s admin đã kết nối sau %.1fs, bắn %s đơn (%s đơn/s)...",
+                len(run.connected), args.clients, connect_seconds, args.orders, args.rate)
+
+    await fire_orders(run, base_url, store, order, args.orders, args.rate)
+    await asyncio.sleep(args.drain) # Chờ thông báo cuối cùng tới nơi
+    stop.set()
+    await asyncio.gather(*(connection.close() for connection in connections if connection is not None))
+    await asyncio.gather(*clients)
+
+    expected = len(run.created) * len(run.connected)
+    delivered = sum(len(run.received[index] & run.created) for index in run.connected)
+    latencies = sorted(run.latencies_ms)
+    return {
+        "clients": args.clients,
+        "connected": len(run.connected),
+        "connect_failures": run.connect_failures,
+        "connect_seconds": round(connect_seconds, 2),
+        "dropped_connections": run.dropped,
+        "orders_sent": args.orders,
+        "orders_created": len(run.created),
+        "orders_rejected": run.rejected,
+        "notifications_expected": expected,
+        "notifications_missed": max(0, expected - delivered),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 1), "p95": round(_percentile(latencies, 95), 1),
+            "p99": round(_percentile(latencies, 99), 1), "max": round(_percentile(latencies, 100), 1),
+        },
+        "server_rss_kb": {"before": rss_before, "connected": rss_connected} if server_pid else None,
+        "kb_per_connection": round((rss_connected - rss_before) / len(run.connected), 1) if server_pid and run.connected else None,
+    }
+
+
+def regressions(report: dict, args) -> list:
+    """Các ngưỡng bị vượt (rỗng = đạt)"""
+    checks = [
+        ("connect_failures", report["connect_failures"], args.max_connect_failures),
+        ("dropped_connections", report["dropped_connections"], args.max_dropped),
+        ("notifications_missed", report["notifications_missed"], args.max_missed),
+        ("latency_ms.p50", report["latency_ms"]["p50"], args.max_p50_ms),
+        ("latency_ms.p99", report["latency_ms"]["p99"], args.max_p99_ms),
+    ]
+    if report["kb_per_connection"] is not None:
+        checks.append(("kb_per_connection", report["kb_per_connection"], args.max_kb_per_connection))
+    failed = [f"{name} = {value} > {limit}" for name, value, limit in checks if value > limit]
+    if report["orders_created"] < report["orders_sent"]:
+        failed.append(f"orders_created = {report['orders_created']} < {report['orders_sent']} ({report['orders_rejected']})")
+    return failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Kiểm tra tải WebSocket thông báo đơn cho admin")
+    parser.add_argument("--clients", type=int, default=200, help="Số kết nối admin đồng thời")
+    parser.add_argument("--orders", type=int, default=100, help="Số đơn bắn vào")
+    parser.add_argument("--rate", type=float, default=10.0, help="Đơn / giây")
+    parser.add_argument("--store", default="default", help="Slug cửa hàng")
+    parser.add_argument("--admin-user", default="admin", help="Admin của cửa hàng (WebSocket cần token admin)")
+    parser.add_argument("--admin-password", default="admin")
+    parser.add_argument("--url", help="Server đang chạy (mặc định: tự chạy bootstrap.py)")
+    parser.add_argument("--server-pid", type=int, help="PID server của --url để đo RAM")
+    parser.add_argument("--workers", type=int, default=1, help="WEB_CONCURRENCY của server tự chạy")
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+    parser.add_argument("--settle", type=float, default=1.0, help="Giây chờ sau khi kết nối xong")
+    parser.add_argument("--drain", type=float, default=2.0, help="Giây chờ thông báo sau đơn cuối")
+    # Ngưỡng hồi quy
+    parser.add_argument("--max-p50-ms", type=float, default=100.0)
+    parser.add_argument("--max-p99-ms", type=float, default=1000.0)
+    parser.add_argument("--max-dropped", type=int, default=0)
+    parser.add_argument("--max-missed", type=int, default=0)
+    parser.add_argument("--max-connect-failures", type=int, default=0)
+    parser.add_argument("--max-kb-per-connection", type=float, default=256.0)
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.url:
+        base_url, server_pid = args.url.rstrip("/"), args.server_pid
+    else:
+        process, base_url = start_server(args.workers, args.rate)
+        server_pid = process.pid
+    try:
+        menu = wait_until_ready(base_url, args.store, process)
+        report = asyncio.run(run_load(args, base_url, menu, server_pid))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    failed = regressions(report, args)
+    report["regressions"] = failed
+    sys.stdout.write(json.dumps(report, ensure_ascii=False, indent=2) + "\n")
+    for reason in failed:
+        logger.error("Vượt ngưỡng: %s", reason)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import app_logging # Log ra stderr (LOG_FORMAT=text cho dễ đọc)
+    sys.exit(main())